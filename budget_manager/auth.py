@@ -0,0 +1,124 @@
+"""
+Cached request.user for AuthenticationMiddleware (see AUTH_USER_CACHE_TIMEOUT in settings).
+"""
+from functools import partial
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.core import checks
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+
+# Backends holding their entries in the worker process; invalidation would not
+# reach the other workers
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def _cache():
+    return caches[settings.AUTH_USER_CACHE_ALIAS]
+
+
+def _cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _session_user(user_id, backend):
+    """(user id, backend path) stored in a session, or None when it has no logged in user."""
+    if user_id is None or backend is None:
+        return None
+    return auth.get_user_model()._meta.pk.to_python(user_id), backend
+
+
+def _verified(session_hash, user):
+    # The check auth.get_user() runs against the database row, here against the
+    # cached user; a mismatch falls back to auth.get_user() for the full
+    # handling (fallback secret keys, flushing the session)
+    return session_hash and constant_time_compare(session_hash, user.get_session_auth_hash())
+
+
+def get_user(request):
+    if hasattr(request, '_cached_user'):
+        return request._cached_user
+    session = request.session
+    stored = _session_user(session.get(auth.SESSION_KEY), session.get(auth.BACKEND_SESSION_KEY))
+    if stored is None:
+        user = AnonymousUser()
+    elif not settings.AUTH_USER_CACHE_TIMEOUT or stored[1] not in settings.AUTHENTICATION_BACKENDS:
+        user = auth.get_user(request)
+    else:
+        user = _cache().get(_cache_key(stored[0]))
+        if user is None or not _verified(session.get(auth.HASH_SESSION_KEY), user):
+            user = auth.get_user(request)
+            if user.is_authenticated:
+                _cache().set(_cache_key(user.pk), user, settings.AUTH_USER_CACHE_TIMEOUT)
+    request._cached_user = user
+    return user
+
+
+async def auser(request):
+    if hasattr(request, '_acached_user'):
+        return request._acached_user
+    session = request.session
+    stored = _session_user(await session.aget(auth.SESSION_KEY), await session.aget(auth.BACKEND_SESSION_KEY))
+    if stored is None:
+        user = AnonymousUser()
+    elif not settings.AUTH_USER_CACHE_TIMEOUT or stored[1] not in settings.AUTHENTICATION_BACKENDS:
+        user = await auth.aget_user(request)
+    else:
+        user = await _cache().aget(_cache_key(stored[0]))
+        if user is None or not _verified(await session.aget(auth.HASH_SESSION_KEY), user):
+            user = await auth.aget_user(request)
+            if user.is_authenticated:
+                await _cache().aset(_cache_key(user.pk), user, settings.AUTH_USER_CACHE_TIMEOUT)
+    request._acached_user = user
+    return user
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """System check: caching request.user needs a cache every worker shares."""
+    if not settings.AUTH_USER_CACHE_TIMEOUT:
+        return []
+    backend = settings.CACHES.get(settings.AUTH_USER_CACHE_ALIAS, {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [checks.Error(
+        f"AUTH_USER_CACHE_TIMEOUT needs a cache shared by all workers, but the "
+        f"'{settings.AUTH_USER_CACHE_ALIAS}' cache uses {backend}.",
+        hint="Point it at Redis, Memcached, the database or the file system, or set AUTH_USER_CACHE_TIMEOUT=0.",
+        id='budget_manager.E001',
+    )]
+
+
+def forget_user(user_id):
+    _cache().delete(_cache_key(user_id))
+
+
+def forget_saved_user(sender, instance, **kwargs):
+    """post_save/post_delete handler: a changed password, flag or deletion must be seen at once."""
+    forget_user(instance.pk)
+
+
+def forget_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    AuthenticationMiddleware serving request.user from the cache.
+
+    The user row is cached for AUTH_USER_CACHE_TIMEOUT seconds after a
+    successful lookup and dropped when the user is saved or deleted and on
+    logout. The session auth hash is still checked on every request, so a
+    password change or deactivation ends other sessions at once; a cache shared
+    by all workers is required for that (see check_shared_cache).
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        request.auser = partial(auser, request)
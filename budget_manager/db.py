@@ -0,0 +1,43 @@
+"""
+Database helpers for the production SQLite profile (see DATABASE_PROFILE in settings).
+"""
+from django.db import connections
+
+WRITE_ALIAS = 'default'
+READ_ALIAS = 'replica'
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """connection_created handler running the PRAGMAS configured for the alias."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = connection.settings_dict.get('PRAGMAS') or {}
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+class ReadWriteRouter:
+    """
+    Send writes to the default connection and reads to the query-only replica.
+
+    Both aliases point at the same SQLite file; in WAL mode readers never block
+    the writer. Reads issued while the write connection has an open transaction
+    stay on it so they see that transaction's own uncommitted changes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if connections[WRITE_ALIAS].in_atomic_block:
+            return WRITE_ALIAS
+        return READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return WRITE_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == WRITE_ALIAS
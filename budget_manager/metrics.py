@@ -0,0 +1,195 @@
+"""
+Per-process request metrics collected by budget_manager.middleware and served
+in the Prometheus text format by metrics_view.
+
+Histograms are sharded per thread: each thread only ever increments its own
+list of bucket counters, so recording a request takes no lock. A scrape sums
+the shards; a sample taken while another thread is mid-update may be off by
+that one observation, which is fine for monitoring. Shards of threads that
+have ended are folded into a base shard, so servers starting a thread per
+request do not grow the list forever. Every worker process keeps
+its own numbers, so scrape each worker (or aggregate them in Prometheus).
+"""
+import threading
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the histogram buckets; +Inf is implied
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Cumulative histogram with one counter shard per thread."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # [count per bucket..., count above the last bucket, sum of values]
+        self._base = self._new_shard()
+        self._shards = []  # (thread, shard) of every thread that observed a value
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _new_shard(self):
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self._new_shard()
+            with self._lock:
+                self._prune()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _prune(self):
+        # A thread that has ended never touches its shard again; call with the lock held
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for position, value in enumerate(shard):
+                    self._base[position] += value
+        self._shards = alive
+
+    def observe(self, value):
+        shard = self._shard()
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        shard[index] += 1
+        shard[-1] += value
+
+    def snapshot(self):
+        """Return (cumulative counts per bucket including +Inf, total count, sum)."""
+        with self._lock:
+            self._prune()
+            shards = [self._base] + [shard for _, shard in self._shards]
+        totals = [0] * (len(self.buckets) + 2)
+        for shard in shards:
+            for position, value in enumerate(shard):
+                totals[position] += value
+        cumulative = []
+        running = 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, running, totals[-1]
+
+
+class HistogramFamily:
+    """Histograms of one metric keyed by a single label value."""
+
+    def __init__(self, name, help_text, label, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._children = {}
+
+    def labels(self, value):
+        child = self._children.get(value)
+        if child is None:
+            # setdefault is atomic, so two threads racing here share one histogram
+            child = self._children.setdefault(value, Histogram(self.buckets))
+        return child
+
+    def clear(self):
+        self._children = {}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for value, histogram in sorted(self._children.items()):
+            label = f'{self.label}="{escape_label(value)}"'
+            cumulative, count, total = histogram.snapshot()
+            bounds = [format_number(bound) for bound in self.buckets] + ['+Inf']
+            for bound, bucket_count in zip(bounds, cumulative):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_sum{{{label}}} {format_number(total)}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return '\n'.join(lines)
+
+
+class CounterFamily:
+    """Counters of one metric keyed by a single label value."""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value, amount=1):
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + amount
+
+    def get(self, value):
+        return self._values.get(value, 0)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for value, count in sorted(self._values.items()):
+            lines.append(f'{self.name}{{{self.label}="{escape_label(value)}"}} {count}')
+        return '\n'.join(lines)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REQUEST_DURATION = HistogramFamily(
+    'django_request_duration_seconds', 'Wall time spent handling a request.', 'view', DURATION_BUCKETS,
+)
+REQUEST_QUERIES = HistogramFamily(
+    'django_request_db_queries', 'Database queries issued while handling a request.', 'view', QUERY_BUCKETS,
+)
+REQUEST_DB_DURATION = HistogramFamily(
+    'django_request_db_duration_seconds', 'Time spent in database queries while handling a request.', 'view',
+    DURATION_BUCKETS,
+)
+FAMILIES = [REQUEST_DURATION, REQUEST_QUERIES, REQUEST_DB_DURATION]
+
+
+def register(family):
+    """Serve a metric family of another module at /metrics/ too; returns it."""
+    FAMILIES.append(family)
+    return family
+
+
+def observe_request(view, duration, queries, db_duration):
+    REQUEST_DURATION.labels(view).observe(duration)
+    REQUEST_QUERIES.labels(view).observe(queries)
+    REQUEST_DB_DURATION.labels(view).observe(db_duration)
+
+
+def reset():
+    for family in FAMILIES:
+        family.clear()
+
+
+def render():
+    return '\n'.join(family.render() for family in FAMILIES) + '\n'
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint for staff users, and INTERNAL_IPS with METRICS_ALLOW_INTERNAL_IPS."""
+    internal = settings.METRICS_ALLOW_INTERNAL_IPS and request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS
+    if not internal and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
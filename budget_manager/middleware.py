@@ -0,0 +1,104 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+slow_request_logger = logging.getLogger('budget_manager.slow_requests')
+
+UNRESOLVED = '<unresolved>'
+
+
+class QueryRecorder:
+    """Database execute wrapper counting queries and their time, optionally keeping the SQL."""
+
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_sql = keep_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if self.keep_sql and len(self.statements) < settings.METRICS_SLOW_REQUEST_MAX_QUERIES:
+                self.statements.append((elapsed, sql))
+
+
+class RequestMetricsMiddleware:
+    """
+    Record wall time, query count and query time of every request under the
+    name of the URL pattern it resolved to (see budget_manager.metrics).
+
+    With METRICS_SLOW_REQUEST_MS set, requests slower than that are logged to
+    the 'budget_manager.slow_requests' logger together with the SQL they ran.
+    Being first in MIDDLEWARE, it is async-capable so that under ASGI the
+    chain and the async views are not adapted to sync.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _recording(self, recorder):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        recorder = QueryRecorder(keep_sql=settings.METRICS_SLOW_REQUEST_MS is not None)
+        with self._recording(recorder):
+            started = time.perf_counter()
+            response = self.get_response(request)
+            duration = time.perf_counter() - started
+        self.record(request, response, duration, recorder)
+        return response
+
+    async def __acall__(self, request):
+        # Connections are per thread and the ORM calls of async views run in
+        # the request's thread-sensitive thread, so wrap the connections there
+        recorder = QueryRecorder(keep_sql=settings.METRICS_SLOW_REQUEST_MS is not None)
+        recording = await sync_to_async(self._recording)(recorder)
+        try:
+            started = time.perf_counter()
+            response = await self.get_response(request)
+            duration = time.perf_counter() - started
+        finally:
+            await sync_to_async(recording.close)()
+        self.record(request, response, duration, recorder)
+        return response
+
+    def record(self, request, response, duration, recorder):
+        threshold = settings.METRICS_SLOW_REQUEST_MS
+        match = request.resolver_match
+        view = match.view_name if match else UNRESOLVED
+        metrics.observe_request(view, duration, recorder.count, recorder.duration)
+        if threshold is not None and duration * 1000 >= threshold:
+            self.log_slow_request(request, view, response, duration, recorder)
+
+    def log_slow_request(self, request, view, response, duration, recorder):
+        statements = '\n'.join(f'  {elapsed * 1000:.1f} ms  {sql}' for elapsed, sql in recorder.statements)
+        if recorder.count > len(recorder.statements):
+            statements += f'\n  ... {recorder.count - len(recorder.statements)} more'
+        slow_request_logger.warning(
+            '%s %s (%s) took %.1f ms with %d queries in %.1f ms\n%s',
+            request.method, request.path, view, duration * 1000, recorder.count, recorder.duration * 1000,
+            statements,
+            extra={'request': request, 'status_code': response.status_code},
+        )
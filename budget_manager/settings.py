@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from django.contrib.messages import constants as messages
 
@@ -46,11 +47,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'budget_manager.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'budget_manager.auth.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
@@ -83,10 +85,89 @@ WSGI_APPLICATION = 'budget_manager.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# DATABASE_PROFILE=production tunes SQLite for several concurrent workers:
+# WAL journal and connection pragmas (applied by budget_manager.db on every new
+# connection), persistent connections, IMMEDIATE write transactions so writers
+# queue on the busy timeout instead of failing with "database is locked", and a
+# separate query-only connection for reads outside transactions.
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'development')
+
+if DATABASE_PROFILE == 'production':
+    SQLITE_TIMEOUT = int(os.environ.get('SQLITE_TIMEOUT', 20))
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': SQLITE_TIMEOUT * 1000,
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', 64 * 1024)),
+        'temp_store': 'MEMORY',
+    }
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'timeout': SQLITE_TIMEOUT, 'transaction_mode': 'IMMEDIATE'},
+        'PRAGMAS': SQLITE_PRAGMAS,
+    })
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'OPTIONS': {'timeout': SQLITE_TIMEOUT},
+        'PRAGMAS': {**SQLITE_PRAGMAS, 'query_only': 'ON'},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['budget_manager.db.ReadWriteRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The expense aggregates cache only relies on get/set, so the file based or
+# database backends can be used to share it between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+EXPENSES_CACHE_ALIAS = 'default'
+EXPENSES_CACHE_TIMEOUT = 60 * 60
+
+
+# Sessions and the logged in user
+# SESSION_STORE=cached_db reads sessions from the cache and writes them through
+# to the database; signed_cookies keeps them in the cookie with no server side
+# lookup at all. Both only pay off with a cache shared by all workers (the
+# locmem default is per process). request.user is cached for
+# AUTH_USER_CACHE_TIMEOUT seconds, 0 (the default) disables it; it is dropped
+# on every save of the user and on logout, which only reaches every worker
+# through a shared cache, so a locmem cache fails the system checks.
+
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[os.environ.get('SESSION_STORE', 'db')]
+
+AUTH_USER_CACHE_ALIAS = 'default'
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', 0))
+
+
+# Request metrics
+# Per-view latency and query histograms are served at /metrics/ to staff users.
+# METRICS_ALLOW_INTERNAL_IPS=1 also serves them to INTERNAL_IPS without a login,
+# for a local scraper; behind a reverse proxy on the same host every client
+# comes from the proxy's address, so leave it off there. Set
+# METRICS_SLOW_REQUEST_MS to log the SQL of slower requests.
+
+INTERNAL_IPS = ['127.0.0.1']
+METRICS_ALLOW_INTERNAL_IPS = os.environ.get('METRICS_ALLOW_INTERNAL_IPS', '0') == '1'
+
+METRICS_SLOW_REQUEST_MS = int(os.environ['METRICS_SLOW_REQUEST_MS']) if os.environ.get('METRICS_SLOW_REQUEST_MS') else None
+METRICS_SLOW_REQUEST_MAX_QUERIES = 100
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -127,6 +208,11 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
+# Uploaded and generated files, i.e. report job results. They are only served
+# through the login-protected download view, so there is no MEDIA_URL.
+
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', BASE_DIR / 'media')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -140,3 +226,24 @@ AUTHENTICATION_BACKENDS = [
 SITE_ID = 1
 LOGIN_REDIRECT_URL = '/expenses/'
 
+# Number of expenses shown per page of the keyset-paginated expense list
+EXPENSES_PAGE_SIZE = 50
+
+# Maximum (and default) number of changes returned per page of the sync change feed
+EXPENSES_CHANGES_PAGE_SIZE = 1000
+
+# Rows inserted per bulk_create/transaction by the CSV / JSON Lines importer
+EXPENSES_IMPORT_BATCH_SIZE = 1000
+
+# Rows fetched per database round trip when streaming exports
+EXPENSES_EXPORT_CHUNK_SIZE = 2000
+
+# Seconds after which a running report job is assumed lost with its worker and queued again
+EXPENSES_REPORT_JOB_TIMEOUT = 60 * 60
+
+# Currency totals are reported in unless the user picks another one
+EXPENSES_BASE_CURRENCY = 'PLN'
+
+# Size of the in-process LRU cache of (currency pair, date) exchange rate lookups, keyed on the
+# shared ExchangeRateVersion so rates changed by any process are seen at once
+EXPENSES_RATE_CACHE_SIZE = 4096
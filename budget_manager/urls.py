@@ -19,6 +19,7 @@ from django.urls import path, include
 from django.contrib.auth.views import LogoutView
 from django.contrib import messages
 from expenses.views import custom_logout, home
+from budget_manager.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,5 +27,6 @@ urlpatterns = [
     path('accounts/', include('django.contrib.auth.urls')),
     path('accounts/', include('allauth.urls')),
     path('accounts/logout/', custom_logout, name='account_logout'),
+    path('metrics/', metrics_view, name='metrics'),
     path('', home, name='home'),
 ]
@@ -1,3 +1,147 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.core.paginator import Paginator
+from django.db import connections
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
 
-# Register your models here.
+from .bulk import delete_expenses, reassign_category
+from .models import Category, Expense, MonthlyTotal
+
+# Below this many rows an exact COUNT(*) is cheap and statistics may be stale
+ESTIMATE_MIN_ROWS = 10000
+
+
+def estimated_count(model, using):
+    """Row count of model's table from the planner statistics, or None without them."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        elif connection.vendor == 'sqlite':
+            # Filled by ANALYZE or PRAGMA optimize; the first number of every row is the table size
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    count = int(str(row[0]).split()[0])
+    return count if count >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator reading the size of an unfiltered changelist from the database
+    statistics instead of a COUNT(*) over the whole table.
+
+    Filtered lists are still counted exactly; their filters can use indexes.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATE_MIN_ROWS:
+                return estimate
+        return super().count
+
+
+class CurrencyFilter(admin.SimpleListFilter):
+    # Choices come from the rollup, which is far smaller than the expense table
+    title = 'currency'
+    parameter_name = 'currency'
+
+    def lookups(self, request, model_admin):
+        currencies = MonthlyTotal.objects.values_list('currency', flat=True).distinct().order_by('currency')
+        return [(currency, currency) for currency in currencies]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(currency=self.value())
+        return queryset
+
+
+class CategoryFilter(admin.SimpleListFilter):
+    # Categories are per user, so choices are offered once the list is narrowed to one user
+    title = 'category'
+    parameter_name = 'category'
+
+    def lookups(self, request, model_admin):
+        user_id = request.GET.get('user__id__exact')
+        if not (user_id and user_id.isdigit()):
+            return []
+        names = Category.objects.filter(user_id=user_id).values_list('name', flat=True).order_by('name')
+        return [(name, name) for name in names]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(category=self.value())
+        return queryset
+
+
+class CategoryActionForm(forms.Form):
+    category = forms.CharField(max_length=255)
+
+
+@admin.register(Expense)
+class ExpenseAdmin(admin.ModelAdmin):
+    """
+    Expense admin meant to stay fast on tables with millions of rows: no
+    exact count of the whole table, no SELECT DISTINCT over it for filter
+    choices, and bulk actions that run as single UPDATE/DELETE statements.
+    """
+    list_display = ('title', 'amount', 'currency', 'category', 'date', 'user')
+    list_select_related = ('user',)
+    list_filter = (CurrencyFilter, CategoryFilter, ('recurring', admin.EmptyFieldListFilter))
+    date_hierarchy = 'date'
+    ordering = ('-date', '-id')
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username',)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ('move_to_category', 'delete_in_bulk')
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # Replaced by delete_in_bulk; the stock action saves each object separately
+        actions.pop('delete_selected', None)
+        return actions
+
+    def bulk_action_response(self, request, queryset, action, title, form=None):
+        return TemplateResponse(request, 'admin/expenses/expense/bulk_action.html', {
+            **self.admin_site.each_context(request),
+            'title': title,
+            'opts': self.model._meta,
+            'action': action,
+            'form': form,
+            'count': queryset.count(),
+            'select_across': request.POST.get('select_across') == '1',
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        })
+
+    @admin.action(description='Move selected expenses to another category', permissions=['change'])
+    def move_to_category(self, request, queryset):
+        form = CategoryActionForm(request.POST if 'apply' in request.POST else None)
+        if not form.is_valid():
+            return self.bulk_action_response(request, queryset, 'move_to_category', 'Move expenses to another category', form)
+        moved = reassign_category(queryset, form.cleaned_data['category'])
+        self.message_user(request, f'Moved {moved} expenses to {form.cleaned_data["category"]}.', messages.SUCCESS)
+
+    @admin.action(description='Delete selected expenses in one statement', permissions=['delete'])
+    def delete_in_bulk(self, request, queryset):
+        if 'apply' not in request.POST:
+            return self.bulk_action_response(request, queryset, 'delete_in_bulk', 'Delete expenses')
+        deleted = delete_expenses(queryset)
+        self.message_user(request, f'Deleted {deleted} expenses.', messages.SUCCESS)
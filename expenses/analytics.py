@@ -0,0 +1,174 @@
+"""
+Vectorized spending analytics for the Insights page.
+
+A user's expenses are read with one values_list() query into column arrays;
+everything after that is NumPy array arithmetic. The only Python loops run
+over distinct (month, currency) pairs for exchange rates and over categories
+when building the response, never over expense rows.
+"""
+from datetime import date
+
+import numpy as np
+
+from .archives import archived_rollup_rows
+from .currency import get_rate, month_end
+from .models import Expense
+from .money import exponent
+
+PERCENTILES = (50, 90)
+RECENT_MONTHS = 12
+
+
+def load_columns(user):
+    """
+    Return (months, amounts in minor units, currencies, categories) arrays, or None without expenses.
+
+    Archived years contribute one row per month, category and currency; all
+    analytics aggregate by month first, so that gives the same results.
+    """
+    rows = list(Expense.objects.filter(user=user).values_list('date', 'amount_minor', 'currency', 'category'))
+    rows += [
+        (row['month'], row['total_minor'], row['currency'], row['category'])
+        for row in archived_rollup_rows([user.pk])
+    ]
+    if not rows:
+        return None
+    dates, amounts, currencies, categories = zip(*rows)
+    return (
+        np.array(dates, dtype='datetime64[M]'),
+        np.array(amounts, dtype=np.float64),
+        np.array(currencies),
+        np.array(categories),
+    )
+
+
+def conversion_factors(months, currencies, target):
+    """
+    Per-row factor turning minor units into target currency units (NaN without
+    a rate), and the sorted currencies that had no rate.
+
+    Rates are looked up once per distinct (month, currency) pair with the rate
+    in force at the end of that month, like the monthly totals.
+    """
+    codes, currency_index = np.unique(currencies, return_inverse=True)
+    month_values, month_index = np.unique(months, return_inverse=True)
+    pairs, pair_index = np.unique(month_index * len(codes) + currency_index, return_inverse=True)
+    factors = np.empty(len(pairs))
+    for position, pair in enumerate(pairs):
+        month = month_values[pair // len(codes)].astype(object)
+        code = str(codes[pair % len(codes)])
+        rate = get_rate(code, target, month_end(month))
+        factors[position] = np.nan if rate is None else float(rate) / 10 ** exponent(code)
+    missing = sorted({str(codes[pair % len(codes)]) for pair in pairs[np.isnan(factors)]})
+    return factors[pair_index], missing
+
+
+def rolling_mean(series, window):
+    """Trailing mean over window values; NaN until the window is full."""
+    result = np.full(len(series), np.nan)
+    if len(series) >= window:
+        cumulative = np.concatenate(([0.0], np.cumsum(series)))
+        result[window - 1:] = (cumulative[window:] - cumulative[:-window]) / window
+    return result
+
+
+def growth_rates(matrix):
+    """Month-over-month change in percent along the last axis; NaN where the previous month is zero."""
+    previous, current = matrix[..., :-1], matrix[..., 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.where(previous > 0, (current - previous) / previous * 100, np.nan)
+    return np.concatenate((np.full(matrix.shape[:-1] + (1,), np.nan), growth), axis=-1)
+
+
+def seasonal_forecast(history, first_month, months_ahead):
+    """
+    Forecast the next months_ahead months after history.
+
+    The level is the mean of the last twelve months and each calendar month is
+    scaled by how it compared to the average month over the whole history
+    (its seasonal index). Without a full year of history the forecast is flat.
+    """
+    if not len(history) or not months_ahead:
+        return np.zeros(months_ahead)
+    calendar_months = (first_month + np.arange(len(history))).astype(int) % 12
+    level = history[-RECENT_MONTHS:].mean()
+    seasonal = np.ones(12)
+    if len(history) >= 12:
+        counts = np.bincount(calendar_months, minlength=12)
+        means = np.bincount(calendar_months, weights=history, minlength=12) / np.maximum(counts, 1)
+        average = means[counts > 0].mean()
+        if average > 0:
+            seasonal = np.where(counts > 0, means / average, 1.0)
+    future = (first_month + len(history) + np.arange(months_ahead)).astype(int) % 12
+    return level * seasonal[future]
+
+
+def _json(values):
+    return [None if np.isnan(value) else round(float(value), 2) for value in values]
+
+
+def compute_insights(user, currency, today=None):
+    """
+    Analytics of a user's spending converted into currency, as JSON-ready data.
+
+    Months are complete months before today's; the current month is only used
+    for the year-to-date actuals of the forecast.
+    """
+    today = today or date.today()
+    current = np.datetime64(today, 'M')
+    result = {
+        'currency': currency, 'months': [], 'totals': [], 'rolling_3': [], 'rolling_12': [],
+        'categories': [], 'forecast': [], 'year_to_date': 0.0, 'projected_year_total': 0.0, 'missing_rates': [],
+    }
+    columns = load_columns(user)
+    if columns is None:
+        return result
+    months, amounts, currencies, categories = columns
+    factors, result['missing_rates'] = conversion_factors(months, currencies, currency)
+    values = amounts * factors
+    known = ~np.isnan(values)
+
+    first = months.min()
+    span = int((max(months.max(), current) - first).astype(int)) + 1
+    month_index = (months - first).astype(int)
+    names, category_index = np.unique(categories, return_inverse=True)
+    matrix = np.bincount(
+        category_index[known] * span + month_index[known], weights=values[known], minlength=len(names) * span,
+    ).reshape(len(names), span)
+    totals = matrix.sum(axis=0)
+
+    complete = max(int((current - first).astype(int)), 0)  # months before the current one
+    history = totals[:complete]
+    recent = slice(max(len(history) - RECENT_MONTHS, 0), len(history))
+    labels = (first + np.arange(span)).astype(str)
+    result['months'] = labels[recent].tolist()
+    result['totals'] = _json(history[recent])
+    result['rolling_3'] = _json(rolling_mean(history, 3)[recent])
+    result['rolling_12'] = _json(rolling_mean(history, 12)[recent])
+
+    category_history = matrix[:, :len(history)]
+    growth = growth_rates(category_history)
+    if len(history):
+        percentiles = np.percentile(category_history, PERCENTILES, axis=1)
+    else:
+        percentiles = np.full((len(PERCENTILES), len(names)), np.nan)
+    for position, name in enumerate(names.tolist()):
+        result['categories'].append({
+            'name': name,
+            'growth': _json(growth[position, recent]),
+            'last_growth': _json(growth[position, -1:])[0] if len(history) else None,
+            'percentiles': dict(zip((f'p{value}' for value in PERCENTILES), _json(percentiles[:, position]))),
+        })
+
+    # Rest of the current year, from the current month on
+    year_start = max(int((np.datetime64(date(today.year, 1, 1), 'M') - first).astype(int)), 0)
+    ahead = 12 - (today.month - 1)
+    forecast = seasonal_forecast(history, first.astype(int), ahead)
+    result['forecast'] = [
+        {'month': month, 'amount': amount}
+        for month, amount in zip((current + np.arange(ahead)).astype(str).tolist(), _json(forecast))
+    ]
+    year_end = complete + 1 if current >= first else 0
+    result['year_to_date'] = round(float(totals[year_start:year_end].sum()), 2)
+    result['projected_year_total'] = round(float(history[year_start:].sum() + forecast.sum()), 2)
+    return result
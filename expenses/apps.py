@@ -4,3 +4,22 @@ from django.apps import AppConfig
 class ExpensesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'expenses'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model, user_logged_out
+        from django.core import checks
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_migrate, post_save
+
+        from budget_manager.auth import check_shared_cache, forget_logged_out_user, forget_saved_user
+        from budget_manager.db import apply_sqlite_pragmas
+        from . import signals  # noqa: F401
+        from .search import repair_search_triggers
+
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='budget_manager.sqlite_pragmas')
+        User = get_user_model()
+        post_save.connect(forget_saved_user, sender=User, dispatch_uid='budget_manager.auth.saved_user')
+        post_delete.connect(forget_saved_user, sender=User, dispatch_uid='budget_manager.auth.deleted_user')
+        user_logged_out.connect(forget_logged_out_user, dispatch_uid='budget_manager.auth.logged_out_user')
+        checks.register(check_shared_cache, checks.Tags.caches)
+        post_migrate.connect(repair_search_triggers, sender=self, dispatch_uid='expenses.search_triggers')
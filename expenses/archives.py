@@ -0,0 +1,285 @@
+import json
+import uuid
+import zlib
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from datetime import date, timedelta
+from itertools import accumulate
+
+from django.db import connections, router, transaction
+
+from .categories import category_key, resolve_category
+from .changes import record_queryset
+from .models import ArchivedClientId, Category, Expense, ExpenseArchive, ExpenseChange, RecurringExpense
+from .money import from_minor
+from .pagination import decode_cursor
+from .recurring import insert_expenses
+from .rollups import bump_versions
+
+# Expenses of closed years are moved out of the Expense table into one
+# ExpenseArchive row per user and year: the rows as zlib-compressed JSON
+# columns, plus their month and category totals. The MonthlyTotal rollup is
+# left as it was, so totals, charts and the year selector never notice; the
+# totals stored with an archive cover what the rollup does not (category
+# totals, insights) and only listings and exports decode the rows.
+FORMAT = 1
+COLUMNS = (
+    'id', 'date', 'title', 'amount_minor', 'category', 'currency', 'category_ref_id', 'recurring_id', 'occurrence',
+    'client_id',
+)
+# Stored once per archive and referred to by position; titles repeat a lot
+# in recurring and imported expenses
+DICTIONARY_COLUMNS = ('title', 'category', 'currency')
+DATE_COLUMNS = ('date', 'occurrence')
+
+
+class ArchivedExpense(namedtuple('ArchivedExpense', ('user_id',) + COLUMNS)):
+    """Read-only stand-in for an archived Expense in listings and exports."""
+    __slots__ = ()
+    archived = True
+
+    @property
+    def amount(self):
+        return from_minor(self.amount_minor, self.currency)
+
+
+def encode(rows, year):
+    """Compress expense rows of one year, dicts of COLUMNS, into archive data."""
+    rows = sorted(rows, key=lambda row: (row['date'], row['id']))
+    first = date(year, 1, 1).toordinal()
+    columns = {'format': FORMAT}
+    for name in COLUMNS:
+        values = [row[name] for row in rows]
+        if name in DATE_COLUMNS:
+            # Days since Jan 1 instead of ISO strings
+            values = [None if day is None else day.toordinal() - first for day in values]
+        elif name == 'client_id':
+            values = [None if value is None else value.hex for value in values]
+        elif name in DICTIONARY_COLUMNS:
+            codes = {value: index for index, value in enumerate(dict.fromkeys(values))}
+            values = {'values': list(codes), 'codes': [codes[value] for value in values]}
+        elif name == 'id':
+            # Ids mostly grow with the date, so the differences stay small
+            values = [current - previous for previous, current in zip([0] + values, values)]
+        columns[name] = values
+    return zlib.compress(json.dumps(columns, separators=(',', ':')).encode(), 9)
+
+
+def _columns(archive):
+    """Columns of an archive with ids and dates as plain integers (days since Jan 1)."""
+    columns = json.loads(zlib.decompress(bytes(archive.data)))
+    if columns['format'] != FORMAT:
+        raise ValueError(f"Unknown expense archive format {columns['format']}.")
+    columns['id'] = list(accumulate(columns['id']))
+    return columns
+
+
+def _expenses(archive, columns, positions):
+    """ArchivedExpense objects of the rows at positions, built only for those rows."""
+    first = date(archive.year, 1, 1).toordinal()
+    expenses = []
+    for position in positions:
+        row = {}
+        for name in COLUMNS:
+            value = columns[name]
+            if name in DICTIONARY_COLUMNS:
+                value = value['values'][value['codes'][position]]
+            else:
+                value = value[position]
+                if value is not None and name in DATE_COLUMNS:
+                    value = date.fromordinal(first + value)
+                elif value is not None and name == 'client_id':
+                    value = uuid.UUID(value)
+            row[name] = value
+        expenses.append(ArchivedExpense(archive.user_id, **row))
+    return expenses
+
+
+def decode(archive):
+    """ArchivedExpense rows of an ExpenseArchive, ordered by (date, id)."""
+    columns = _columns(archive)
+    return _expenses(archive, columns, range(len(columns['id'])))
+
+
+def compute_totals(rows):
+    """
+    Totals stored with an archive: 'months' holds [month, category, currency,
+    total_minor, count] like MonthlyTotal, 'categories' holds [category_ref_id,
+    category, month, currency, sum_minor] like category_rows().
+    """
+    months = defaultdict(lambda: [0, 0])
+    categories = defaultdict(int)
+    for row in rows:
+        month = row['date'].replace(day=1).isoformat()
+        entry = months[(month, row['category'], row['currency'])]
+        entry[0] += row['amount_minor']
+        entry[1] += 1
+        categories[(row['category_ref_id'], row['category'], month, row['currency'])] += row['amount_minor']
+    return {
+        'months': [[*key, total, count] for key, (total, count) in sorted(months.items())],
+        'categories': [[*key, total] for key, total in sorted(categories.items(), key=str)],
+    }
+
+
+def _row(expense):
+    return {name: getattr(expense, name) for name in COLUMNS}
+
+
+def archive_year(user_id, year):
+    """
+    Move a user's expenses of year from the Expense table into the year's
+    archive, merged with what was archived before; returns how many moved.
+
+    The rows leave the change feed without tombstones, so sync clients keep
+    their copies; their client_ids are recorded as ArchivedClientId rows, so
+    sync refuses to change them. The MonthlyTotal rollup is not touched: the
+    totals do not change, the rows are only stored elsewhere.
+    """
+    start, end = date(year, 1, 1), date(year + 1, 1, 1)
+    queryset = Expense.objects.filter(user_id=user_id, date__gte=start, date__lt=end).order_by()
+    with transaction.atomic():
+        rows = list(queryset.values(*COLUMNS))
+        if not rows:
+            return 0
+        archive = ExpenseArchive.objects.select_for_update().filter(user_id=user_id, year=year).first()
+        if archive is not None:
+            rows += [_row(expense) for expense in decode(archive)]
+        archive, _ = ExpenseArchive.objects.update_or_create(
+            user_id=user_id, year=year,
+            defaults={'row_count': len(rows), 'data': encode(rows, year), 'totals': compute_totals(rows)},
+        )
+        # Rows merged from the previous archive already have theirs
+        ArchivedClientId.objects.bulk_create([
+            ArchivedClientId(user_id=user_id, archive=archive, client_id=row['client_id'])
+            for row in rows if row['client_id'] is not None
+        ], ignore_conflicts=True)
+        ExpenseChange.objects.filter(user_id=user_id, expense_id__in=queryset.values('pk')).delete()
+        moved = queryset._raw_delete(queryset.db)
+        bump_versions([user_id])
+    return moved
+
+
+def unarchive_year(user_id, year):
+    """
+    Put an archived year's expenses back into the Expense table under their
+    old ids, e.g. to correct them; returns how many were restored.
+
+    Links that went stale meanwhile are dropped: a deleted category is
+    created again by name, and a deleted recurring rule, an occurrence
+    generated again or a client_id taken by a newer expense are cleared.
+    """
+    using = router.db_for_write(Expense)
+    with transaction.atomic(using=using):
+        archive = ExpenseArchive.objects.select_for_update().filter(user_id=user_id, year=year).first()
+        if archive is None:
+            return 0
+        rows = [_row(expense) for expense in decode(archive)]
+        categories = set(Category.objects.filter(user_id=user_id).values_list('pk', flat=True))
+        rules = set(RecurringExpense.objects.filter(user_id=user_id).values_list('pk', flat=True))
+        occurrences = set(
+            Expense.objects.filter(recurring_id__in=rules, occurrence__isnull=False).values_list('recurring_id', 'occurrence')
+        )
+        client_ids = set(
+            Expense.objects.filter(user_id=user_id, client_id__isnull=False).values_list('client_id', flat=True)
+        )
+        client_id_field = Expense._meta.get_field('client_id')
+        connection = connections[using]
+        for row in rows:
+            row['user_id'] = user_id
+            if row['category_ref_id'] not in categories:
+                row['category_ref_id'], row['category'] = resolve_category(user_id, row['category'])
+                categories.add(row['category_ref_id'])
+            if row['recurring_id'] not in rules or (row['recurring_id'], row['occurrence']) in occurrences:
+                row['recurring_id'] = row['occurrence'] = None
+            if row['client_id'] in client_ids:
+                row['client_id'] = None
+            row['client_id'] = client_id_field.get_db_prep_value(row['client_id'], connection)
+        # The search index triggers pick the rows up like any other INSERT
+        insert_expenses(rows, using, fields=('user_id',) + COLUMNS)
+        record_queryset(Expense.objects.using(using).filter(pk__in=[row['id'] for row in rows]), replace=False)
+        # Takes its ArchivedClientId rows along
+        archive.delete()
+        bump_versions([user_id])
+    return len(rows)
+
+
+def _archives(user_ids, start, last):
+    """Archives of the users (all without user_ids) overlapping the dates start to last, where None is open."""
+    archives = ExpenseArchive.objects.all()
+    if user_ids is not None:
+        archives = archives.filter(user_id__in=user_ids)
+    if start:
+        archives = archives.filter(year__gte=start.year)
+    if last:
+        archives = archives.filter(year__lte=last.year)
+    return archives
+
+
+def archived_years(user_id):
+    return list(ExpenseArchive.objects.filter(user_id=user_id).order_by('year').values_list('year', flat=True))
+
+
+def archived_expenses(user_ids=None, start=None, end=None, category=None, currency=None):
+    """
+    ArchivedExpense rows matching the filters of exporters.filter_expenses(),
+    end included, ordered by (user_id, date, id); one archive is decoded at a time.
+    """
+    key = category and category_key(category)
+    for archive in _archives(user_ids, start, end).order_by('user_id', 'year').iterator(chunk_size=1):
+        for expense in decode(archive):
+            if start and expense.date < start or end and expense.date > end:
+                continue
+            if key and category_key(expense.category) != key or currency and expense.currency != currency:
+                continue
+            yield expense
+
+
+def archived_page(user_id, year, after, page_size):
+    """
+    Archived expenses of a year that can make it into the keyset_page() page
+    after the cursor after: the page_size + 1 newest older than the cursor.
+    Only those rows are built from the decoded columns.
+    """
+    archive = ExpenseArchive.objects.filter(user_id=user_id, year=year).first()
+    if archive is None:
+        return []
+    columns = _columns(archive)
+    end = len(columns['id'])
+    cursor = decode_cursor(after)
+    if cursor:
+        days = (cursor[0] - date(year, 1, 1)).days
+        end = bisect_left(list(zip(columns['date'], columns['id'])), (days, cursor[1]))
+    return _expenses(archive, columns, reversed(range(max(end - page_size - 1, 0), end)))
+
+
+def archived_rollup_rows(user_ids, start=None, end=None):
+    """Month totals of archived expenses as rollup_rows() dicts, for months in [start, end)."""
+    rows = []
+    last = end and end - timedelta(days=1)
+    for user_id, totals in _archives(user_ids, start, last).values_list('user_id', 'totals'):
+        for month, category, currency, total_minor, count in totals['months']:
+            month = date.fromisoformat(month)
+            if (not start or month >= start) and (not end or month < end):
+                rows.append({
+                    'user_id': user_id, 'month': month, 'category': category, 'currency': currency,
+                    'total_minor': total_minor, 'count': count,
+                })
+    return rows
+
+
+def archived_category_rows(user, start, end):
+    """category_rows() of the user's archived expenses; months are matched by their first day."""
+    rows = []
+    for totals in _archives([user.pk], start, end - timedelta(days=1)).values_list('totals', flat=True):
+        for category_ref_id, name, month, currency, sum_minor in totals['categories']:
+            month = date.fromisoformat(month)
+            if start <= month < end:
+                rows.append({
+                    'category_ref_id': category_ref_id, 'month': month, 'currency': currency,
+                    'sum_minor': sum_minor, 'name': name,
+                })
+    # Current names, like category_rows(); a deleted category keeps its archived name
+    names = dict(Category.objects.filter(pk__in={row['category_ref_id'] for row in rows}).values_list('pk', 'name'))
+    for row in rows:
+        row['name'] = names.get(row['category_ref_id'], row['name'])
+    return rows
@@ -0,0 +1,97 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseBadRequest
+from django.shortcuts import aget_object_or_404, redirect, render as sync_render
+
+from .archives import archived_category_rows, archived_page, archived_years
+from .budgets import budget_usage, current_month, pop_new_alerts
+from .cache import acached
+from .categories import acategory_rows
+from .forms import ExpenseForm
+from .models import Expense
+from .pagination import akeyset_page
+from .rollups import adata_version, amonthly_rows, currencies_queryset, month_start, years_queryset
+from .views import budget_alert_messages, list_context, list_params, year_chart, year_range
+
+# Async counterparts of the views in views.py for deployments served over ASGI.
+# They render the same templates; only the data access differs. Rendering itself
+# runs in a thread because templates touch the session (messages) and the lazy
+# request.user, which are sync-only.
+render = sync_to_async(sync_render)
+
+
+async def _alist(queryset):
+    return [item async for item in queryset]
+
+
+async def _acategory_rows(user, start, end):
+    return await acategory_rows(user, start, end) + await sync_to_async(archived_category_rows)(user, start, end)
+
+
+@login_required
+async def expense_list(request):
+    user = await request.auser()
+    params = list_params(request)
+    if params is None:
+        return HttpResponseBadRequest('Invalid year.')
+    selected_year, base_currency = params
+    start, end = year_range(selected_year)
+    expenses = Expense.objects.filter(user=user, date__gte=start, date__lt=end)
+    version = await adata_version(user.pk)
+    month = current_month()
+    archived = await acached(user.pk, 'archived_years', lambda: sync_to_async(archived_years)(user.pk), version)
+    extra = None
+    if selected_year in archived:
+        extra = await sync_to_async(archived_page)(user.pk, selected_year, request.GET.get('after'), settings.EXPENSES_PAGE_SIZE)
+    # The cached aggregates and the expense page do not depend on each other
+    rows, years, categories, currencies, budgets, page = await asyncio.gather(
+        acached(user.pk, f'monthly:{start}:{end}:total', lambda: amonthly_rows(user, start, end), version),
+        acached(user.pk, 'years', lambda: _alist(years_queryset(user)), version),
+        acached(user.pk, f'categories:{start}:{end}', lambda: _acategory_rows(user, start, end), version),
+        acached(user.pk, 'currencies', lambda: _alist(currencies_queryset(user)), version),
+        acached(user.pk, f'budgets:{month}', lambda: sync_to_async(budget_usage)(user, month), version),
+        akeyset_page(expenses, request.GET.get('after'), settings.EXPENSES_PAGE_SIZE, extra),
+    )
+    # Currency conversion may look up exchange rates, which goes through the sync ORM
+    context = await sync_to_async(list_context)(selected_year, base_currency, rows, years, categories, currencies, page)
+    context['is_first_page'] = not request.GET.get('after')
+    context['budgets'] = budgets
+    context['budget_month'] = month
+    context['by_category'] = request.GET.get('chart') == 'category'
+    context['chart'] = await sync_to_async(year_chart)(
+        user, selected_year, base_currency, context['by_category'], version, rows,
+    )
+    return await render(request, 'list.html', context)
+
+
+@login_required
+async def add_expense(request):
+    user = await request.auser()
+    if request.method == 'POST':
+        form = ExpenseForm(request.POST, user=user)
+        # Validation resolves the category name, which may query the database
+        if await sync_to_async(form.is_valid)():
+            expense = form.save(commit=False)
+            expense.user = user
+            await expense.asave()
+            alerts = await sync_to_async(pop_new_alerts)(user, month_start(expense.date))
+            budget_alert_messages(request, alerts)
+            return redirect('expense_list_async')
+    else:
+        form = ExpenseForm()
+    return await render(request, 'add.html', {'form': form})
+
+
+@login_required
+async def delete_expense(request, expense_id):
+    user = await request.auser()
+    expense = await aget_object_or_404(Expense, id=expense_id, user=user)
+    if request.method == 'POST':
+        await expense.adelete()
+        messages.success(request, 'Expense deleted successfully.')
+        return redirect('expense_list_async')
+    return await render(request, 'confirm_delete.html', {'expense': expense})
@@ -0,0 +1,137 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .currency import convert_monthly
+from .models import Budget, BudgetAlert, MonthlyTotal
+from .money import from_minor
+
+# Budgets are monthly limits on the spending already counted per (user, month,
+# category, currency) by the MonthlyTotal rollup. Those rows are updated with
+# an atomic F() expression on every expense write, so budget usage is read
+# from a handful of counter rows instead of summing the month's expenses.
+
+
+def current_month():
+    return timezone.localdate().replace(day=1)
+
+
+def _converted(month, amount_minor, currency, target):
+    # Spending without a known exchange rate does not count towards the budget
+    return convert_monthly(month, from_minor(amount_minor, currency), currency, target) or Decimal('0')
+
+
+def spent(budgets_by_key, months):
+    """
+    Return {(user_id, category, month): spent in the budget's currency} for the
+    given budgets (keyed by (user_id, category name)) and months.
+    """
+    if not budgets_by_key or not months:
+        return {}
+    totals = defaultdict(Decimal)
+    rows = MonthlyTotal.objects.filter(
+        user_id__in={user_id for user_id, _ in budgets_by_key},
+        category__in={category for _, category in budgets_by_key},
+        month__in=months,
+    ).values_list('user_id', 'category', 'month', 'currency', 'total_minor')
+    for user_id, category, month, currency, total_minor in rows:
+        budget = budgets_by_key.get((user_id, category))
+        if budget is None:
+            continue
+        totals[(user_id, category, month)] += _converted(month, total_minor, currency, budget.currency)
+    return totals
+
+
+def budgets_for(keys):
+    """Budgets of the (user_id, category name) pairs that have one, keyed by that pair."""
+    if not keys:
+        return {}
+    budgets = Budget.objects.filter(
+        user_id__in={user_id for user_id, _ in keys}, category__name__in={category for _, category in keys},
+    ).select_related('category')
+    return {
+        (budget.user_id, budget.category.name): budget
+        for budget in budgets if (budget.user_id, budget.category.name) in keys
+    }
+
+
+def crossed(budget, before, after):
+    """(thresholds reached going from before to after, thresholds left going back below)."""
+    limit = budget.limit
+    raised, cleared = [], []
+    for percent in budget.thresholds():
+        line = limit * percent / 100
+        if before < line <= after:
+            raised.append(percent)
+        elif after < line <= before:
+            cleared.append(percent)
+    return raised, cleared
+
+
+def sync_alerts(budget, month, before, after):
+    raised, cleared = crossed(budget, before, after)
+    if raised:
+        BudgetAlert.objects.bulk_create(
+            [BudgetAlert(budget=budget, month=month, percent=percent) for percent in raised],
+            ignore_conflicts=True,
+        )
+    if cleared:
+        # Dropping back under a threshold re-arms it for the rest of the month
+        BudgetAlert.objects.filter(budget=budget, month=month, percent__in=cleared).delete()
+
+
+def refresh_alerts(budget, month):
+    """Make the month's alerts of a budget match its current usage, e.g. after its limit changed."""
+    budgets = {(budget.user_id, budget.category.name): budget}
+    amount = spent(budgets, [month]).get((budget.user_id, budget.category.name, month), Decimal('0'))
+    sync_alerts(budget, month, Decimal('0'), amount)
+    reached = [percent for percent in budget.thresholds() if budget.limit * percent / 100 <= amount]
+    BudgetAlert.objects.filter(budget=budget, month=month).exclude(percent__in=reached).delete()
+    return amount
+
+
+def check_thresholds(deltas):
+    """
+    Raise or clear budget alerts after rollup deltas were applied.
+
+    deltas maps (user_id, month, category, currency) to the (amount_minor,
+    count) just added to MonthlyTotal. The counters already hold the new
+    totals, so the previous ones are the new totals minus the deltas.
+    """
+    budgets = budgets_for({(user_id, category) for user_id, _, category, _ in deltas})
+    if not budgets:
+        return
+    months = {month for _, month, _, _ in deltas}
+    after = spent(budgets, months)
+    changes = defaultdict(Decimal)
+    for (user_id, month, category, currency), (amount_minor, _) in deltas.items():
+        budget = budgets.get((user_id, category))
+        if budget is not None:
+            changes[(user_id, category, month)] += _converted(month, amount_minor, currency, budget.currency)
+    for (user_id, category, month), change in changes.items():
+        now = after.get((user_id, category, month), Decimal('0'))
+        sync_alerts(budgets[(user_id, category)], month, now - change, now)
+
+
+def budget_usage(user, month):
+    """[(budget, spent, percent)] for every budget of the user in month, largest usage first."""
+    budgets = {(budget.user_id, budget.category.name): budget for budget in Budget.objects.filter(user=user).select_related('category')}
+    totals = spent(budgets, [month])
+    usage = []
+    for (user_id, category), budget in budgets.items():
+        amount = totals.get((user_id, category, month), Decimal('0'))
+        percent = int(amount * 100 / budget.limit) if budget.limit_minor else 0
+        usage.append((budget, amount, percent))
+    return sorted(usage, key=lambda item: (-item[2], item[0].category.name))
+
+
+def pop_new_alerts(user, month):
+    """Alerts of the month the user has not been told about yet; they are marked as notified."""
+    alerts = list(
+        BudgetAlert.objects.filter(budget__user=user, month=month, notified=False)
+        .select_related('budget__category').order_by('percent')
+    )
+    if alerts:
+        BudgetAlert.objects.filter(pk__in=[alert.pk for alert in alerts]).update(notified=True)
+    return alerts
@@ -0,0 +1,52 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from . import rollups
+from .categories import resolve_category
+from .changes import record_queryset
+
+# Set-based writes over a queryset of expenses. They bypass the per-object
+# save/delete signals, so each keeps the rollup and the change feed in step
+# itself, in the same transaction.
+
+
+def reassign_category(queryset, name):
+    """
+    Move every expense of queryset to the category name, with one UPDATE per
+    owning user, and return the number of expenses moved.
+
+    The rollup is corrected from one grouped query over the moved rows rather
+    than per-object saves.
+    """
+    with transaction.atomic():
+        moved = rollups.queryset_deltas(queryset, 1)
+        if not moved:
+            return 0
+        # Only category fields change, so the rows can be logged before the UPDATE
+        record_queryset(queryset)
+        categories = {}
+        updated = 0
+        for user_id in sorted({user_id for user_id, _, _, _ in moved}):
+            category_id, categories[user_id] = resolve_category(user_id, name)
+            updated += queryset.filter(user_id=user_id).order_by().update(category=categories[user_id], category_ref_id=category_id)
+        deltas = defaultdict(lambda: [0, 0])
+        for (user_id, month, category, currency), (amount_minor, count) in moved.items():
+            for key, sign in (((user_id, month, category, currency), -1), ((user_id, month, categories[user_id], currency), 1)):
+                deltas[key][0] += sign * amount_minor
+                deltas[key][1] += sign * count
+        rollups.apply_deltas(deltas)
+    return updated
+
+
+def delete_expenses(queryset):
+    """Delete every expense of queryset with one DELETE, returning how many were deleted."""
+    with transaction.atomic():
+        deltas = rollups.queryset_deltas(queryset, -1)
+        if not deltas:
+            return 0
+        record_queryset(queryset, deleted=True)
+        # _raw_delete skips the collector, which would load every row to send post_delete
+        deleted = queryset.order_by()._raw_delete(queryset.db)
+        rollups.apply_deltas(deltas)
+    return deleted
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from budget_manager import metrics
+
+from .rollups import data_version
+
+# Part of every key; bump it when the shape of the cached values changes
+KEY_SCHEMA = 2
+
+# Hits and misses of this process, served at /metrics/ for the hit rate
+LOOKUPS = metrics.register(metrics.CounterFamily(
+    'expenses_aggregate_cache_lookups_total', 'Expense aggregate cache lookups by result.', 'result',
+))
+
+
+def _record(outcome):
+    LOOKUPS.inc(outcome)
+
+
+def stats():
+    """Hit/miss counters of this process."""
+    return {'hits': LOOKUPS.get('hit'), 'misses': LOOKUPS.get('miss')}
+
+
+def reset_stats():
+    LOOKUPS.clear()
+
+
+def aggregates_cache():
+    return caches[settings.EXPENSES_CACHE_ALIAS]
+
+
+def _cache_key(user_id, name, version):
+    counter, updated_at = version
+    stamp = updated_at.timestamp() if updated_at else 0
+    return f'expenses:s{KEY_SCHEMA}:{user_id}:v{counter}:{stamp}:{name}'
+
+
+def cached(user_id, name, compute, version=None):
+    """
+    Return compute() for a user, cached under the user's current data version.
+
+    The version is the (counter, updated_at) pair of UserDataVersion, bumped
+    with an atomic UPDATE in the same transaction as every Expense change, so
+    entries written for an older version are simply never read again. Only
+    plain get/set are used, which keeps this correct on the locmem, file and
+    database backends.
+    """
+    key = _cache_key(user_id, name, version or data_version(user_id))
+    cache = aggregates_cache()
+    value = cache.get(key)
+    if value is not None:
+        _record('hit')
+        return value
+    _record('miss')
+    value = compute()
+    cache.set(key, value, settings.EXPENSES_CACHE_TIMEOUT)
+    return value
+
+
+async def acached(user_id, name, acompute, version):
+    """Async version of cached(); acompute is a coroutine function."""
+    key = _cache_key(user_id, name, version)
+    cache = aggregates_cache()
+    value = await cache.aget(key)
+    if value is not None:
+        _record('hit')
+        return value
+    _record('miss')
+    value = await acompute()
+    await cache.aset(key, value, settings.EXPENSES_CACHE_TIMEOUT)
+    return value
@@ -0,0 +1,125 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+from .currency import convert_monthly
+from .models import Category, Expense
+from .money import from_minor
+
+
+def category_key(name):
+    return ' '.join(name.split()).casefold()
+
+
+def _cache_key(user_id):
+    return f'expenses:{user_id}:categories'
+
+
+def _category_cache():
+    return caches[settings.EXPENSES_CACHE_ALIAS]
+
+
+def forget_categories(user_id):
+    _category_cache().delete(_cache_key(user_id))
+
+
+def _remember(user_id, key, value):
+    cache = _category_cache()
+    mapping = cache.get(_cache_key(user_id)) or {}
+    mapping[key] = value
+    cache.set(_cache_key(user_id), mapping, settings.EXPENSES_CACHE_TIMEOUT)
+
+
+def resolve_category(user_id, name):
+    """
+    Return (category id, canonical name) for a user's category name.
+
+    Names are matched on their case-folded key through a cached per-user
+    name -> id map; unknown names create the Category. The map is only updated
+    once the surrounding transaction commits so a rollback can never leave an
+    id in the cache that does not exist.
+    """
+    key = category_key(name)
+    cached = (_category_cache().get(_cache_key(user_id)) or {}).get(key)
+    if cached:
+        return cached
+    category = Category.objects.filter(user_id=user_id, key=key).values_list('pk', 'name').first()
+    if category is None:
+        try:
+            with transaction.atomic():
+                created = Category.objects.create(user_id=user_id, name=' '.join(name.split()), key=key)
+            category = (created.pk, created.name)
+        except IntegrityError:
+            category = Category.objects.filter(user_id=user_id, key=key).values_list('pk', 'name').get()
+    category = tuple(category)
+    transaction.on_commit(lambda: _remember(user_id, key, category))
+    return category
+
+
+def canonical_name(user_id, name):
+    """
+    Spelling a category name is stored under: that of the user's existing
+    category with the same key, else the name with its whitespace collapsed.
+    Read-only, unlike resolve_category(), so forms can call it while validating.
+    """
+    key = category_key(name)
+    cached = (_category_cache().get(_cache_key(user_id)) or {}).get(key)
+    if cached:
+        return cached[1]
+    existing = Category.objects.filter(user_id=user_id, key=key).values_list('name', flat=True).first()
+    return existing or ' '.join(name.split())
+
+
+def category_rows(user, start, end):
+    """
+    Per-category totals for [start, end) in one query grouped by the integer FK.
+
+    Rows are also split by month and currency so they can be converted like the
+    monthly rollup; names are attached afterwards from a primary-key lookup.
+    """
+    rows = list(_category_rows_queryset(user, start, end))
+    names = dict(_category_names_queryset(rows))
+    return _attach_names(rows, names)
+
+
+async def acategory_rows(user, start, end):
+    """Async version of category_rows()."""
+    rows = [row async for row in _category_rows_queryset(user, start, end)]
+    names = {pk: name async for pk, name in _category_names_queryset(rows)}
+    return _attach_names(rows, names)
+
+
+def _category_rows_queryset(user, start, end):
+    return (
+        Expense.objects.filter(user=user, date__gte=start, date__lt=end)
+        .annotate(month=TruncMonth('date'))
+        .values('category_ref_id', 'month', 'currency').annotate(sum_minor=Sum('amount_minor')).order_by()
+    )
+
+
+def _category_names_queryset(rows):
+    return Category.objects.filter(pk__in={row['category_ref_id'] for row in rows}).values_list('pk', 'name')
+
+
+def _attach_names(rows, names):
+    for row in rows:
+        row['name'] = names.get(row['category_ref_id'], '')
+    return rows
+
+
+def category_totals(rows, currency):
+    """Return ([(name, total)] sorted by total descending, missing currencies)."""
+    totals = defaultdict(Decimal)
+    missing = set()
+    for row in rows:
+        converted = convert_monthly(row['month'], from_minor(row['sum_minor'], row['currency']), row['currency'], currency)
+        if converted is None:
+            missing.add(row['currency'])
+            continue
+        totals[row['name']] += converted
+    return sorted(totals.items(), key=lambda item: (-item[1], item[0])), sorted(missing)
@@ -0,0 +1,83 @@
+from django.db import connections, transaction
+from django.db.models import BooleanField, Value
+
+from .models import ExpenseChange
+
+# The change feed behind the sync API. Every expense write logs the expense id
+# in ExpenseChange; an earlier entry of the same expense is dropped, so the log
+# holds one row per live expense plus one tombstone per deleted one, and a
+# client catching up reads each changed expense once however often it changed.
+# SQLite serializes writers, so ids are committed in increasing order and
+# "id > cursor" never skips a change committed later with a smaller id.
+
+
+def record_changes(expenses, deleted=False):
+    """Log the given saved (or just deleted) expense objects as changed."""
+    expenses = list(expenses)
+    if not expenses:
+        return
+    with transaction.atomic():
+        ExpenseChange.objects.filter(expense_id__in=[expense.pk for expense in expenses]).delete()
+        ExpenseChange.objects.bulk_create([
+            ExpenseChange(user_id=expense.user_id, expense_id=expense.pk, client_id=expense.client_id, deleted=deleted)
+            for expense in expenses
+        ])
+
+
+def record_queryset(queryset, deleted=False, replace=True):
+    """
+    Log every expense of queryset as changed with one INSERT ... SELECT,
+    without loading the rows. Deletions must be logged before the rows go.
+    replace=False skips dropping earlier entries, for rows that were just
+    inserted and cannot have any.
+    """
+    using = queryset.db
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    select, params = (
+        queryset.order_by('pk')
+        .annotate(change_deleted=Value(deleted, output_field=BooleanField()))
+        .values_list('user_id', 'pk', 'client_id', 'change_deleted')
+        .query.sql_with_params()
+    )
+    columns = ', '.join(
+        quote(ExpenseChange._meta.get_field(name).column) for name in ('user', 'expense_id', 'client_id', 'deleted')
+    )
+    with transaction.atomic(using=using):
+        if replace:
+            ExpenseChange.objects.using(using).filter(expense_id__in=queryset.values('pk')).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {quote(ExpenseChange._meta.db_table)} ({columns}) {select}', params)
+
+
+def latest_cursor(user):
+    """Cursor pointing after the user's newest change; 0 without any."""
+    return ExpenseChange.objects.filter(user=user).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def changes_page(user, since, limit):
+    """
+    Return (changes, cursor, more) for the user's changes after the cursor
+    since, at most limit of them, oldest first.
+
+    Each change is an expense's current values, or a tombstone with only its
+    ids for a deleted one. cursor is the value to pass as since next time.
+    """
+    rows = list(ExpenseChange.objects.filter(user=user, id__gt=since).order_by('id')[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    expenses = user.expense_set.in_bulk([row.expense_id for row in rows if not row.deleted])
+    changes = []
+    for row in rows:
+        expense = expenses.get(row.expense_id)
+        change = {'id': row.expense_id, 'client_id': str(row.client_id) if row.client_id else None}
+        if expense is None:
+            # Deleted after this entry was read; its tombstone follows in a later page
+            change['deleted'] = True
+        else:
+            change.update({
+                'deleted': False, 'title': expense.title, 'amount': str(expense.amount), 'category': expense.category,
+                'date': expense.date.isoformat(), 'currency': expense.currency,
+            })
+        changes.append(change)
+    return changes, rows[-1].id if rows else since, more
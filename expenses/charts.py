@@ -0,0 +1,144 @@
+import math
+
+from django.utils.html import escape
+
+# Charts are rendered as inline SVG on the server, so pages need no chart
+# library; the viewBox keeps them scaling with the page width. Values are
+# Decimals straight from monthly_series() and only turned into floats here.
+WIDTH = 720
+HEIGHT = 280
+MARGIN_LEFT = 72
+MARGIN_RIGHT = 16
+MARGIN_TOP = 16
+MARGIN_BOTTOM = 32
+LEGEND_ITEM_WIDTH = 140
+LEGEND_ROW_HEIGHT = 20
+TICKS = 5
+PALETTE = (
+    '#4bc0c0', '#ff6384', '#36a2eb', '#ff9f40', '#9966ff',
+    '#ffcd56', '#2e8b57', '#c9cbcf', '#8b4513', '#1f3a93',
+)
+
+
+def axis_step(maximum, ticks=TICKS):
+    """Round step (1, 2, 2.5 or 5 times a power of ten) splitting [0, maximum] into at most ticks parts."""
+    if maximum <= 0:
+        return 1
+    rough = maximum / ticks
+    magnitude = 10 ** math.floor(math.log10(rough))
+    for factor in (1, 2, 2.5, 5, 10):
+        if rough <= factor * magnitude:
+            return factor * magnitude
+
+
+def _format(value, step):
+    return f'{value:,.0f}' if step >= 1 else f'{value:,.2f}'
+
+
+class Frame:
+    """Plot area of a chart: axes, grid and legend, and the value to pixel mapping."""
+
+    def __init__(self, labels, maximum, legend=()):
+        self.labels = labels
+        self.legend = list(legend)
+        self.step = axis_step(maximum)
+        self.top = max(math.ceil(maximum / self.step), 1) * self.step
+        self.plot_width = WIDTH - MARGIN_LEFT - MARGIN_RIGHT
+        self.plot_height = HEIGHT - MARGIN_TOP - MARGIN_BOTTOM
+        self.per_row = max(self.plot_width // LEGEND_ITEM_WIDTH, 1)
+        self.height = HEIGHT + LEGEND_ROW_HEIGHT * math.ceil(len(self.legend) / self.per_row) + (8 if self.legend else 0)
+
+    def x(self, index):
+        """Centre of the index-th label's slot."""
+        return MARGIN_LEFT + (index + 0.5) * self.plot_width / len(self.labels)
+
+    def y(self, value):
+        return MARGIN_TOP + self.plot_height * (1 - float(value) / self.top)
+
+    @property
+    def slot(self):
+        return self.plot_width / len(self.labels)
+
+    def svg(self, title, unit, body):
+        parts = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {WIDTH} {self.height}" width="100%" '
+            f'role="img" aria-label="{escape(title)}" font-family="sans-serif" font-size="11">',
+            f'<title>{escape(title)}</title>',
+        ]
+        for index in range(round(self.top / self.step) + 1):
+            value = index * self.step
+            y = self.y(value)
+            parts.append(
+                f'<line x1="{MARGIN_LEFT}" y1="{y:.1f}" x2="{WIDTH - MARGIN_RIGHT}" y2="{y:.1f}" stroke="#e0e0e0"/>'
+                f'<text x="{MARGIN_LEFT - 6}" y="{y + 4:.1f}" text-anchor="end" fill="#555">{_format(value, self.step)}</text>'
+            )
+        parts.append(
+            f'<text x="12" y="{MARGIN_TOP + self.plot_height / 2:.1f}" text-anchor="middle" fill="#555" '
+            f'transform="rotate(-90 12 {MARGIN_TOP + self.plot_height / 2:.1f})">{escape(unit)}</text>'
+        )
+        for index, label in enumerate(self.labels):
+            parts.append(
+                f'<text x="{self.x(index):.1f}" y="{HEIGHT - MARGIN_BOTTOM + 16}" text-anchor="middle" fill="#555">{escape(label)}</text>'
+            )
+        parts.extend(body)
+        for index, (label, color) in enumerate(self.legend):
+            row, column = divmod(index, self.per_row)
+            x = MARGIN_LEFT + column * LEGEND_ITEM_WIDTH
+            y = HEIGHT + 8 + row * LEGEND_ROW_HEIGHT
+            parts.append(
+                f'<rect x="{x}" y="{y - 9}" width="10" height="10" fill="{color}"/>'
+                f'<text x="{x + 14}" y="{y}" fill="#333">{escape(label)}</text>'
+            )
+        parts.append('</svg>')
+        return ''.join(parts)
+
+
+def line_chart(labels, series, title, unit, fill=False):
+    """
+    SVG line chart with one line per entry of series (label -> values, one
+    per label). A single series is drawn without a legend, filled below the
+    line with fill.
+    """
+    maximum = max((float(value) for values in series.values() for value in values), default=0)
+    colors = dict(zip(series, PALETTE * (len(series) // len(PALETTE) + 1)))
+    frame = Frame(labels, maximum, colors.items() if len(series) > 1 else ())
+    body = []
+    for label, values in series.items():
+        points = [(frame.x(index), frame.y(value)) for index, value in enumerate(values)]
+        path = ' '.join(f'{x:.1f},{y:.1f}' for x, y in points)
+        if fill and len(series) == 1:
+            bottom = frame.y(0)
+            body.append(
+                f'<polygon points="{points[0][0]:.1f},{bottom:.1f} {path} {points[-1][0]:.1f},{bottom:.1f}" '
+                f'fill="{colors[label]}" fill-opacity="0.2"/>'
+            )
+        body.append(f'<polyline points="{path}" fill="none" stroke="{colors[label]}" stroke-width="2"/>')
+        for (x, y), name, value in zip(points, labels, values):
+            body.append(
+                f'<circle cx="{x:.1f}" cy="{y:.1f}" r="3" fill="{colors[label]}">'
+                f'<title>{escape(label)} {escape(name)}: {value:,.2f} {escape(unit)}</title></circle>'
+            )
+    return frame.svg(title, unit, body)
+
+
+def stacked_bar_chart(labels, series, title, unit):
+    """SVG chart with one bar per label stacking every series' value (label -> values) on top of each other."""
+    totals = [sum(float(value) for value in values) for values in zip(*series.values())]
+    colors = dict(zip(series, PALETTE * (len(series) // len(PALETTE) + 1)))
+    frame = Frame(labels, max(totals, default=0), colors.items())
+    width = frame.slot * 0.7
+    body = []
+    for index, name in enumerate(labels):
+        base = 0.0
+        for label, values in series.items():
+            value = float(values[index])
+            if value <= 0:
+                continue
+            top = frame.y(base + value)
+            body.append(
+                f'<rect x="{frame.x(index) - width / 2:.1f}" y="{top:.1f}" width="{width:.1f}" '
+                f'height="{frame.y(base) - top:.1f}" fill="{colors[label]}">'
+                f'<title>{escape(label)} {escape(name)}: {values[index]:,.2f} {escape(unit)}</title></rect>'
+            )
+            base += value
+    return frame.svg(title, unit, body)
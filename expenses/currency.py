@@ -0,0 +1,106 @@
+import calendar
+import threading
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import ExchangeRate, ExchangeRateVersion
+from .money import exponent
+
+
+def _latest_rate(base, quote, day):
+    return (
+        ExchangeRate.objects.filter(base=base, quote=quote, date__lte=day)
+        .order_by('-date').values_list('rate', flat=True).first()
+    )
+
+
+def _lookup_rate(currency, target, day):
+    rate = _latest_rate(currency, target, day)
+    if rate is not None:
+        return rate
+    inverse = _latest_rate(target, currency, day)
+    if inverse:
+        return Decimal(1) / inverse
+    return None
+
+
+@lru_cache(maxsize=settings.EXPENSES_RATE_CACHE_SIZE)
+def _cached_lookup_rate(currency, target, day, version):
+    # version only makes entries of older rates unreachable
+    return _lookup_rate(currency, target, day)
+
+
+def clear_rate_cache():
+    _cached_lookup_rate.cache_clear()
+
+
+# The rates version read by the current request, if any; requests read it once
+_request_state = threading.local()
+
+
+def rates_version():
+    """Current ExchangeRateVersion; read once per request, on every call outside requests."""
+    version = getattr(_request_state, 'version', None)
+    if version is None:
+        version = ExchangeRateVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+        if getattr(_request_state, 'active', False):
+            _request_state.version = version
+    return version
+
+
+def start_request(**kwargs):
+    """request_started handler."""
+    _request_state.active = True
+    _request_state.version = None
+
+
+def finish_request(**kwargs):
+    """request_finished handler."""
+    _request_state.active = False
+    _request_state.version = None
+
+
+def bump_rates_version():
+    """Make every process look rates up again; call in the transaction changing them."""
+    if not ExchangeRateVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        try:
+            with transaction.atomic():
+                ExchangeRateVersion.objects.create(pk=1, version=1)
+        except IntegrityError:
+            ExchangeRateVersion.objects.filter(pk=1).update(version=F('version') + 1)
+    _request_state.version = None
+    clear_rate_cache()
+
+
+def get_rate(currency, target, day):
+    """
+    Rate converting currency into target on day, or None if no rate is known.
+
+    Uses the latest rate published on or before day, directly or as the inverse
+    of the opposite pair. Lookups for closed days go through an in-process LRU
+    cache keyed on the shared rates version, so rates loaded by another
+    process are seen at once; today and later always hit the table because
+    new rates may still be loaded for them.
+    """
+    if currency == target:
+        return Decimal(1)
+    if day < date.today():
+        return _cached_lookup_rate(currency, target, day, rates_version())
+    return _lookup_rate(currency, target, day)
+
+
+def month_end(month):
+    return month.replace(day=calendar.monthrange(month.year, month.month)[1])
+
+
+def convert_monthly(month, amount, currency, target):
+    """Convert a monthly total with the rate in force at the end of that month, to target's minor units."""
+    rate = get_rate(currency, target, month_end(month))
+    if rate is None:
+        return None
+    return (amount * rate).quantize(Decimal(1).scaleb(-exponent(target)))
@@ -0,0 +1,147 @@
+import csv
+import heapq
+import json
+import zlib
+
+from django.db.models import Q
+
+from .archives import archived_expenses
+from .categories import category_key
+from .importers import IMPORT_FIELDS
+from .models import Expense
+from .money import from_minor
+
+# Same columns as the importer so an export can be re-imported as is
+EXPORT_FIELDS = IMPORT_FIELDS
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+# Rows rendered into one chunk before it is handed to the response
+ROWS_PER_CHUNK = 500
+
+
+class Echo:
+    """File-like object whose write() returns the value instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, fields, chunk_size, archived=None):
+    """
+    Stream value tuples from the database without building model instances.
+
+    archived are ArchivedExpense rows to merge in; both they and queryset
+    must be ordered by the fields among (user_id, date) that are exported.
+    """
+    rows = _database_rows(queryset, fields, chunk_size)
+    if archived is None:
+        return rows
+    positions = [fields.index(name) for name in ('user_id', 'date') if name in fields]
+    return heapq.merge(
+        rows, ([getattr(expense, name) for name in fields] for expense in archived),
+        key=lambda row: [row[position] for position in positions],
+    )
+
+
+def _database_rows(queryset, fields, chunk_size):
+    if 'amount' not in fields:
+        return queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    # amount is stored in minor units, which only mean something with the currency
+    columns = [('amount_minor' if name == 'amount' else name) for name in fields] + ['currency']
+    rows = queryset.values_list(*columns).iterator(chunk_size=chunk_size)
+    return _with_decimal_amounts(rows, fields.index('amount'))
+
+
+def _with_decimal_amounts(rows, position):
+    for row in rows:
+        *values, currency = row
+        values[position] = from_minor(values[position], currency)
+        yield values
+
+
+def filter_expenses(queryset, start=None, end=None, category=None, currency=None):
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        # end is inclusive for users; end + 1 day would overflow for 9999-12-31
+        queryset = queryset.filter(date__lte=end)
+    if category:
+        # Names are matched like categories are stored: case and spacing do not
+        # matter. Expenses of a deleted category have no category_ref but keep its name
+        queryset = queryset.filter(
+            Q(category_ref__key=category_key(category))
+            | Q(category_ref__isnull=True, category__iexact=' '.join(category.split()))
+        )
+    if currency:
+        queryset = queryset.filter(currency=currency)
+    return queryset
+
+
+def _json_default(value):
+    return str(value)
+
+
+def render_csv(rows, fields):
+    writer = csv.writer(Echo())
+    chunk = [writer.writerow(fields)]
+    for row in rows:
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield ''.join(chunk).encode()
+            chunk = []
+    if chunk:
+        yield ''.join(chunk).encode()
+
+
+def render_jsonl(rows, fields):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(fields, row)), default=_json_default) + '\n')
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield ''.join(chunk).encode()
+            chunk = []
+    if chunk:
+        yield ''.join(chunk).encode()
+
+
+RENDERERS = {'csv': render_csv, 'jsonl': render_jsonl}
+
+
+def gzip_stream(chunks):
+    """Compress an iterable of byte chunks on the fly into a single gzip member."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(queryset, file_format, chunk_size, fields=EXPORT_FIELDS, compress=False, archived=None):
+    chunks = RENDERERS[file_format](export_rows(queryset, fields, chunk_size, archived), fields)
+    return gzip_stream(chunks) if compress else chunks
+
+
+def user_export_queryset(user, **filters):
+    return filter_expenses(Expense.objects.filter(user=user), **filters).order_by('date', 'id')
+
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header value allows gzip; a q-value of 0 refuses it."""
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0))) > 0
@@ -1,17 +1,246 @@
 from django import forms
-from .models import Expense
+from django.conf import settings
+from .models import Budget, Expense, RecurringExpense, ReportJob
+from .categories import canonical_name, resolve_category
+from .money import exponent, has_minor_precision, to_minor
 from django.core.exceptions import ValidationError
+from datetime import date
+
+
+def validate_positive_amount(amount):
+    if amount is not None and amount <= 0:
+        raise ValidationError("Amount must be greater than 0.")
+    return amount
+
+
+def validate_amount_precision(amount, currency):
+    if amount is not None and currency and not has_minor_precision(amount, currency):
+        raise ValidationError(
+            f"Ensure that there are no more than {exponent(currency)} decimal places for {currency}."
+        )
+    return amount
+
 
 class ExpenseForm(forms.ModelForm):
+    # Entered as a decimal and stored as Expense.amount_minor
+    amount = forms.DecimalField(max_digits=10)
+    field_order = ["title", "amount", "category", "date", "currency"]
+
     class Meta:
         model = Expense
-        fields = ["title", "amount", "category", "date", "currency"]
+        fields = ["title", "category", "date", "currency"]
         widgets = {
             "date": forms.DateInput(attrs={"type": "date"})  
         }
 
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        if self.instance.amount_minor is not None:
+            self.initial.setdefault("amount", self.instance.amount)
+
+    def clean_amount(self):
+        return validate_positive_amount(self.cleaned_data.get("amount"))
+
+    def clean_category(self):
+        category = self.cleaned_data.get("category")
+        if category and self.user is not None:
+            # Only the spelling; the Category row is resolved (and created) when
+            # the expense is saved, so invalid submissions write nothing
+            category = canonical_name(self.user.pk, category)
+        return category
+
+    def clean(self):
+        cleaned_data = super().clean()
+        try:
+            validate_amount_precision(cleaned_data.get("amount"), cleaned_data.get("currency"))
+        except ValidationError as exc:
+            self.add_error("amount", exc)
+        return cleaned_data
+
+    def save(self, commit=True):
+        self.instance.amount = self.cleaned_data["amount"]
+        return super().save(commit)
+
+
+class BudgetForm(forms.Form):
+    category = forms.CharField(max_length=255)
+    limit = forms.DecimalField(max_digits=10, label="Monthly limit")
+    currency = forms.CharField(max_length=3, initial="PLN")
+    alert_percent = forms.IntegerField(min_value=1, max_value=100, initial=80, label="Alert at (%)")
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+
+    def clean_limit(self):
+        return validate_positive_amount(self.cleaned_data.get("limit"))
+
+    def clean_currency(self):
+        return self.cleaned_data["currency"].upper()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        try:
+            validate_amount_precision(cleaned_data.get("limit"), cleaned_data.get("currency"))
+        except ValidationError as exc:
+            self.add_error("limit", exc)
+        return cleaned_data
+
+    def save(self):
+        """Create the budget of the category, or update it if there already is one."""
+        category_id, _ = resolve_category(self.user.pk, self.cleaned_data["category"])
+        budget, _ = Budget.objects.update_or_create(
+            user=self.user, category_id=category_id,
+            defaults={
+                "limit_minor": to_minor(self.cleaned_data["limit"], self.cleaned_data["currency"]),
+                "currency": self.cleaned_data["currency"],
+                "alert_percent": self.cleaned_data["alert_percent"],
+            },
+        )
+        return budget
+
+
+class RecurringExpenseForm(forms.ModelForm):
+    amount = forms.DecimalField(max_digits=10)
+    field_order = ["title", "amount", "category", "currency", "frequency", "start_date", "end_date"]
+
+    class Meta:
+        model = RecurringExpense
+        fields = ["title", "category", "currency", "frequency", "start_date", "end_date"]
+        widgets = {
+            "start_date": forms.DateInput(attrs={"type": "date"}),
+            "end_date": forms.DateInput(attrs={"type": "date"}),
+        }
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+
     def clean_amount(self):
-        amount = self.cleaned_data.get("amount")
-        if amount is not None and amount <= 0:
-            raise ValidationError("Amount must be greater than 0.")
-        return amount
+        return validate_positive_amount(self.cleaned_data.get("amount"))
+
+    def clean_currency(self):
+        return self.cleaned_data["currency"].upper()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        try:
+            validate_amount_precision(cleaned_data.get("amount"), cleaned_data.get("currency"))
+        except ValidationError as exc:
+            self.add_error("amount", exc)
+        start, end = cleaned_data.get("start_date"), cleaned_data.get("end_date")
+        if start and end and end < start:
+            self.add_error("end_date", "End date must not be before the start date.")
+        return cleaned_data
+
+    def save(self, commit=True):
+        self.instance.user = self.user
+        self.instance.amount = self.cleaned_data["amount"]
+        return super().save(commit)
+
+
+class ImportForm(forms.Form):
+    file = forms.FileField()
+    format = forms.ChoiceField(
+        choices=[("", "Detect from file name"), ("csv", "CSV"), ("jsonl", "JSON Lines")],
+        required=False,
+    )
+
+
+class ExportForm(forms.Form):
+    format = forms.ChoiceField(choices=[("csv", "CSV"), ("jsonl", "JSON Lines")], required=False)
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+    category = forms.CharField(max_length=255, required=False)
+    currency = forms.CharField(max_length=3, required=False)
+
+    def clean_format(self):
+        return self.cleaned_data.get("format") or "csv"
+
+
+class SummaryForm(forms.Form):
+    MAX_YEARS = 50
+
+    start_year = forms.IntegerField(min_value=1, max_value=9998, required=False)
+    end_year = forms.IntegerField(min_value=1, max_value=9998, required=False)
+    split = forms.ChoiceField(choices=[("", "Total"), ("category", "Category")], required=False)
+    currency = forms.CharField(max_length=3, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get("start_year"), cleaned_data.get("end_year")
+        if start and end:
+            if start > end:
+                raise ValidationError("Start year must not be after end year.")
+            if end - start >= self.MAX_YEARS:
+                raise ValidationError(f"At most {self.MAX_YEARS} years can be compared.")
+        return cleaned_data
+
+    def year_range(self, data_years):
+        """(first, last) year to summarize; missing bounds default to the years that have data."""
+        start, end = self.cleaned_data.get("start_year"), self.cleaned_data.get("end_year")
+        if not end:
+            end = max(max(data_years, default=date.today().year), start or 1)
+        if not start:
+            start = min(min(data_years, default=end), end)
+        return max(start, end - self.MAX_YEARS + 1), end
+
+
+class ReportForm(forms.Form):
+    report = forms.ChoiceField(choices=ReportJob.REPORT_CHOICES)
+
+
+class SearchForm(forms.Form):
+    q = forms.CharField(max_length=200, required=False, label="Search")
+
+
+class ChangesForm(forms.Form):
+    since = forms.IntegerField(min_value=0, required=False)
+    limit = forms.IntegerField(min_value=1, required=False)
+
+    def clean_since(self):
+        return self.cleaned_data.get("since") or 0
+
+    def clean_limit(self):
+        return min(self.cleaned_data.get("limit") or settings.EXPENSES_CHANGES_PAGE_SIZE, settings.EXPENSES_CHANGES_PAGE_SIZE)
+
+
+class ChartForm(forms.Form):
+    MAX_MONTHS = 120
+    # date_range() ends at the first day of the month after end
+    LAST_END = date(9999, 11, 30)
+
+    year = forms.IntegerField(min_value=1, max_value=9998, required=False)
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+    split = forms.ChoiceField(choices=[("", "Total"), ("category", "Category")], required=False)
+    currency = forms.CharField(max_length=3, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get("start"), cleaned_data.get("end")
+        # Without an end the period runs to the end of start's year
+        last = end or (start and date(start.year, 12, 31))
+        if last and last > self.LAST_END:
+            self.add_error("end" if end else "start", f"The period must end by {self.LAST_END.isoformat()}.")
+            return cleaned_data
+        if start and end and start > end:
+            raise ValidationError("Start must not be after end.")
+        if start or end:
+            first, last = self.date_range()
+            if (last.year - first.year) * 12 + last.month - first.month > self.MAX_MONTHS:
+                raise ValidationError(f"At most {self.MAX_MONTHS} months can be charted.")
+        return cleaned_data
+
+    def date_range(self):
+        """Half-open [start, end) covering whole months of the requested period."""
+        start, end = self.cleaned_data.get("start"), self.cleaned_data.get("end")
+        if start or end:
+            year = (start or end).year
+            start = (start or date(year, 1, 1)).replace(day=1)
+            end = end or date(year, 12, 31)
+            end = date(end.year + 1, 1, 1) if end.month == 12 else date(end.year, end.month + 1, 1)
+            return start, end
+        year = self.cleaned_data.get("year") or date.today().year
+        return date(year, 1, 1), date(year + 1, 1, 1)
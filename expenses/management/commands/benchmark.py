@@ -0,0 +1,150 @@
+import json
+import math
+import platform
+import subprocess
+import time
+import tracemalloc
+from contextlib import ExitStack
+from datetime import date, datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from expenses.models import Expense
+
+BENCHMARK_TITLE = 'benchmark expense'
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(values)) - 1, 0)
+    return values[rank]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the expense views through the Django test client and report p50/p95/p99 latency, "
+        "query count and peak memory per view as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help="Username to benchmark as, e.g. one created by seed_expenses.")
+        parser.add_argument('--iterations', type=int, default=50, help="Timed requests per view.")
+        parser.add_argument('--warmup', type=int, default=3, help="Untimed requests per view before measuring.")
+        parser.add_argument('--year', type=int, default=date.today().year)
+        parser.add_argument('--output', '-o', help="Write the JSON results to this file as well as stdout.")
+        parser.add_argument(
+            '--session-store', choices=('db', 'cached_db', 'signed_cookies'),
+            help="Session engine to run with instead of SESSION_ENGINE.",
+        )
+        parser.add_argument(
+            '--user-cache-timeout', type=int,
+            help="AUTH_USER_CACHE_TIMEOUT to run with; 0 looks the user up on every request.",
+        )
+
+    def handle(self, *args, user, iterations, warmup, year, output, session_store, user_cache_timeout, **options):
+        if iterations <= 0 or warmup < 0:
+            raise CommandError("--iterations must be positive and --warmup not negative.")
+        try:
+            owner = User.objects.get(username=user)
+        except User.DoesNotExist:
+            raise CommandError(f"User '{user}' does not exist.")
+
+        overrides = {}
+        if session_store:
+            overrides['SESSION_ENGINE'] = f'django.contrib.sessions.backends.{session_store}'
+        if user_cache_timeout is not None:
+            overrides['AUTH_USER_CACHE_TIMEOUT'] = user_cache_timeout
+
+        # The test client talks to the 'testserver' host
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], **overrides):
+            try:
+                client = Client()
+                client.force_login(owner)
+                scenarios = {
+                    'expense_list': lambda: client.get(reverse('expense_list'), {'year': year}),
+                    'expense_list_async': lambda: client.get(reverse('expense_list_async'), {'year': year}),
+                    'chart_data': lambda: client.get(reverse('chart_data'), {'year': year, 'split': 'category'}),
+                    'add_expense': lambda: client.post(reverse('add_expense'), {
+                        'title': BENCHMARK_TITLE, 'amount': '1.00', 'category': 'Benchmark',
+                        'date': f'{year}-01-01', 'currency': 'PLN',
+                    }),
+                    'export_expenses': lambda: b''.join(
+                        client.get(reverse('export_expenses'), {'start': f'{year}-01-01', 'end': f'{year}-12-31'}).streaming_content
+                    ),
+                }
+                results = {name: self.measure(scenario, iterations, warmup) for name, scenario in scenarios.items()}
+            finally:
+                # Remove what add_expense created; signals keep the rollups in step
+                for expense in Expense.objects.filter(user=owner, title=BENCHMARK_TITLE):
+                    expense.delete()
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'database': connections['default'].vendor,
+                'user': user,
+                'expenses': Expense.objects.filter(user=owner).count(),
+                'iterations': iterations,
+                'year': year,
+                'session_engine': overrides.get('SESSION_ENGINE', settings.SESSION_ENGINE),
+                'user_cache_timeout': overrides.get('AUTH_USER_CACHE_TIMEOUT', settings.AUTH_USER_CACHE_TIMEOUT),
+            },
+            'views': results,
+        }
+        rendered = json.dumps(report, indent=2)
+        if output:
+            with open(output, 'w', encoding='utf-8') as destination:
+                destination.write(rendered + '\n')
+        self.stdout.write(rendered)
+
+    def measure(self, scenario, iterations, warmup):
+        for _ in range(warmup):
+            scenario()
+
+        durations = []
+        queries = []
+        for _ in range(iterations):
+            with ExitStack() as stack:
+                captured = [stack.enter_context(CaptureQueriesContext(connection)) for connection in connections.all()]
+                started = time.perf_counter()
+                scenario()
+                durations.append((time.perf_counter() - started) * 1000)
+            queries.append(sum(len(capture) for capture in captured))
+
+        # Memory tracing slows everything down, so it gets its own untimed pass
+        tracemalloc.start()
+        try:
+            scenario()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        durations.sort()
+        return {
+            'p50_ms': round(percentile(durations, 0.50), 3),
+            'p95_ms': round(percentile(durations, 0.95), 3),
+            'p99_ms': round(percentile(durations, 0.99), 3),
+            'mean_ms': round(sum(durations) / len(durations), 3),
+            'queries': round(sum(queries) / len(queries), 2),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
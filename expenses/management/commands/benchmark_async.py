@@ -0,0 +1,73 @@
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/s of the sync and async expense list views at a fixed concurrency "
+        "against a running server, e.g. `uvicorn budget_manager.asgi:application`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help="Root URL of the running server.")
+        parser.add_argument('--user', required=True, help="Username whose expense list is requested.")
+        parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight at any time.")
+        parser.add_argument('--requests', type=int, default=400, help="Requests sent to each view.")
+        parser.add_argument('--year', type=int, help="Year passed to the list views.")
+
+    def handle(self, *args, base_url, user, concurrency, requests, year, **options):
+        if concurrency <= 0 or requests <= 0:
+            raise CommandError("--concurrency and --requests must be positive.")
+        try:
+            owner = User.objects.get(username=user)
+        except User.DoesNotExist:
+            raise CommandError(f"User '{user}' does not exist.")
+
+        cookie = f'{settings.SESSION_COOKIE_NAME}={self.create_session(owner)}'
+        query = f'?year={year}' if year else ''
+        self.stdout.write(f"{'view':<20}{'requests/s':>12}{'mean ms':>10}{'errors':>8}")
+        for name in ('expense_list', 'expense_list_async'):
+            url = base_url.rstrip('/') + reverse(name) + query
+            self.fetch(url, cookie)  # warm up caches and connections
+            rate, mean, errors = self.run(url, cookie, concurrency, requests)
+            self.stdout.write(f"{name:<20}{rate:>12.1f}{mean * 1000:>10.1f}{errors:>8}")
+
+    def create_session(self, user):
+        # Same keys django.contrib.auth.login() stores, without needing a request,
+        # in the engine the server reads (SESSION_STORE)
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        # save() creates the session; for signed cookies the key is the cookie value
+        session.save()
+        return session.session_key
+
+    def fetch(self, url, cookie):
+        request = urllib.request.Request(url, headers={'Cookie': cookie})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                ok = response.status == 200 and response.url == url
+        except (urllib.error.URLError, OSError):
+            ok = False
+        return time.perf_counter() - started, ok
+
+    def run(self, url, cookie, concurrency, requests):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: self.fetch(url, cookie), range(requests)))
+        elapsed = time.perf_counter() - started
+        errors = sum(1 for _, ok in results if not ok)
+        mean = sum(duration for duration, _ in results) / len(results)
+        return requests / elapsed, mean, errors
@@ -0,0 +1,54 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from expenses.archives import archived_expenses
+from expenses.exporters import EXPORT_FIELDS, RENDERERS, export_stream, filter_expenses
+from expenses.models import Expense
+
+
+def date_argument(value):
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Dump expenses of all (or selected) users as CSV or JSON Lines for offline processing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help="Destination file, stdout by default.")
+        parser.add_argument('--format', choices=sorted(RENDERERS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output.")
+        parser.add_argument('--user', type=int, action='append', dest='users', help="Only export this user id (repeatable).")
+        parser.add_argument('--start', type=date_argument, help="First date to include (YYYY-MM-DD).")
+        parser.add_argument('--end', type=date_argument, help="Last date to include (YYYY-MM-DD).")
+        parser.add_argument('--category')
+        parser.add_argument('--currency')
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPENSES_EXPORT_CHUNK_SIZE,
+                            help="Rows fetched per database round trip.")
+
+    def handle(self, *args, output, format, gzip, users, start, end, category, currency, chunk_size, **options):
+        if chunk_size <= 0:
+            raise CommandError("--chunk-size must be positive.")
+        queryset = Expense.objects.all()
+        if users:
+            queryset = queryset.filter(user_id__in=users)
+        queryset = filter_expenses(queryset, start=start, end=end, category=category, currency=currency)
+        # Walk users in (user, date) index order so the dump never needs a sort step
+        queryset = queryset.order_by('user_id', 'date', 'id')
+        fields = ('user_id',) + EXPORT_FIELDS
+        archived = archived_expenses(users, start=start, end=end, category=category, currency=currency)
+
+        destination = open(output, 'wb') if output else sys.stdout.buffer
+        try:
+            for chunk in export_stream(queryset, format, chunk_size, fields=fields, compress=gzip, archived=archived):
+                destination.write(chunk)
+        finally:
+            if output:
+                destination.close()
+            else:
+                destination.flush()
@@ -0,0 +1,44 @@
+import csv
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.importers import FORMATS, detect_format, import_expenses
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV or JSON Lines file of expenses into the database for one user."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import.")
+        parser.add_argument('--user', required=True, help="Username that will own the imported expenses.")
+        parser.add_argument('--format', choices=FORMATS, help="Input format, detected from the file name by default.")
+        parser.add_argument('--batch-size', type=int, default=settings.EXPENSES_IMPORT_BATCH_SIZE,
+                            help="Rows inserted per bulk_create and transaction.")
+        parser.add_argument('--errors', help="Write rejected rows to this CSV file instead of stderr.")
+
+    def handle(self, *args, path, user, format, batch_size, errors, **options):
+        if batch_size <= 0:
+            raise CommandError("--batch-size must be positive.")
+        try:
+            owner = User.objects.get(username=user)
+        except User.DoesNotExist:
+            raise CommandError(f"User '{user}' does not exist.")
+
+        with open(path, 'rb') as source:
+            result = import_expenses(owner, source, format or detect_format(path), batch_size)
+
+        if errors:
+            with open(errors, 'w', newline='', encoding='utf-8') as report:
+                writer = csv.writer(report)
+                writer.writerow(['line', 'error'])
+                writer.writerows(result.errors)
+        else:
+            for line_number, message in result.errors:
+                self.stderr.write(f"Line {line_number}: {message}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} expenses in {result.elapsed:.2f}s "
+            f"({result.rows_per_second:.0f} rows/s), {len(result.errors)} rows rejected."
+        ))
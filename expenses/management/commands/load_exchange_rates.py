@@ -0,0 +1,64 @@
+import csv
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from expenses.currency import bump_rates_version
+from expenses.models import ExchangeRate
+from expenses.rollups import bump_all_versions
+
+
+def parse_rate_row(row):
+    day = parse_date(row['date'] or '')
+    base, quote = (row['base'] or '').strip().upper(), (row['quote'] or '').strip().upper()
+    # A short row has None for its missing columns; Decimal(None) raises TypeError
+    rate = Decimal(row['rate'])
+    if day is None or len(base) != 3 or len(quote) != 3 or not rate.is_finite() or rate <= 0:
+        raise ValueError
+    return ExchangeRate(date=day, base=base, quote=quote, rate=rate)
+
+
+class Command(BaseCommand):
+    help = "Bulk-load exchange rate history from CSV files with date,base,quote,rate columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="CSV files to load.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rates upserted per statement.")
+
+    def handle(self, *args, paths, batch_size, **options):
+        if batch_size <= 0:
+            raise CommandError("--batch-size must be positive.")
+        loaded = skipped = 0
+        for path in paths:
+            with open(path, newline='', encoding='utf-8-sig') as source:
+                reader = csv.DictReader(source)
+                missing = {'date', 'base', 'quote', 'rate'} - set(reader.fieldnames or ())
+                if missing:
+                    raise CommandError(f"{path}: missing columns {', '.join(sorted(missing))}.")
+                numbered = ((reader.line_num, row) for row in reader)
+                while True:
+                    rows = list(islice(numbered, batch_size))
+                    if not rows:
+                        break
+                    rates = []
+                    for line_number, row in rows:
+                        try:
+                            rates.append(parse_rate_row(row))
+                        except (ValueError, TypeError, InvalidOperation):
+                            skipped += 1
+                            self.stderr.write(f"{path}:{line_number}: skipping invalid row {row}")
+                    with transaction.atomic():
+                        ExchangeRate.objects.bulk_create(
+                            rates, update_conflicts=True,
+                            unique_fields=['base', 'quote', 'date'], update_fields=['rate'],
+                        )
+                    loaded += len(rates)
+
+        # bulk_create skips signals, so invalidate rate lookups of every process and converted totals explicitly
+        with transaction.atomic():
+            bump_rates_version()
+            bump_all_versions()
+        self.stdout.write(self.style.SUCCESS(f"Loaded {loaded} exchange rates, skipped {skipped} invalid rows."))
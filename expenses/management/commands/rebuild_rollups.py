@@ -0,0 +1,64 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from expenses.archives import archived_rollup_rows
+from expenses.models import MonthlyTotal
+from expenses.rollups import compute_rollups, rollup_key
+
+
+class Command(BaseCommand):
+    help = "Recompute the MonthlyTotal rollup from the Expense table and the archives, or check it for drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of users processed per transaction.")
+        parser.add_argument('--user', type=int, action='append', dest='users', help="Only process this user id (repeatable).")
+        parser.add_argument('--check', action='store_true', help="Report drift without modifying the rollup.")
+
+    def handle(self, *args, batch_size, users, check, **options):
+        if batch_size <= 0:
+            raise CommandError("--batch-size must be positive.")
+        user_ids = User.objects.order_by('pk').values_list('pk', flat=True)
+        if users:
+            user_ids = user_ids.filter(pk__in=users)
+
+        drifted = rebuilt = 0
+        last_pk = 0
+        while True:
+            batch = list(user_ids.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            with transaction.atomic():
+                expected = {}
+                # A month of an archived year may also have expenses added after archiving
+                for row in [*compute_rollups(batch), *archived_rollup_rows(batch)]:
+                    total, count = expected.get(rollup_key(row), (0, 0))
+                    expected[rollup_key(row)] = (total + row['total_minor'], count + row['count'])
+                current = {
+                    rollup_key(row): (row['total_minor'], row['count'])
+                    for row in MonthlyTotal.objects.filter(user_id__in=batch)
+                    .values('user_id', 'month', 'category', 'currency', 'total_minor', 'count')
+                }
+                for key in sorted(expected.keys() | current.keys(), key=str):
+                    if expected.get(key) != current.get(key):
+                        drifted += 1
+                        self.stdout.write(f"Drift {key}: expected {expected.get(key)}, found {current.get(key)}")
+                if check:
+                    continue
+                MonthlyTotal.objects.filter(user_id__in=batch).delete()
+                MonthlyTotal.objects.bulk_create(
+                    [
+                        MonthlyTotal(user_id=user_id, month=month, category=category, currency=currency, total_minor=total, count=count)
+                        for (user_id, month, category, currency), (total, count) in expected.items()
+                    ],
+                    batch_size=1000,
+                )
+                rebuilt += len(expected)
+
+        if check:
+            if drifted:
+                raise CommandError(f"{drifted} rollup rows drifted from the Expense table.")
+            self.stdout.write(self.style.SUCCESS("Rollup matches the Expense table."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} rollup rows, fixed {drifted} drifted rows."))
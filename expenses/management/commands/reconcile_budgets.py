@@ -0,0 +1,82 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from expenses.archives import archived_rollup_rows
+from expenses.budgets import current_month, refresh_alerts
+from expenses.models import Budget, Expense, MonthlyTotal
+from expenses.rollups import bump_versions
+
+
+def parse_month(value):
+    return date.fromisoformat(f'{value}-01')
+
+
+class Command(BaseCommand):
+    help = (
+        "Verify the monthly spent counters behind category budgets against the Expense table, "
+        "in batches of budgets, and optionally repair them and their alerts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', type=parse_month, help="Month to check as YYYY-MM; the current month by default.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of budgets checked per transaction.")
+        parser.add_argument('--fix', action='store_true', help="Rewrite drifted counters and re-evaluate alerts.")
+
+    def handle(self, *args, month, batch_size, fix, **options):
+        if batch_size <= 0:
+            raise CommandError("--batch-size must be positive.")
+        month = month or current_month()
+        next_month = date(month.year + 1, 1, 1) if month.month == 12 else date(month.year, month.month + 1, 1)
+
+        checked = drifted = 0
+        last_pk = 0
+        while True:
+            batch = list(Budget.objects.filter(pk__gt=last_pk).order_by('pk').select_related('category')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            keys = {(budget.user_id, budget.category.name) for budget in batch}
+            users = {user_id for user_id, _ in keys}
+            categories = {category for _, category in keys}
+            with transaction.atomic():
+                rows = Expense.objects.filter(
+                    user_id__in=users, category__in=categories, date__gte=month, date__lt=next_month,
+                ).values('user_id', 'category', 'currency').annotate(total_minor=Sum('amount_minor'), count=Count('id')).order_by()
+                expected = {}
+                for row in [*rows, *archived_rollup_rows(users, month, next_month)]:
+                    key = (row['user_id'], row['category'], row['currency'])
+                    if key[:2] in keys:
+                        total, count = expected.get(key, (0, 0))
+                        expected[key] = (total + row['total_minor'], count + row['count'])
+                current = {
+                    (row['user_id'], row['category'], row['currency']): (row['total_minor'], row['count'])
+                    for row in MonthlyTotal.objects.filter(user_id__in=users, category__in=categories, month=month)
+                    .values('user_id', 'category', 'currency', 'total_minor', 'count')
+                    if (row['user_id'], row['category']) in keys
+                }
+                wrong = sorted(key for key in expected.keys() | current.keys() if expected.get(key) != current.get(key))
+                for key in wrong:
+                    self.stdout.write(f"Drift {month:%Y-%m} {key}: expected {expected.get(key)}, found {current.get(key)}")
+                checked += len(batch)
+                drifted += len(wrong)
+                if not fix:
+                    continue
+                for user_id, category, currency in wrong:
+                    row = {'user_id': user_id, 'month': month, 'category': category, 'currency': currency}
+                    MonthlyTotal.objects.filter(**row).delete()
+                    if (user_id, category, currency) in expected:
+                        total_minor, count = expected[(user_id, category, currency)]
+                        MonthlyTotal.objects.create(total_minor=total_minor, count=count, **row)
+                for budget in batch:
+                    refresh_alerts(budget, month)
+                bump_versions(sorted({user_id for user_id, _, _ in wrong}))
+
+        if fix:
+            self.stdout.write(self.style.SUCCESS(f"Checked {checked} budgets, fixed {drifted} drifted counters."))
+        elif drifted:
+            raise CommandError(f"{drifted} budget counters drifted from the Expense table.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Checked {checked} budgets; all counters match the Expense table."))
@@ -0,0 +1,113 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from expenses import report_worker
+from expenses.reports import claim_jobs, fail_jobs, requeue_stale_jobs, run_job
+
+
+def concurrent_readers_allowed():
+    """Whether jobs can write their progress while other jobs hold long read transactions."""
+    connection = connections['default']
+    if connection.vendor != 'sqlite':
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        return cursor.fetchone()[0].lower() == 'wal'
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued report jobs on a pool of worker processes, polling the ReportJob table for new ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help="Worker processes; 0 runs the jobs one by one in this process.",
+        )
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds between checks for new jobs.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty instead of waiting for jobs.")
+
+    def handle(self, *args, workers, poll_interval, once, **options):
+        if workers < 0 or poll_interval <= 0:
+            raise CommandError("--workers must not be negative and --poll-interval must be positive.")
+        if workers > 1 and not concurrent_readers_allowed():
+            self.stderr.write(
+                "SQLite is not in WAL mode, where a report reading the database blocks the others' writes; "
+                "running one worker. Set DATABASE_PROFILE=production to run several."
+            )
+            workers = 1
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f"Queued {requeued} stale jobs again.")
+        if workers == 0:
+            self.run_inline(poll_interval, once)
+        else:
+            self.run_pool(workers, poll_interval, once)
+
+    def finished(self, job_id, status, started):
+        self.stdout.write(f"Job {job_id} {status} in {time.perf_counter() - started:.2f}s.")
+
+    def run_inline(self, poll_interval, once):
+        while True:
+            claimed = claim_jobs(1)
+            if not claimed:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+            started = time.perf_counter()
+            self.finished(claimed[0], run_job(claimed[0]), started)
+
+    def run_pool(self, workers, poll_interval, once):
+        # Nothing open may leak into the pool processes
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        while True:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=report_worker.setup) as pool:
+                if self.serve(pool, workers, poll_interval, once):
+                    return
+            self.stderr.write("A worker process died; starting a new pool.")
+
+    def serve(self, pool, workers, poll_interval, once):
+        """Run jobs on pool until the queue is empty with once (returns True) or the pool breaks (returns False)."""
+        running = {}
+        while True:
+            if len(running) < workers:
+                for job_id in claim_jobs(workers - len(running)):
+                    try:
+                        running[pool.submit(report_worker.run, job_id)] = (job_id, time.perf_counter())
+                    except BrokenProcessPool:
+                        self.lost([job_id] + [job_id for job_id, _ in running.values()])
+                        return False
+            if not running:
+                if once:
+                    return True
+                time.sleep(poll_interval)
+                continue
+            done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id, started = running.pop(future)
+                exception = future.exception()
+                if isinstance(exception, BrokenProcessPool):
+                    # Which job killed the worker is unknown; every job of the pool is lost
+                    self.lost([job_id] + [job_id for job_id, _ in running.values()])
+                    return False
+                if exception is not None:
+                    self.stderr.write(f"Job {job_id} crashed its worker: {exception!r}")
+                    fail_jobs([job_id], f'{type(exception).__name__}: {exception}')
+                else:
+                    self.finished(job_id, future.result()[1], started)
+
+    def lost(self, job_ids):
+        # Failed rather than queued again, so a job that kills its worker
+        # (out of memory, say) is not retried forever; requesting it again queues it
+        fail_jobs(job_ids, 'The worker process running the job died.')
+        for job_id in job_ids:
+            self.stderr.write(f"Job {job_id} failed: its worker process died.")
@@ -0,0 +1,100 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.importers import save_batch
+from expenses.models import Expense
+
+# (category, relative frequency, median amount in PLN)
+CATEGORIES = [
+    ('Food', 40, 45),
+    ('Transport', 15, 25),
+    ('Bills', 10, 250),
+    ('Entertainment', 10, 60),
+    ('Health', 5, 120),
+    ('Clothes', 5, 150),
+    ('Travel', 3, 900),
+    ('Rent', 2, 2500),
+    ('Gifts', 5, 100),
+    ('Other', 5, 40),
+]
+CURRENCIES = [('PLN', 85, Decimal('1')), ('EUR', 10, Decimal('0.23')), ('USD', 5, Decimal('0.25'))]
+# Relative spend per month, with peaks around holidays and summer
+SEASONALITY = [0.9, 0.8, 0.9, 1.0, 1.0, 1.1, 1.3, 1.3, 1.0, 1.0, 1.1, 1.6]
+TITLES = {
+    'Food': ['Groceries', 'Restaurant', 'Bakery', 'Lunch', 'Coffee'],
+    'Transport': ['Bus ticket', 'Fuel', 'Taxi', 'Train'],
+    'Bills': ['Electricity', 'Internet', 'Phone', 'Water'],
+    'Entertainment': ['Cinema', 'Concert', 'Streaming', 'Books'],
+    'Health': ['Pharmacy', 'Dentist', 'Doctor'],
+    'Clothes': ['Shoes', 'Jacket', 'T-shirt'],
+    'Travel': ['Hotel', 'Flight', 'Tour'],
+    'Rent': ['Rent'],
+    'Gifts': ['Birthday gift', 'Flowers'],
+    'Other': ['Haircut', 'Repair', 'Stationery'],
+}
+
+
+class Command(BaseCommand):
+    help = "Bulk-generate N users x M expenses with realistic, seed-deterministic distributions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--expenses', type=int, default=1000, help="Expenses generated per user.")
+        parser.add_argument('--years', type=int, default=3, help="Spread expenses over this many years up to --end.")
+        parser.add_argument('--end', type=date.fromisoformat, default=date.today(),
+                            help="Last possible expense date (YYYY-MM-DD), today by default. Fix it for reproducible data.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='seed', help="Usernames are PREFIX0, PREFIX1, ...")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--clear', action='store_true', help="Delete existing users with the same names first.")
+
+    def handle(self, *args, users, expenses, years, end, seed, prefix, batch_size, clear, **options):
+        if users <= 0 or expenses < 0 or years <= 0 or batch_size <= 0:
+            raise CommandError("--users, --years and --batch-size must be positive and --expenses not negative.")
+        usernames = [f'{prefix}{index}' for index in range(users)]
+        existing = User.objects.filter(username__in=usernames)
+        if clear:
+            existing.delete()
+        elif existing.exists():
+            raise CommandError(f"Users with prefix '{prefix}' already exist; use --clear or another --prefix.")
+
+        password = make_password(None)
+        owners = User.objects.bulk_create([User(username=name, password=password) for name in usernames])
+        if owners[0].pk is None:
+            owners = list(User.objects.filter(username__in=usernames).order_by('pk'))
+
+        rng = random.Random(seed)
+        start = end.replace(year=end.year - years + 1, month=1, day=1)
+        span = (end - start).days
+        month_weights = [SEASONALITY[(start + timedelta(days=offset)).month - 1] for offset in range(span + 1)]
+        category_weights = [weight for _, weight, _ in CATEGORIES]
+        currency_weights = [weight for _, weight, _ in CURRENCIES]
+
+        created = 0
+        batch = []
+        for owner in owners:
+            day_offsets = rng.choices(range(span + 1), weights=month_weights, k=expenses)
+            for offset in day_offsets:
+                category, _, median = rng.choices(CATEGORIES, weights=category_weights)[0]
+                currency, _, factor = rng.choices(CURRENCIES, weights=currency_weights)[0]
+                amount = Decimal(str(round(median * rng.lognormvariate(0, 0.6), 2))) * factor
+                batch.append(Expense(
+                    user=owner,
+                    title=rng.choice(TITLES[category]),
+                    amount=max(amount.quantize(Decimal('0.01')), Decimal('0.01')),
+                    category=category,
+                    date=start + timedelta(days=offset),
+                    currency=currency,
+                ))
+                if len(batch) >= batch_size:
+                    created += save_batch(batch)
+                    batch = []
+        if batch:
+            created += save_batch(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Created {len(owners)} users and {created} expenses."))
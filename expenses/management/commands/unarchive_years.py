@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from expenses.archives import unarchive_year
+from expenses.models import ExpenseArchive
+
+
+class Command(BaseCommand):
+    help = "Move a user's archived expenses back into the Expense table, e.g. to correct them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, required=True, help="User id whose archives are restored.")
+        parser.add_argument('--year', type=int, action='append', dest='years', help="Only restore this year (repeatable).")
+
+    def handle(self, *args, user, years, **options):
+        archived = ExpenseArchive.objects.filter(user_id=user).order_by('year').values_list('year', flat=True)
+        if years:
+            archived = archived.filter(year__in=years)
+        restored = 0
+        for year in list(archived):
+            count = unarchive_year(user, year)
+            restored += count
+            self.stdout.write(f"Restored {count} expenses of {year}.")
+        self.stdout.write(self.style.SUCCESS(f"Restored {restored} expenses of user {user}."))
@@ -0,0 +1,58 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+USER_BATCH_SIZE = 200
+
+
+def category_key(name):
+    return ' '.join(name.split()).casefold()
+
+
+def dedupe_categories(apps, schema_editor):
+    Category = apps.get_model('expenses', 'Category')
+    Expense = apps.get_model('expenses', 'Expense')
+    MonthlyTotal = apps.get_model('expenses', 'MonthlyTotal')
+
+    user_ids = list(Expense.objects.values_list('user_id', flat=True).distinct().order_by('user_id'))
+    for offset in range(0, len(user_ids), USER_BATCH_SIZE):
+        batch = user_ids[offset:offset + USER_BATCH_SIZE]
+        renamed_users = set()
+        # Most used spelling first, so it becomes the canonical name of its key
+        spellings = list(
+            Expense.objects.filter(user_id__in=batch)
+            .values('user_id', 'category').annotate(uses=Count('id'))
+            .order_by('user_id', '-uses', 'category')
+        )
+        categories = {}
+        for row in spellings:
+            key = (row['user_id'], category_key(row['category']))
+            if key not in categories:
+                categories[key] = Category.objects.create(user_id=row['user_id'], name=' '.join(row['category'].split()), key=key[1])
+            category = categories[key]
+            Expense.objects.filter(user_id=row['user_id'], category=row['category']).update(
+                category_ref=category, category=category.name,
+            )
+            if row['category'] != category.name:
+                renamed_users.add(row['user_id'])
+
+        # Merged spellings change rollup keys, so recompute those users' rollups
+        if renamed_users:
+            MonthlyTotal.objects.filter(user_id__in=renamed_users).delete()
+            rows = (
+                Expense.objects.filter(user_id__in=renamed_users).annotate(month=TruncMonth('date'))
+                .values('user_id', 'month', 'category', 'currency')
+                .annotate(total=Sum('amount'), count=Count('id')).order_by()
+            )
+            MonthlyTotal.objects.bulk_create((MonthlyTotal(**row) for row in rows), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0006_category'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_categories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_dedupe_categories'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expense',
+            name='category_ref',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='expenses.category'),
+        ),
+    ]
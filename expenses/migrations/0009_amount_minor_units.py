@@ -0,0 +1,87 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+# Copy of expenses.money as of this migration
+CURRENCY_EXPONENTS = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0,
+    'PYG': 0, 'RWF': 0, 'UGX': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+}
+
+
+def exponent(currency):
+    return CURRENCY_EXPONENTS.get((currency or '').upper(), 2)
+
+
+def to_minor(amount, currency):
+    return int((Decimal(amount) * 10 ** exponent(currency)).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_minor(value, currency):
+    return Decimal(value).scaleb(-exponent(currency))
+
+
+def convert_batches(model, source, target, convert):
+    """Fill target from source in primary key order, one bulk_update per batch."""
+    last_pk = 0
+    while True:
+        batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'currency', source)[:BATCH_SIZE])
+        if not batch:
+            break
+        for row in batch:
+            setattr(row, target, convert(getattr(row, source), row.currency))
+        model.objects.bulk_update(batch, [target])
+        last_pk = batch[-1].pk
+
+
+def amounts_to_minor(apps, schema_editor):
+    convert_batches(apps.get_model('expenses', 'Expense'), 'amount', 'amount_minor', to_minor)
+    convert_batches(apps.get_model('expenses', 'MonthlyTotal'), 'total', 'total_minor', to_minor)
+
+
+def amounts_from_minor(apps, schema_editor):
+    convert_batches(apps.get_model('expenses', 'Expense'), 'amount_minor', 'amount', from_minor)
+    convert_batches(apps.get_model('expenses', 'MonthlyTotal'), 'total_minor', 'total', from_minor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_expense_category_ref_set_null'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='amount_minor',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='monthlytotal',
+            name='total_minor',
+            field=models.BigIntegerField(default=0),
+        ),
+        # Nullable while both columns exist so the migration can also run backwards
+        migrations.AlterField(
+            model_name='expense',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(amounts_to_minor, amounts_from_minor),
+        migrations.AlterField(
+            model_name='expense',
+            name='amount_minor',
+            field=models.BigIntegerField(),
+        ),
+        migrations.RemoveField(
+            model_name='expense',
+            name='amount',
+        ),
+        migrations.RemoveField(
+            model_name='monthlytotal',
+            name='total',
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from expenses.search import install_search_index, uninstall_search_index
+
+
+def create_search_index(apps, schema_editor):
+    # Databases without FTS5 (or not SQLite) keep using the icontains fallback
+    install_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0009_amount_minor_units'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.1 on 2026-10-18 06:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0013_expense_date_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expense_id', models.BigIntegerField(db_index=True)),
+                ('client_id', models.UUIDField(blank=True, null=True)),
+                ('deleted', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='client_id',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='expense',
+            constraint=models.UniqueConstraint(condition=models.Q(('client_id__isnull', False)), fields=('user', 'client_id'), name='expense_unique_user_client_id'),
+        ),
+        migrations.AddField(
+            model_name='expensechange',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='expensechange',
+            index=models.Index(fields=['user', 'id'], name='expensechange_user_id_idx'),
+        ),
+        # Existing expenses enter the feed once, in id order, so a first sync from cursor 0 sees them all
+        migrations.RunSQL(
+            "INSERT INTO expenses_expensechange (user_id, expense_id, client_id, deleted) "
+            "SELECT user_id, id, NULL, FALSE FROM expenses_expense ORDER BY id",
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0016_expense_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRateVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,14 +1,326 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 
+from .money import from_minor, to_minor
+
 # Create your models here.
+class Category(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    # Case-folded, whitespace-collapsed name; "Food", "food " and "FOOD" share one row
+    key = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='category_unique_user_key'),
+        ]
+        verbose_name_plural = 'categories'
+
+    def __str__(self):
+        return self.name
+
+
 class Expense(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
-    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Integer count of the currency's minor units (grosze, cents); see amount
+    amount_minor = models.BigIntegerField()
     category = models.CharField(max_length=255)
+    category_ref = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, editable=False)
     date = models.DateField()
     currency = models.CharField(max_length=3, default='PLN')
+    # Set on expenses generated from a recurring rule, one per occurrence date
+    recurring = models.ForeignKey('RecurringExpense', on_delete=models.SET_NULL, null=True, blank=True, editable=False)
+    occurrence = models.DateField(null=True, blank=True, editable=False)
+    # Id generated by an offline client; upserts from the sync API are keyed by it
+    client_id = models.UUIDField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date'], name='expense_user_date_idx'),
+            models.Index(fields=['user', 'category', 'date'], name='expense_user_cat_date_idx'),
+            # Admin date hierarchy and date range filters across all users
+            models.Index(fields=['date'], name='expense_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recurring', 'occurrence'], condition=models.Q(recurring__isnull=False),
+                name='expense_unique_recurring_occurrence',
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'client_id'], condition=models.Q(client_id__isnull=False),
+                name='expense_unique_user_client_id',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.amount} - {self.date}"
+
+    @property
+    def amount(self):
+        """Decimal view of amount_minor; assigning it (also as a constructor keyword) sets amount_minor."""
+        if self.amount_minor is None:
+            return None
+        return from_minor(self.amount_minor, self.currency)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_minor = None if value is None else to_minor(value, self.currency)
+
+    def save(self, *args, **kwargs):
+        # Rollup signal handlers must commit or roll back together with the row
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class RecurringExpense(models.Model):
+    """Rule generating an Expense every week, month or year from start_date until end_date."""
+    WEEKLY = 'weekly'
+    MONTHLY = 'monthly'
+    YEARLY = 'yearly'
+    FREQUENCY_CHOICES = [(WEEKLY, 'Weekly'), (MONTHLY, 'Monthly'), (YEARLY, 'Yearly')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    title = models.CharField(max_length=255)
+    amount_minor = models.BigIntegerField()
+    category = models.CharField(max_length=255)
+    category_ref = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, editable=False)
+    currency = models.CharField(max_length=3, default='PLN')
+    frequency = models.CharField(max_length=7, choices=FREQUENCY_CHOICES, default=MONTHLY)
+    start_date = models.DateField()
+    end_date = models.DateField(null=True, blank=True)
+    # First occurrence not materialized yet; None once the rule has ended
+    next_date = models.DateField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_date'], name='recurring_next_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.title} - {self.amount} {self.currency} - {self.frequency}"
+
+    @property
+    def amount(self):
+        if self.amount_minor is None:
+            return None
+        return from_minor(self.amount_minor, self.currency)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_minor = None if value is None else to_minor(value, self.currency)
+
+
+class ExpenseChange(models.Model):
+    """
+    Change feed of a user's expenses for the sync API.
+
+    The log keeps only the latest change of every expense: writing a new one
+    replaces the previous row, and its ever-growing id is the feed cursor.
+    Deleted expenses leave a tombstone row with deleted set.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    expense_id = models.BigIntegerField(db_index=True)
+    client_id = models.UUIDField(null=True, blank=True)
+    deleted = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='expensechange_user_id_idx'),
+        ]
+
+
+class ExpenseArchive(models.Model):
+    """
+    A user's expenses of one closed year, moved out of the Expense table by
+    the archive_years command.
+
+    data holds the rows as compressed columns (see expenses.archives) and
+    totals their month and category totals, so aggregates never decode it.
+    The MonthlyTotal rollup keeps covering archived years unchanged.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    year = models.PositiveSmallIntegerField()
+    row_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    totals = models.JSONField()
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'year'], name='expensearchive_unique_year'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.year} - {self.row_count} expenses"
+
+
+class ArchivedClientId(models.Model):
+    """
+    client_id of an expense moved into an ExpenseArchive, so that sync
+    batches changing it are refused instead of creating a second copy of it.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    archive = models.ForeignKey(ExpenseArchive, on_delete=models.CASCADE, related_name='client_ids')
+    client_id = models.UUIDField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'client_id'], name='archivedclientid_unique_client_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.client_id}"
+
+
+class MonthlyTotal(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    month = models.DateField()
+    category = models.CharField(max_length=255)
+    currency = models.CharField(max_length=3, default='PLN')
+    total_minor = models.BigIntegerField(default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month', 'category', 'currency'], name='monthlytotal_unique_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.month:%Y-%m} - {self.category} - {self.total} {self.currency}"
+
+    @property
+    def total(self):
+        return from_minor(self.total_minor, self.currency)
+
+
+class UserDataVersion(models.Model):
+    """Per-user counter bumped on every change to the user's expenses."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} - v{self.version}"
+
+
+class ExchangeRate(models.Model):
+    """Price of one unit of base expressed in quote, effective from date."""
+    date = models.DateField()
+    base = models.CharField(max_length=3)
+    quote = models.CharField(max_length=3)
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['base', 'quote', 'date'], name='exchangerate_unique_pair_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.base}/{self.quote} - {self.rate}"
+
+
+class ExchangeRateVersion(models.Model):
+    """
+    Single-row counter bumped whenever exchange rates change, from any
+    process; every process keys its cache of rate lookups on it.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"rates v{self.version}"
+
+
+class Budget(models.Model):
+    """Monthly spending limit of one category, in its own currency."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    limit_minor = models.BigIntegerField()
+    currency = models.CharField(max_length=3, default='PLN')
+    # Usage (in percent of the limit) at which an alert is raised besides 100%
+    alert_percent = models.PositiveSmallIntegerField(default=80)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category'], name='budget_unique_user_category'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.category} - {self.limit} {self.currency}"
+
+    @property
+    def limit(self):
+        return from_minor(self.limit_minor, self.currency)
+
+    @limit.setter
+    def limit(self, value):
+        self.limit_minor = to_minor(value, self.currency)
+
+    def thresholds(self):
+        return sorted({self.alert_percent, 100})
+
+
+class BudgetAlert(models.Model):
+    """Raised when a month's spending in a budget's category reaches percent of its limit."""
+    budget = models.ForeignKey(Budget, on_delete=models.CASCADE)
+    month = models.DateField()
+    percent = models.PositiveSmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set once the user has been told, e.g. right after the expense that crossed it
+    notified = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['budget', 'month', 'percent'], name='budgetalert_unique_threshold'),
+        ]
+
+    def __str__(self):
+        return f"{self.budget} - {self.month:%Y-%m} - {self.percent}%"
+
+
+class ReportJob(models.Model):
+    """
+    A report built in the background by the run_report_jobs worker.
+
+    The table is the queue: queued jobs are claimed oldest first. A user gets
+    one job per report and data version, so asking again before anything
+    changed returns the job already queued, running or done.
+    """
+    ANNUAL_SUMMARY = 'annual_summary'
+    FULL_EXPORT = 'full_export'
+    REPORT_CHOICES = [
+        (ANNUAL_SUMMARY, 'Annual summary (CSV)'),
+        (FULL_EXPORT, 'All expenses (gzipped CSV)'),
+    ]
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    report = models.CharField(max_length=20, choices=REPORT_CHOICES)
+    # UserDataVersion.version the job was requested at
+    data_version = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    result = models.FileField(upload_to='reports/%Y/%m/', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'report', 'data_version'], name='reportjob_unique_version'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'id'], name='reportjob_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.report} - v{self.data_version} - {self.status}"
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
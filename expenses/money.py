@@ -0,0 +1,30 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+# Digits after the decimal point of the currencies that do not use two (ISO 4217)
+CURRENCY_EXPONENTS = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0,
+    'PYG': 0, 'RWF': 0, 'UGX': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+}
+DEFAULT_EXPONENT = 2
+
+
+def exponent(currency):
+    return CURRENCY_EXPONENTS.get((currency or '').upper(), DEFAULT_EXPONENT)
+
+
+def has_minor_precision(amount, currency):
+    """Whether amount has no more decimal places than currency allows."""
+    amount = Decimal(amount)
+    return amount == amount.quantize(Decimal(1).scaleb(-exponent(currency)))
+
+
+def to_minor(amount, currency):
+    """Convert a decimal amount into an integer count of the currency's minor units (grosze, cents)."""
+    return int((Decimal(amount) * 10 ** exponent(currency)).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_minor(value, currency):
+    """Decimal amount of an integer count of minor units, e.g. 1250 PLN grosze -> Decimal('12.50')."""
+    # Shifting the exponent of an integer keeps exactly that many decimal places
+    return Decimal(value).scaleb(-exponent(currency))
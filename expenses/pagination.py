@@ -0,0 +1,78 @@
+import heapq
+from datetime import date
+
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'expenses.cursor'
+# Types of the (date, id) values of a keyset_page() cursor
+KEYSET_TYPES = (date.fromisoformat, int)
+
+
+def encode_cursor(*values, salt=CURSOR_SALT):
+    return signing.dumps([str(value) for value in values], salt=salt, compress=True)
+
+
+def decode_cursor(token, types=KEYSET_TYPES, salt=CURSOR_SALT):
+    """
+    Return the values stored in a cursor token converted by types, or None if
+    it is missing, tampered with or does not hold one value of each type.
+    """
+    if not token:
+        return None
+    try:
+        values = signing.loads(token, salt=salt)
+        if not isinstance(values, list) or len(values) != len(types):
+            return None
+        return [convert(value) for convert, value in zip(types, values)]
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+
+
+def _keyset_queryset(queryset, after, page_size):
+    queryset = queryset.order_by('-date', '-id')
+    cursor = decode_cursor(after)
+    if cursor:
+        last_date, last_id = cursor
+        queryset = queryset.filter(Q(date__lt=last_date) | Q(date=last_date, id__lt=last_id))
+    # One extra row tells whether there is a next page
+    return queryset[:page_size + 1]
+
+
+def _merge_extra(items, extra, after, page_size):
+    """items of a page slice merged with the objects of extra that belong in the same page."""
+    cursor = decode_cursor(after)
+    if cursor:
+        extra = [item for item in extra if (item.date, item.id) < tuple(cursor)]
+    return heapq.nlargest(page_size + 1, [*items, *extra], key=lambda item: (item.date, item.id))
+
+
+def _finish_page(items, page_size):
+    next_token = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_token = encode_cursor(items[-1].date.isoformat(), items[-1].id)
+    return items, next_token
+
+
+def keyset_page(queryset, after, page_size, extra=None):
+    """
+    Return (items, next_token) for a queryset ordered by (-date, -id).
+
+    Rows are located with a WHERE on the last seen (date, id) pair instead of an
+    OFFSET, so every page costs the same regardless of how deep the user scrolls.
+    extra are objects outside the queryset, like archived expenses, paged
+    together with its rows.
+    """
+    items = list(_keyset_queryset(queryset, after, page_size))
+    if extra is not None:
+        items = _merge_extra(items, extra, after, page_size)
+    return _finish_page(items, page_size)
+
+
+async def akeyset_page(queryset, after, page_size, extra=None):
+    """Async version of keyset_page()."""
+    items = [item async for item in _keyset_queryset(queryset, after, page_size)]
+    if extra is not None:
+        items = _merge_extra(items, extra, after, page_size)
+    return _finish_page(items, page_size)
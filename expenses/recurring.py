@@ -0,0 +1,180 @@
+import calendar
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+
+from . import rollups
+from .categories import resolve_category
+from .changes import record_queryset
+from .models import Expense, RecurringExpense
+from .search import bulk_indexing
+
+INSERT_FIELDS = (
+    'user_id', 'title', 'amount_minor', 'category', 'category_ref_id', 'currency', 'date', 'recurring_id', 'occurrence',
+)
+
+# Occurrences are computed from the rule's start date by index rather than by
+# adding a period to the previous one, so a rule starting on Jan 31 lands on
+# Feb 28 and then back on Mar 31 instead of drifting to the 28th for good.
+
+
+def _clamped(year, month, day):
+    return day if day <= 28 else min(day, calendar.monthrange(year, month)[1])
+
+
+def occurrence(start, frequency, index):
+    """The index-th occurrence (0 is start) of a rule starting on start."""
+    if frequency == RecurringExpense.WEEKLY:
+        return start + timedelta(weeks=index)
+    if frequency == RecurringExpense.YEARLY:
+        year = start.year + index
+        return start.replace(year=year, day=_clamped(year, start.month, start.day))
+    year, month = divmod(start.month - 1 + index, 12)
+    year, month = start.year + year, month + 1
+    return start.replace(year=year, month=month, day=_clamped(year, month, start.day))
+
+
+def occurrence_index(start, frequency, day):
+    """Index of the first occurrence on or after day."""
+    if day <= start:
+        return 0
+    if frequency == RecurringExpense.WEEKLY:
+        index = -(-(day - start).days // 7)
+    elif frequency == RecurringExpense.YEARLY:
+        index = day.year - start.year
+    else:
+        index = (day.year - start.year) * 12 + day.month - start.month
+    # Month and year arithmetic can land one period short of day
+    return index if occurrence(start, frequency, index) >= day else index + 1
+
+
+def due_dates(rule, until):
+    """
+    Return (occurrences from rule.next_date through until, new next_date).
+
+    The new next_date is None once the rule has no occurrence left before its
+    end date.
+    """
+    dates = []
+    if rule.next_date is None:
+        return dates, None
+    last = until if rule.end_date is None else min(until, rule.end_date)
+    index = occurrence_index(rule.start_date, rule.frequency, rule.next_date)
+    day = occurrence(rule.start_date, rule.frequency, index)
+    while day <= last:
+        dates.append(day)
+        index += 1
+        day = occurrence(rule.start_date, rule.frequency, index)
+    if rule.end_date is not None and day > rule.end_date:
+        day = None
+    return dates, day
+
+
+def first_date(rule):
+    """next_date of a rule that has not produced any expense yet."""
+    if rule.end_date is not None and rule.end_date < rule.start_date:
+        return None
+    return rule.start_date
+
+
+def insert_expenses(rows, using, fields=INSERT_FIELDS):
+    """
+    INSERT expense rows given as dicts of fields (INSERT_FIELDS by default)
+    with one executemany.
+
+    Going around bulk_create() matters here: building and preparing a model
+    instance per occurrence costs several times more than the INSERT itself
+    when a catch-up creates hundreds of thousands of rows.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    columns = [Expense._meta.get_field(name).column for name in fields]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(Expense._meta.db_table),
+        ', '.join(quote(column) for column in columns),
+        ', '.join(['%s'] * len(columns)),
+    )
+    dates = {day for row in rows for day in (row['date'], row['occurrence'])}
+    adapted = {day: connection.ops.adapt_datefield_value(day) for day in dates}
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [adapted[row[name]] if name in ('date', 'occurrence') else row[name] for name in fields]
+            for row in rows
+        ])
+
+
+def materialize(until, batch_size=1000, rules=None):
+    """
+    Create the expenses of every rule due on or before until; returns
+    (rules processed, expenses created).
+
+    Rules are read in batches ordered by user, so each user's rollup rows are
+    written by as few batches as possible, and every batch is handled in one
+    transaction: occurrences are generated in memory, the (rule, occurrence)
+    pairs already stored are skipped, the rest are inserted together and
+    folded into the rollup at once, and next_date is moved past until.
+    Running it twice, or after a failed run, never creates an occurrence
+    twice. rules narrows the run to a queryset of rules.
+    """
+    queryset = RecurringExpense.objects.all() if rules is None else rules
+    using = router.db_for_write(Expense)
+    processed = created = 0
+    last = (0, 0)
+    while True:
+        with transaction.atomic(using=using):
+            batch = list(
+                queryset.select_for_update().filter(next_date__lte=until)
+                .filter(Q(user_id__gt=last[0]) | Q(user_id=last[0], pk__gt=last[1]))
+                .order_by('user_id', 'pk')[:batch_size]
+            )
+            if not batch:
+                break
+            last = (batch[-1].user_id, batch[-1].pk)
+            pending = []
+            for rule in batch:
+                dates, rule.next_date = due_dates(rule, until)
+                pending.extend((rule, day) for day in dates)
+            existing = set(
+                Expense.objects.filter(
+                    recurring_id__in=[rule.pk for rule in batch],
+                    occurrence__gte=min((day for _, day in pending), default=until),
+                ).values_list('recurring_id', 'occurrence')
+            ) if pending else set()
+            resolved = {}
+            rows = []
+            for rule, day in pending:
+                if (rule.pk, day) in existing:
+                    continue
+                category = (rule.category_ref_id, rule.category)
+                if rule.category_ref_id is None:
+                    # The rule's category was deleted since; recreate it like any new expense would
+                    key = (rule.user_id, rule.category)
+                    if key not in resolved:
+                        resolved[key] = resolve_category(*key)
+                    category = resolved[key]
+                rows.append({
+                    'user_id': rule.user_id, 'title': rule.title, 'amount_minor': rule.amount_minor,
+                    'category_ref_id': category[0], 'category': category[1], 'currency': rule.currency,
+                    'date': day, 'recurring_id': rule.pk, 'occurrence': day,
+                })
+            if rows:
+                last_id = Expense.objects.using(using).order_by('-pk').values_list('pk', flat=True).first() or 0
+                with bulk_indexing(using):
+                    insert_expenses(rows, using)
+                # Raw inserts skip the save signals, so fold them into the rollup and change feed here
+                rollups.apply_changes((row, 1) for row in rows)
+                record_queryset(
+                    Expense.objects.using(using).filter(pk__gt=last_id, recurring_id__in=[rule.pk for rule in batch]),
+                    replace=False,
+                )
+                created += len(rows)
+            # Rules of a batch share few next dates; one UPDATE per date beats bulk_update's CASE
+            by_next_date = defaultdict(list)
+            for rule in batch:
+                by_next_date[rule.next_date].append(rule.pk)
+            for next_date, pks in by_next_date.items():
+                RecurringExpense.objects.filter(pk__in=pks).update(next_date=next_date)
+            processed += len(batch)
+    return processed, created
@@ -0,0 +1,23 @@
+"""
+Entry points of the run_report_jobs process pool.
+
+Pool processes are spawned rather than forked, since a forked child would
+share the parent's open SQLite connection, so they import this module before
+Django is set up: nothing here may import models at module level.
+"""
+import django
+
+
+def setup():
+    django.setup()
+
+
+def run(job_id):
+    from django.db import connections
+
+    from .reports import run_job
+
+    try:
+        return job_id, run_job(job_id)
+    finally:
+        connections.close_all()
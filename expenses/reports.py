@@ -0,0 +1,183 @@
+import csv
+import io
+import logging
+import tempfile
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import OperationalError, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .archives import archived_expenses
+from .exporters import EXPORT_FIELDS, export_rows, gzip_stream, render_csv, user_export_queryset
+from .models import Expense, ExpenseArchive, MonthlyTotal, ReportJob
+from .money import from_minor
+from .rollups import data_version
+
+logger = logging.getLogger('expenses.reports')
+
+# Progress is written at most once per this many percent; every write takes the SQLite write lock
+PROGRESS_STEP = 5
+
+
+def request_report(user, report):
+    """
+    Return the job building report over the user's current data, queueing it
+    if there is none yet. A failed job is queued again.
+    """
+    version = data_version(user.pk)[0]
+    job, created = ReportJob.objects.get_or_create(user=user, report=report, data_version=version)
+    if not created and job.status == ReportJob.FAILED:
+        ReportJob.objects.filter(pk=job.pk, status=ReportJob.FAILED).update(status=ReportJob.QUEUED, progress=0, error='')
+        job.refresh_from_db()
+    return job
+
+
+def requeue_stale_jobs():
+    """Queue again the jobs left running longer than EXPENSES_REPORT_JOB_TIMEOUT, e.g. by a killed worker."""
+    cutoff = timezone.now() - timedelta(seconds=settings.EXPENSES_REPORT_JOB_TIMEOUT)
+    return ReportJob.objects.filter(status=ReportJob.RUNNING, started_at__lt=cutoff).update(
+        status=ReportJob.QUEUED, progress=0,
+    )
+
+
+def claim_jobs(limit):
+    """
+    Mark up to limit queued jobs as running and return their ids, oldest first.
+
+    Each job is claimed with an UPDATE conditional on it still being queued,
+    so several workers polling the same table never run a job twice.
+    """
+    claimed = []
+    for pk in ReportJob.objects.filter(status=ReportJob.QUEUED).order_by('id').values_list('pk', flat=True)[:limit]:
+        if ReportJob.objects.filter(pk=pk, status=ReportJob.QUEUED).update(
+            status=ReportJob.RUNNING, started_at=timezone.now(), progress=0,
+        ):
+            claimed.append(pk)
+    return claimed
+
+
+def fail_jobs(job_ids, error):
+    """Mark jobs still running as failed, e.g. when the worker running them died."""
+    return ReportJob.objects.filter(pk__in=job_ids, status=ReportJob.RUNNING).update(
+        status=ReportJob.FAILED, error=error, finished_at=timezone.now(),
+    )
+
+
+class Progress:
+    """Callable recording a job's progress in percent, throttled to PROGRESS_STEP."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.written = 0
+
+    def __call__(self, done, total):
+        percent = min(int(done * 100 / total), 99) if total else 0
+        if percent >= self.written + PROGRESS_STEP:
+            try:
+                ReportJob.objects.filter(pk=self.job_id).update(progress=percent)
+            except OperationalError:
+                # SQLite refuses to write from a connection whose open read
+                # snapshot is older than another worker's commit; progress is
+                # only informative, so try again at the next step
+                return
+            self.written = percent
+
+
+def annual_summary(job, destination, progress):
+    """
+    Write a CSV with one row per year, category and currency of the user's
+    expenses: the twelve monthly totals, the year total and the number of
+    expenses, all in the expenses' own currency.
+    """
+    rows = MonthlyTotal.objects.filter(user_id=job.user_id).order_by('month').values_list(
+        'month', 'category', 'currency', 'total_minor', 'count',
+    )
+    years = defaultdict(lambda: defaultdict(lambda: [[0] * 12, 0]))
+    for month, category, currency, total_minor, count in rows.iterator():
+        entry = years[month.year][(category, currency)]
+        entry[0][month.month - 1] += total_minor
+        entry[1] += count
+    text = io.TextIOWrapper(destination, encoding='utf-8', newline='', write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(['year', 'category', 'currency', *(f'{month:02d}' for month in range(1, 13)), 'total', 'count'])
+    for index, (year, groups) in enumerate(sorted(years.items())):
+        for (category, currency), (months, count) in sorted(groups.items()):
+            writer.writerow([
+                year, category, currency, *(from_minor(value, currency) for value in months),
+                from_minor(sum(months), currency), count,
+            ])
+        progress(index + 1, len(years))
+    text.detach()
+
+
+def full_export(job, destination, progress):
+    """Write every expense of the user, archived ones included, as a gzipped CSV in the export format."""
+    queryset = user_export_queryset(job.user)
+    total = Expense.objects.filter(user_id=job.user_id).count() + sum(
+        ExpenseArchive.objects.filter(user_id=job.user_id).values_list('row_count', flat=True)
+    )
+
+    def counted(rows):
+        for done, row in enumerate(rows, 1):
+            yield row
+            if done % settings.EXPENSES_EXPORT_CHUNK_SIZE == 0:
+                progress(done, total)
+
+    rows = counted(export_rows(queryset, EXPORT_FIELDS, settings.EXPENSES_EXPORT_CHUNK_SIZE, archived_expenses([job.user_id])))
+    for chunk in gzip_stream(render_csv(rows, EXPORT_FIELDS)):
+        destination.write(chunk)
+
+
+# report -> (builder, file extension)
+BUILDERS = {
+    ReportJob.ANNUAL_SUMMARY: (annual_summary, 'csv'),
+    ReportJob.FULL_EXPORT: (full_export, 'csv.gz'),
+}
+
+
+def run_job(job_id):
+    """Build a claimed job's report into its result file; returns the final status."""
+    job = ReportJob.objects.select_related('user').get(pk=job_id)
+    builder, extension = BUILDERS[job.report]
+    try:
+        with tempfile.TemporaryFile() as destination:
+            builder(job, destination, Progress(job.pk))
+            destination.seek(0)
+            job.result.save(f'{job.report}-{job.user_id}-v{job.data_version}.{extension}', File(destination), save=False)
+    except Exception as exc:
+        logger.exception("Report job %s failed", job.pk)
+        ReportJob.objects.filter(pk=job.pk).update(
+            status=ReportJob.FAILED, error=f'{type(exc).__name__}: {exc}', finished_at=timezone.now(),
+        )
+        return ReportJob.FAILED
+    with transaction.atomic():
+        ReportJob.objects.filter(pk=job.pk).update(
+            status=ReportJob.DONE, progress=100, result=job.result.name, finished_at=timezone.now(),
+        )
+        # Results of older data are never served again once a newer one is done
+        outdated = list(ReportJob.objects.filter(
+            user_id=job.user_id, report=job.report, data_version__lt=job.data_version,
+            status__in=[ReportJob.DONE, ReportJob.FAILED],
+        ))
+        ReportJob.objects.filter(pk__in=[old.pk for old in outdated]).delete()
+        transaction.on_commit(lambda: [old.result.delete(save=False) for old in outdated if old.result])
+    return ReportJob.DONE
+
+
+def job_json(job):
+    return {
+        'id': job.pk,
+        'report': job.report,
+        'data_version': job.data_version,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error or None,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'status_url': reverse('report_job_status', args=[job.pk]),
+        'download_url': reverse('download_report', args=[job.pk]) if job.status == ReportJob.DONE else None,
+    }
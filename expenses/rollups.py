@@ -0,0 +1,263 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .budgets import check_thresholds
+from .currency import convert_monthly
+from .models import Expense, MonthlyTotal, UserDataVersion
+from .money import from_minor
+
+
+ROLLUP_FIELDS = ('user_id', 'date', 'category', 'currency', 'amount_minor')
+# Below this many keys one UPDATE per key is cheaper than the bulk read/write path
+BULK_MIN_KEYS = 50
+# Users per chunk of bulk rollup writes, keeping IN lists well under SQLite's variable limit
+USERS_PER_CHUNK = 500
+
+
+def month_start(day):
+    # Accepts whatever was assigned to Expense.date (date, datetime or ISO string)
+    return Expense._meta.get_field('date').to_python(day).replace(day=1)
+
+
+def apply_delta(user_id, month, category, currency, amount_minor, count):
+    """Add amount_minor/count to a single MonthlyTotal row, creating or removing it as needed."""
+    key = {'user_id': user_id, 'month': month, 'category': category, 'currency': currency}
+    with transaction.atomic():
+        updated = MonthlyTotal.objects.filter(**key).update(total_minor=F('total_minor') + amount_minor, count=F('count') + count)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    MonthlyTotal.objects.create(total_minor=amount_minor, count=count, **key)
+            except IntegrityError:
+                # Another writer created the row between our UPDATE and INSERT
+                MonthlyTotal.objects.filter(**key).update(total_minor=F('total_minor') + amount_minor, count=F('count') + count)
+        MonthlyTotal.objects.filter(count__lte=0, **key).delete()
+
+
+def _bump_version(user_id, now):
+    updated = UserDataVersion.objects.filter(user_id=user_id).update(version=F('version') + 1, updated_at=now)
+    if not updated:
+        try:
+            with transaction.atomic():
+                UserDataVersion.objects.create(user_id=user_id, version=1)
+        except IntegrityError:
+            UserDataVersion.objects.filter(user_id=user_id).update(version=F('version') + 1, updated_at=now)
+
+
+def bump_versions(user_ids):
+    """Advance the data version of each user; readers use it for ETags and cache keys."""
+    now = timezone.now()
+    user_ids = list(user_ids)
+    if len(user_ids) < BULK_MIN_KEYS:
+        for user_id in user_ids:
+            _bump_version(user_id, now)
+        return
+    for start in range(0, len(user_ids), USERS_PER_CHUNK):
+        chunk = user_ids[start:start + USERS_PER_CHUNK]
+        existing = set(UserDataVersion.objects.filter(user_id__in=chunk).values_list('user_id', flat=True))
+        UserDataVersion.objects.filter(user_id__in=existing).update(version=F('version') + 1, updated_at=now)
+        for user_id in chunk:
+            if user_id not in existing:
+                _bump_version(user_id, now)
+
+
+def bump_all_versions():
+    """Invalidate every user's derived data at once, e.g. after exchange rates change."""
+    UserDataVersion.objects.update(version=F('version') + 1, updated_at=timezone.now())
+
+
+def apply_deltas_bulk(deltas):
+    """
+    apply_delta() for many keys with a constant number of queries.
+
+    The touched MonthlyTotal rows are read (and locked where the database
+    supports it) in one query, then deleted and written back with their new
+    totals by one bulk_create alongside the new rows; bulk_update's CASE
+    expressions cost far more than the rows themselves. If another writer
+    created one of the new rows in the meantime the inserts fall back to
+    apply_delta() key by key.
+    """
+    rows = {
+        (row.user_id, row.month, row.category, row.currency): row
+        for row in MonthlyTotal.objects.select_for_update().filter(
+            user_id__in={user_id for user_id, _, _, _ in deltas},
+            month__in={month for _, month, _, _ in deltas},
+        )
+    }
+    touched, changed, created = [], [], {}
+    for key, (amount_minor, count) in deltas.items():
+        if not (amount_minor or count):
+            continue
+        row = rows.get(key)
+        if row is None:
+            user_id, month, category, currency = key
+            created[key] = MonthlyTotal(
+                user_id=user_id, month=month, category=category, currency=currency, total_minor=amount_minor, count=count,
+            )
+            continue
+        touched.append(row.pk)
+        if row.count + count > 0:
+            row.pk = None
+            row.total_minor += amount_minor
+            row.count += count
+            changed.append(row)
+    if touched:
+        MonthlyTotal.objects.filter(pk__in=touched).delete()
+    MonthlyTotal.objects.bulk_create(changed)
+    try:
+        with transaction.atomic():
+            MonthlyTotal.objects.bulk_create([row for row in created.values() if row.count > 0])
+    except IntegrityError:
+        for key in created:
+            apply_delta(*key, *deltas[key])
+
+
+def apply_deltas(deltas):
+    """
+    Add {(user_id, month, category, currency): (amount_minor, count)} deltas to
+    the rollup, check budget thresholds and bump the users' data versions.
+
+    Large batches, such as a catch-up of recurring expenses, are applied in
+    chunks of users with bulk queries instead of one write per key.
+    """
+    by_user = defaultdict(dict)
+    for key, delta in deltas.items():
+        by_user[key[0]][key] = delta
+    user_ids = sorted(by_user)
+    with transaction.atomic():
+        for start in range(0, len(user_ids), USERS_PER_CHUNK):
+            chunk = user_ids[start:start + USERS_PER_CHUNK]
+            chunk_deltas = {key: delta for user_id in chunk for key, delta in by_user[user_id].items()}
+            if len(chunk_deltas) >= BULK_MIN_KEYS:
+                apply_deltas_bulk(chunk_deltas)
+            else:
+                for (user_id, month, category, currency), (amount_minor, count) in chunk_deltas.items():
+                    if amount_minor or count:
+                        apply_delta(user_id, month, category, currency, amount_minor, count)
+            check_thresholds(chunk_deltas)
+            bump_versions(chunk)
+
+
+def apply_changes(changes):
+    """
+    Fold (row values, sign) pairs into the rollup with one write per touched key.
+
+    Row values carry user_id, date, category, currency and amount_minor; sign is
+    +1 for rows that now exist and -1 for rows that went away.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for row, sign in changes:
+        key = (row['user_id'], month_start(row['date']), row['category'], row['currency'])
+        deltas[key][0] += sign * int(row['amount_minor'])
+        deltas[key][1] += sign
+    apply_deltas(deltas)
+
+
+def queryset_deltas(queryset, sign):
+    """Rollup deltas of adding (sign=1) or removing (sign=-1) every expense of queryset, from one grouped query."""
+    return {
+        rollup_key(row): (sign * row['total_minor'], sign * row['count'])
+        for row in rollup_rows(queryset)
+    }
+
+
+def expense_values(expense):
+    return {name: getattr(expense, name) for name in ROLLUP_FIELDS}
+
+
+def apply_expenses(expenses, sign=1):
+    apply_changes((expense_values(expense), sign) for expense in expenses)
+
+
+def rollup_rows(queryset):
+    """MonthlyTotal values of the expenses in queryset, grouped in the database."""
+    return (
+        queryset.annotate(month=TruncMonth('date'))
+        .values('user_id', 'month', 'category', 'currency')
+        .annotate(total_minor=Sum('amount_minor'), count=Count('id'))
+        .order_by()
+    )
+
+
+def compute_rollups(user_ids):
+    """Recompute rollup rows for the given users straight from the Expense table."""
+    return rollup_rows(Expense.objects.filter(user_id__in=user_ids))
+
+
+def rollup_key(row):
+    return (row['user_id'], row['month'], row['category'], row['currency'])
+
+
+def month_starts(start, end):
+    """First day of every month in the half-open range [start, end)."""
+    months = []
+    current = month_start(start)
+    while current < end:
+        months.append(current)
+        current = current.replace(year=current.year + 1, month=1) if current.month == 12 else current.replace(month=current.month + 1)
+    return months
+
+
+def monthly_rows_queryset(user, start, end, by_category=False):
+    """Rollup totals for [start, end) grouped by month, currency and optionally category, in minor units."""
+    group_by = ('month', 'category', 'currency') if by_category else ('month', 'currency')
+    return (
+        MonthlyTotal.objects.filter(user=user, month__gte=start, month__lt=end)
+        .values(*group_by).annotate(sum_minor=Sum('total_minor')).order_by(*group_by)
+    )
+
+
+def monthly_rows(user, start, end, by_category=False):
+    return list(monthly_rows_queryset(user, start, end, by_category))
+
+
+async def amonthly_rows(user, start, end, by_category=False):
+    return [row async for row in monthly_rows_queryset(user, start, end, by_category)]
+
+
+def years_queryset(user):
+    return MonthlyTotal.objects.filter(user=user).dates('month', 'year')
+
+
+def currencies_queryset(user):
+    return MonthlyTotal.objects.filter(user=user).values_list('currency', flat=True).distinct().order_by('currency')
+
+
+def monthly_series(rows, start, end, currency, by_category=False):
+    """
+    Return (months, series, missing) for [start, end) converted into currency.
+
+    series maps a label ('Total' or each category) to one total per month, with
+    zeroes for months without expenses. Conversion runs once per (month,
+    currency) group of monthly_rows() rather than per expense; groups without a
+    known rate are left out and their currencies reported in missing.
+    """
+    months = month_starts(start, end)
+    position = {month: index for index, month in enumerate(months)}
+    series = {} if by_category else {'Total': [Decimal('0')] * len(months)}
+    missing = set()
+    for row in rows:
+        converted = convert_monthly(row['month'], from_minor(row['sum_minor'], row['currency']), row['currency'], currency)
+        if converted is None:
+            missing.add(row['currency'])
+            continue
+        label = row['category'] if by_category else 'Total'
+        values = series.setdefault(label, [Decimal('0')] * len(months))
+        values[position[row['month']]] += converted
+    return months, dict(sorted(series.items())), sorted(missing)
+
+
+def data_version(user_id):
+    """Return (version, updated_at) for a user without touching any aggregate."""
+    row = UserDataVersion.objects.filter(user_id=user_id).values_list('version', 'updated_at').first()
+    return row or (0, None)
+
+
+async def adata_version(user_id):
+    row = await UserDataVersion.objects.filter(user_id=user_id).values_list('version', 'updated_at').afirst()
+    return row or (0, None)
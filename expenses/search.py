@@ -0,0 +1,194 @@
+import re
+from contextlib import contextmanager
+
+from django.db import OperationalError, connections, router, transaction
+from django.db.models import Q
+
+from .models import Expense
+from .pagination import decode_cursor, encode_cursor, keyset_page
+
+# Search cursors hold (rank, id) rather than (date, id); their own salt keeps
+# list and search cursors from being accepted by the other endpoint
+SEARCH_CURSOR_SALT = 'expenses.search_cursor'
+
+# External-content FTS5 index over Expense.title and category. It stores only
+# the inverted index; rows are read back from expenses_expense by rowid = id.
+FTS_TABLE = 'expenses_expense_fts'
+CREATE_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "title, category, content='expenses_expense', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+# 'delete' rows must carry the old values so FTS5 can find the tokens to remove
+TRIGGERS = {
+    'expenses_expense_fts_insert': (
+        "AFTER INSERT ON expenses_expense BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, title, category) VALUES (new.id, new.title, new.category); END"
+    ),
+    'expenses_expense_fts_delete': (
+        "AFTER DELETE ON expenses_expense BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, category) VALUES ('delete', old.id, old.title, old.category); END"
+    ),
+    'expenses_expense_fts_update': (
+        "AFTER UPDATE OF title, category ON expenses_expense BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, category) VALUES ('delete', old.id, old.title, old.category); "
+        f"INSERT INTO {FTS_TABLE}(rowid, title, category) VALUES (new.id, new.title, new.category); END"
+    ),
+}
+# bm25() column weights: a hit in the title counts twice as much as one in the category
+RANK = f'bm25({FTS_TABLE}, 2.0, 1.0)'
+
+_available = {}
+
+
+def fts5_supported(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute('CREATE VIRTUAL TABLE temp.expenses_fts5_probe USING fts5(x)')
+            cursor.execute('DROP TABLE temp.expenses_fts5_probe')
+    except OperationalError:
+        return False
+    return True
+
+
+def _existing(cursor, kind, names):
+    placeholders = ', '.join(['%s'] * len(names))
+    cursor.execute(f"SELECT name FROM sqlite_master WHERE type = %s AND name IN ({placeholders})", [kind, *names])
+    return {name for name, in cursor.fetchall()}
+
+
+def install_search_index(connection):
+    """Create the FTS5 table and its triggers and index existing rows; False without FTS5."""
+    if not fts5_supported(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE)
+        for name, body in TRIGGERS.items():
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    _available.clear()
+    return True
+
+
+def uninstall_search_index(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    _available.clear()
+
+
+def repair_search_triggers(using='default', **kwargs):
+    """
+    post_migrate handler restoring triggers a later migration dropped.
+
+    SQLite's schema editor rebuilds a table for most ALTERs, which silently
+    drops the triggers attached to it. If any are missing the index may have
+    missed writes, so it is rebuilt as well.
+    """
+    connection = connections[using]
+    _available.clear()
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if not _existing(cursor, 'table', [FTS_TABLE]):
+            return
+        if len(_existing(cursor, 'trigger', list(TRIGGERS))) < len(TRIGGERS):
+            install_search_index(connection)
+
+
+def search_available(using):
+    if using not in _available:
+        connection = connections[using]
+        if connection.vendor != 'sqlite':
+            _available[using] = False
+        else:
+            with connection.cursor() as cursor:
+                _available[using] = bool(_existing(cursor, 'table', [FTS_TABLE]))
+    return _available[using]
+
+
+@contextmanager
+def bulk_indexing(using):
+    """
+    Index the expenses inserted inside the block with one INSERT ... SELECT
+    when it ends instead of one trigger run per row, which is several times
+    slower for large batches.
+
+    The insert trigger is dropped and recreated in the same transaction, so
+    SQLite's write lock keeps other writers out meanwhile and a rollback
+    restores it.
+    """
+    if not search_available(using):
+        yield
+        return
+    connection = connections[using]
+    name = 'expenses_expense_fts_insert'
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM expenses_expense')
+            last_id, = cursor.fetchone()
+        yield
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE}(rowid, title, category) '
+                'SELECT id, title, category FROM expenses_expense WHERE id > %s',
+                [last_id],
+            )
+            cursor.execute(f'CREATE TRIGGER {name} {TRIGGERS[name]}')
+
+
+def search_terms(text):
+    return re.findall(r'\w+', text or '')
+
+
+def fts_query(terms):
+    # Every term must match, as a prefix so "groc" finds "groceries"; quoting
+    # keeps user input from being read as FTS5 operators
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_page(user, text, after, page_size):
+    """
+    Return (items, next_token, ranked) for the user's expenses matching text.
+
+    With the FTS5 index results are ordered by relevance and paginated on the
+    last seen (rank, id) pair. Without it every term is matched with icontains
+    on title or category, newest first, through the regular keyset pagination.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return [], None, False
+    using = router.db_for_read(Expense)
+    if not search_available(using):
+        queryset = Expense.objects.filter(user=user)
+        for term in terms:
+            queryset = queryset.filter(Q(title__icontains=term) | Q(category__icontains=term))
+        items, next_token = keyset_page(queryset, after, page_size)
+        return items, next_token, False
+
+    params = [fts_query(terms), user.pk]
+    after_clause = ''
+    cursor = decode_cursor(after, (float, int), SEARCH_CURSOR_SALT)
+    if cursor:
+        last_rank, last_id = cursor
+        after_clause = f'AND ({RANK} > %s OR ({RANK} = %s AND e.id < %s))'
+        params += [last_rank, last_rank, last_id]
+    sql = (
+        f'SELECT e.*, {RANK} AS search_rank FROM {FTS_TABLE} '
+        f'JOIN expenses_expense e ON e.id = {FTS_TABLE}.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s AND e.user_id = %s {after_clause} '
+        'ORDER BY search_rank, e.id DESC LIMIT %s'
+    )
+    # One extra row tells whether there is a next page
+    items = list(Expense.objects.raw(sql, params + [page_size + 1], using=using))
+    next_token = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_token = encode_cursor(repr(items[-1].search_rank), items[-1].id, salt=SEARCH_CURSOR_SALT)
+    return items, next_token, True
@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import rollups
+from .budgets import current_month, refresh_alerts
+from .categories import forget_categories, resolve_category
+from .changes import record_changes
+from .currency import bump_rates_version, finish_request, start_request
+from .models import Budget, Category, ExchangeRate, Expense, RecurringExpense
+from .recurring import first_date
+
+
+@receiver(pre_save, sender=Expense)
+def resolve_expense_category(sender, instance, raw, **kwargs):
+    if raw or not instance.category:
+        return
+    instance.category_ref_id, instance.category = resolve_category(instance.user_id, instance.category)
+
+
+@receiver(pre_save, sender=RecurringExpense)
+def prepare_recurring_expense(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    if instance.category:
+        instance.category_ref_id, instance.category = resolve_category(instance.user_id, instance.category)
+    if instance.pk is None and instance.next_date is None:
+        instance.next_date = first_date(instance)
+
+
+@receiver(pre_save, sender=Expense)
+def remember_previous_expense(sender, instance, raw, **kwargs):
+    instance._rollup_previous = None
+    if raw or instance.pk is None:
+        return
+    instance._rollup_previous = Expense.objects.filter(pk=instance.pk).values(*rollups.ROLLUP_FIELDS).first()
+
+
+@receiver(post_save, sender=Expense)
+def update_rollup_on_save(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    changes = [(rollups.expense_values(instance), 1)]
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous:
+        changes.insert(0, (previous, -1))
+    rollups.apply_changes(changes)
+    record_changes([instance])
+
+
+def _deleted_with_user(origin):
+    # Deleting a user cascades to their rollups and data version as well
+    return isinstance(origin, User) or getattr(origin, 'model', None) is User
+
+
+@receiver(post_delete, sender=Expense)
+def update_rollup_on_delete(sender, instance, origin=None, **kwargs):
+    if _deleted_with_user(origin):
+        return
+    rollups.apply_expenses([instance], sign=-1)
+    record_changes([instance], deleted=True)
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def invalidate_converted_totals(sender, **kwargs):
+    bump_rates_version()
+    rollups.bump_all_versions()
+
+
+request_started.connect(start_request, dispatch_uid='expenses.currency.start_request')
+request_finished.connect(finish_request, dispatch_uid='expenses.currency.finish_request')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_map(sender, instance, **kwargs):
+    forget_categories(instance.user_id)
+
+
+@receiver(post_save, sender=Budget)
+def refresh_budget_alerts(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    # A new or changed limit may put this month over (or back under) a threshold
+    refresh_alerts(instance, current_month())
+    rollups.bump_versions([instance.user_id])
+
+
+@receiver(post_delete, sender=Budget)
+def forget_budget(sender, instance, origin=None, **kwargs):
+    if _deleted_with_user(origin):
+        return
+    rollups.bump_versions([instance.user_id])
@@ -0,0 +1,81 @@
+from datetime import date
+from decimal import Decimal
+from itertools import accumulate
+
+from .rollups import monthly_series
+
+
+def percent_change(previous, current):
+    if not previous:
+        return None
+    return ((current - previous) / previous * 100).quantize(Decimal('0.1'))
+
+
+def year_rows(values, years):
+    """
+    Split one monthly series covering whole years into per-year summaries.
+
+    Each row holds the twelve monthly totals, their running (year-to-date)
+    totals, the year total and the change against the previous year, both per
+    month and for the whole year.
+    """
+    rows = []
+    previous = None
+    for index, year in enumerate(years):
+        months = values[index * 12:(index + 1) * 12]
+        running = list(accumulate(months))
+        row = {
+            'year': year,
+            'months': months,
+            'running': running,
+            'total': running[-1],
+            'yoy_months': [current - before for current, before in zip(months, previous['months'])] if previous else None,
+            'yoy_total': running[-1] - previous['total'] if previous else None,
+            'yoy_percent': percent_change(previous['total'], running[-1]) if previous else None,
+        }
+        rows.append(row)
+        previous = row
+    return rows
+
+
+def multi_year_summary(rows, first_year, last_year, currency, by_category=False):
+    """
+    Return (years, totals, categories, missing) for the rollup rows of
+    [first_year, last_year] converted into currency.
+
+    rows come from one grouped monthly_rows() query over the whole range;
+    totals are the year rows of all expenses and categories maps each category
+    name to its own year rows (empty unless by_category).
+    """
+    years = list(range(first_year, last_year + 1))
+    _, series, missing = monthly_series(rows, date(first_year, 1, 1), date(last_year + 1, 1, 1), currency, by_category)
+    if by_category:
+        total = [sum(values, Decimal('0')) for values in zip(*series.values())] or [Decimal('0')] * 12 * len(years)
+        categories = {label: year_rows(values, years) for label, values in series.items()}
+    else:
+        total = series['Total']
+        categories = {}
+    return years, year_rows(total, years), categories, missing
+
+
+def _number(value):
+    return None if value is None else float(value)
+
+
+def _numbers(values):
+    return None if values is None else [float(value) for value in values]
+
+
+def year_rows_json(rows):
+    return [
+        {
+            'year': row['year'],
+            'months': _numbers(row['months']),
+            'running': _numbers(row['running']),
+            'total': float(row['total']),
+            'yoy_months': _numbers(row['yoy_months']),
+            'yoy_total': _number(row['yoy_total']),
+            'yoy_percent': _number(row['yoy_percent']),
+        }
+        for row in rows
+    ]
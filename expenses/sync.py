@@ -0,0 +1,119 @@
+import uuid
+
+from django.db import transaction
+
+from .bulk import delete_expenses
+from .changes import latest_cursor
+from .forms import ExpenseForm
+from .importers import save_batch
+from .models import ArchivedClientId, Expense, ExpenseChange
+
+MAX_BATCH = 500
+SYNCED_FIELDS = ('title', 'amount_minor', 'category', 'date', 'currency')
+ARCHIVED_ERROR = {'client_id': [{
+    'message': 'This expense is archived; its year must be unarchived to change it.', 'code': 'archived',
+}]}
+
+
+class SyncError(Exception):
+    """A sync batch that was rejected as a whole; errors is JSON-ready."""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def parse_client_id(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def parse_batch(payload):
+    """Return ({client_id: upsert data}, [client_id to delete]) of a sync request body, or raise SyncError."""
+    if not isinstance(payload, dict):
+        raise SyncError({'batch': ['Expected a JSON object with "upserts" and "deletes".']})
+    upserts, deletes = payload.get('upserts') or [], payload.get('deletes') or []
+    if not isinstance(upserts, list) or not isinstance(deletes, list):
+        raise SyncError({'batch': ['"upserts" and "deletes" must be lists.']})
+    if len(upserts) + len(deletes) > MAX_BATCH:
+        raise SyncError({'batch': [f'At most {MAX_BATCH} upserts and deletes per batch.']})
+    errors = {}
+    parsed = {}
+    for index, item in enumerate(upserts):
+        client_id = parse_client_id(item.get('client_id')) if isinstance(item, dict) else None
+        if client_id is None:
+            errors[f'upserts.{index}'] = ['Each upsert needs a "client_id" UUID.']
+        else:
+            # The last upsert of the same expense in a batch wins
+            parsed[client_id] = item
+    deleted = []
+    for index, value in enumerate(deletes):
+        client_id = parse_client_id(value)
+        if client_id is None:
+            errors[f'deletes.{index}'] = ['Expected a UUID.']
+        else:
+            deleted.append(client_id)
+    if errors:
+        raise SyncError(errors)
+    return parsed, deleted
+
+
+def apply_batch(user, upserts, deletes):
+    """
+    Apply a parsed sync batch in one transaction and return its summary.
+
+    Upserts create or update the user's expense with the same client_id and
+    deletes remove it, so replaying a batch changes nothing. An id that was
+    already deleted is not brought back by a late replay of its upsert. If
+    any upsert is invalid or any upsert or delete targets an archived
+    expense, nothing is applied and SyncError lists the errors.
+    """
+    with transaction.atomic():
+        client_ids = [*upserts, *deletes]
+        existing = {expense.client_id: expense for expense in Expense.objects.filter(user=user, client_id__in=client_ids)}
+        tombstones = set(
+            ExpenseChange.objects.filter(user=user, deleted=True, client_id__in=client_ids).values_list('client_id', flat=True)
+        )
+        archived = set(
+            ArchivedClientId.objects.filter(user=user, client_id__in=client_ids).values_list('client_id', flat=True)
+        )
+        errors = {str(client_id): ARCHIVED_ERROR for client_id in client_ids if client_id in archived}
+        created, updated = [], []
+        unchanged = skipped = 0
+        for client_id, data in upserts.items():
+            if client_id in archived:
+                continue
+            if client_id in tombstones:
+                skipped += 1
+                continue
+            expense = existing.get(client_id) or Expense(user=user, client_id=client_id)
+            before = [getattr(expense, name) for name in SYNCED_FIELDS]
+            form = ExpenseForm(data, instance=expense, user=user)
+            if not form.is_valid():
+                errors[str(client_id)] = form.errors.get_json_data()
+                continue
+            expense = form.save(commit=False)
+            if expense.pk is None:
+                created.append(expense)
+            elif [getattr(expense, name) for name in SYNCED_FIELDS] != before:
+                updated.append(expense)
+            else:
+                unchanged += 1
+        if errors:
+            raise SyncError(errors)
+        if created:
+            save_batch(created)
+        for expense in updated:
+            expense.save()
+        removed = delete_expenses(Expense.objects.filter(user=user, client_id__in=deletes)) if deletes else 0
+        return {
+            'cursor': latest_cursor(user),
+            'created': len(created),
+            'updated': len(updated),
+            'unchanged': unchanged,
+            'deleted': removed,
+            'skipped': skipped,
+            'ids': {str(expense.client_id): expense.pk for expense in created + updated},
+        }
@@ -1,9 +1,34 @@
-from django.test import TestCase, Client
+from django.test import SimpleTestCase, TestCase, Client, override_settings
+from asgiref.sync import sync_to_async
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
-from .models import Expense
+from .models import (
+    ArchivedClientId, Budget, BudgetAlert, Category, ExchangeRate, ExchangeRateVersion, Expense, ExpenseArchive, ExpenseChange,
+    MonthlyTotal, RecurringExpense, ReportJob,
+)
+from .archives import decode as decode_archive
+from .categories import category_rows, category_totals
+from .currency import clear_rate_cache, convert_monthly, get_rate
 from .forms import ExpenseForm
-from datetime import datetime
+from .views import year_range
+from . import cache as aggregates_cache
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from io import StringIO
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import xml.etree.ElementTree as ElementTree
+from unittest import skipUnless
+from datetime import date, datetime
 from decimal import Decimal
 
 class ExpenseModelTest(TestCase):
@@ -205,3 +230,1424 @@ class ExpenseFormTest(TestCase):
         self.assertFalse(form.is_valid())
         self.assertIn('date', form.errors)
 
+
+class ExpenseIndexTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        for month in range(1, 13):
+            Expense.objects.create(
+                user=self.user, date=datetime(2023, month, 1), category='Food', title='Groceries', currency='PLN', amount=Decimal('10.00')
+            )
+
+    def test_year_filter_uses_user_date_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN is SQLite specific')
+        start, end = year_range(2023)
+        queryset = Expense.objects.filter(user=self.user, date__gte=start, date__lt=end)
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('SEARCH', plan)
+        self.assertIn('expense_user_date_idx', plan)
+        self.assertNotIn('SCAN', plan)
+        self.assertEqual(queryset.count(), 12)
+
+    def test_out_of_range_year_is_rejected(self):
+        self.client.login(username='testuser', password='testpassword')
+        for year in ('9999', '0', 'abc'):
+            self.assertEqual(self.client.get(reverse('expense_list'), {'year': year}).status_code, 400)
+            self.assertEqual(self.client.get(reverse('expense_list_async'), {'year': year}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('expense_list'), {'year': '9998'}).status_code, 200)
+
+
+class MonthlyTotalRollupTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+
+    def rollup(self):
+        return {
+            (row.month.month, row.category): (row.total, row.count)
+            for row in MonthlyTotal.objects.filter(user=self.user)
+        }
+
+    def test_rollup_follows_add_edit_and_delete(self):
+        self.client.post(reverse('add_expense'), {
+            'date': '2024-03-05', 'category': 'Food', 'title': 'Lunch', 'currency': 'PLN', 'amount': '12.50'
+        })
+        self.client.post(reverse('add_expense'), {
+            'date': '2024-03-20', 'category': 'Food', 'title': 'Dinner', 'currency': 'PLN', 'amount': '30.00'
+        })
+        self.assertEqual(self.rollup(), {(3, 'Food'): (Decimal('42.50'), 2)})
+
+        expense = Expense.objects.get(title='Dinner')
+        expense.category = 'Restaurants'
+        expense.date = datetime(2024, 4, 1).date()
+        expense.save()
+        self.assertEqual(self.rollup(), {(3, 'Food'): (Decimal('12.50'), 1), (4, 'Restaurants'): (Decimal('30.00'), 1)})
+
+        self.client.post(reverse('delete_expense', args=[expense.id]))
+        self.assertEqual(self.rollup(), {(3, 'Food'): (Decimal('12.50'), 1)})
+
+    def test_rebuild_rollups_fixes_drift(self):
+        Expense.objects.create(
+            user=self.user, date=datetime(2024, 1, 10), category='Food', title='Groceries', currency='PLN', amount=Decimal('100.00')
+        )
+        MonthlyTotal.objects.filter(user=self.user).update(total_minor=100)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', '--check', stdout=StringIO())
+        call_command('rebuild_rollups', '--batch-size', '1', stdout=StringIO())
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+        self.assertEqual(self.rollup(), {(1, 'Food'): (Decimal('100.00'), 1)})
+
+
+@override_settings(EXPENSES_PAGE_SIZE=2)
+class ExpenseListPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        for day in (3, 1, 5, 5, 2):
+            Expense.objects.create(
+                user=self.user, date=datetime(2024, 1, day), category='Food', title=f'Day {day}', currency='PLN', amount=Decimal('10.00')
+            )
+
+    def test_keyset_pages_cover_year_in_order(self):
+        seen = []
+        params = {'year': 2024}
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('expense_list'), params)
+            self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+            self.assertLessEqual(len(response.context['expenses']), 2)
+            self.assertEqual(response.context['monthly_totals'][0][1], Decimal('50.00'))
+            seen.extend(response.context['expenses'])
+            if not response.context['next_cursor']:
+                break
+            params['after'] = response.context['next_cursor']
+
+        expected = list(Expense.objects.filter(user=self.user).order_by('-date', '-id'))
+        self.assertEqual(seen, expected)
+
+    def test_tampered_cursor_starts_from_first_page(self):
+        response = self.client.get(reverse('expense_list'), {'year': 2024, 'after': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['expenses'][0].date.day, 5)
+
+
+class ExpenseImportTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_csv_upload_imports_valid_rows_and_reports_errors(self):
+        upload = SimpleUploadedFile('bank.csv', (
+            'title,amount,category,date,currency\n'
+            'Rent,1500.00,Bills,2024-01-01,PLN\n'
+            'Refund,-20.00,Food,2024-01-02,PLN\n'
+            'Coffee,9.50,Food,2024-01-03,\n'
+            'Broken,abc,Food,not-a-date,PLN\n'
+        ).encode())
+        response = self.client.post(reverse('import_expenses'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+
+        result = response.context['result']
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line for line, _ in result.errors], [3, 5])
+        self.assertIn("Amount must be greater than 0.", result.errors[0][1])
+        self.assertEqual(Expense.objects.get(title='Coffee').currency, 'PLN')
+        self.assertEqual(MonthlyTotal.objects.get(user=self.user, category='Bills').total, Decimal('1500.00'))
+
+    def test_jsonl_command_inserts_in_batches(self):
+        lines = [json.dumps({'title': f'Item {i}', 'amount': '1.25', 'category': 'Misc', 'date': '2024-02-01'}) for i in range(5)]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as source:
+            source.write('\n'.join(lines + ['{not json']))
+        self.addCleanup(os.remove, source.name)
+
+        out, err = StringIO(), StringIO()
+        call_command('import_expenses', source.name, '--user', 'testuser', '--batch-size', '2', stdout=out, stderr=err)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 5)
+        self.assertIn('Imported 5 expenses', out.getvalue())
+        self.assertIn('Line 6', err.getvalue())
+
+
+class ExpenseExportTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        Expense.objects.create(
+            user=self.user, date=datetime(2024, 1, 10), category='Food', title='Groceries', currency='PLN', amount=Decimal('100.00')
+        )
+        Expense.objects.create(
+            user=self.user, date=datetime(2024, 2, 10), category='Bills', title='Power', currency='EUR', amount=Decimal('40.00')
+        )
+        other = User.objects.create_user(username='other', password='testpassword')
+        Expense.objects.create(
+            user=other, date=datetime(2024, 1, 11), category='Food', title='Not mine', currency='PLN', amount=Decimal('5.00')
+        )
+
+    def test_csv_export_is_streamed_and_filtered(self):
+        response = self.client.get(reverse('export_expenses'), {'end': '2024-01-31', 'category': 'Food'})
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.splitlines(), ['title,amount,category,date,currency', 'Groceries,100.00,Food,2024-01-10,PLN'])
+
+    def test_jsonl_export_is_gzipped_on_request(self):
+        response = self.client.get(reverse('export_expenses'), {'format': 'jsonl', 'currency': 'EUR'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        rows = [json.loads(line) for line in gzip.decompress(b''.join(response.streaming_content)).splitlines()]
+        self.assertEqual(rows, [{'title': 'Power', 'amount': '40.00', 'category': 'Bills', 'date': '2024-02-10', 'currency': 'EUR'}])
+
+    def test_invalid_filter_is_rejected(self):
+        response = self.client.get(reverse('export_expenses'), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_open_end_date_category_key_and_refused_gzip(self):
+        response = self.client.get(
+            reverse('export_expenses'), {'end': '9999-12-31', 'category': ' FOOD '}, HTTP_ACCEPT_ENCODING='gzip;q=0, identity',
+        )
+        self.assertFalse(response.has_header('Content-Encoding'))
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.splitlines()[1:], ['Groceries,100.00,Food,2024-01-10,PLN'])
+        response = self.client.get(reverse('export_expenses'), HTTP_ACCEPT_ENCODING='br;q=1.0, *;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        # Expenses of a deleted category are matched on the name they kept
+        Category.objects.filter(user=self.user, name='Food').delete()
+        response = self.client.get(reverse('export_expenses'), {'category': 'food'})
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.splitlines()[1:], ['Groceries,100.00,Food,2024-01-10,PLN'])
+
+    def test_bulk_dump_command_covers_all_users(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dump.csv.gz')
+            call_command('export_expenses', '--output', path, '--gzip', '--chunk-size', '1')
+            with gzip.open(path, 'rt') as dump:
+                lines = dump.read().splitlines()
+        self.assertEqual(lines[0], 'user_id,title,amount,category,date,currency')
+        self.assertEqual(len(lines), 4)
+
+
+class ChartDataApiTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        Expense.objects.create(
+            user=self.user, date=datetime(2024, 1, 10), category='Food', title='Groceries', currency='PLN', amount=Decimal('100.00')
+        )
+        Expense.objects.create(
+            user=self.user, date=datetime(2024, 3, 10), category='Bills', title='Power', currency='PLN', amount=Decimal('40.00')
+        )
+
+    def test_monthly_series_split_by_category(self):
+        response = self.client.get(reverse('chart_data'), {'start': '2024-01-01', 'end': '2024-03-31', 'split': 'category'})
+        self.assertEqual(response.json(), {
+            'labels': ['2024-01', '2024-02', '2024-03'],
+            'currency': 'PLN',
+            'missing_rates': [],
+            'series': [
+                {'label': 'Bills', 'data': [0.0, 0.0, 40.0]},
+                {'label': 'Food', 'data': [100.0, 0.0, 0.0]},
+            ],
+        })
+
+    def test_out_of_range_end_and_long_spans_are_rejected(self):
+        # Without an end, the period runs to the end of start's year
+        for params in ({'end': '9999-12-31'}, {'start': '9999-12-01'}, {'start': '9999-01-01'},
+                       {'start': '2000-01-01', 'end': '2024-12-31'}):
+            response = self.client.get(reverse('chart_data'), params)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('chart_data'), {'start': '2015-01-01', 'end': '2024-12-31'})
+        self.assertEqual(len(response.json()['labels']), 120)
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=30)
+    def test_conditional_get_returns_304_until_data_changes(self):
+        url = reverse('chart_data') + '?year=2024'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(2):  # session, data version; the user is cached
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Expense.objects.create(
+            user=self.user, date=datetime(2024, 2, 1), category='Food', title='Snack', currency='PLN', amount=Decimal('5.00')
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['series'][0]['data'][1], 5.0)
+
+
+class AggregatesCacheTest(TestCase):
+    backends = {
+        'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'aggregates-test'},
+        'file': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache'},
+        'db': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'aggregates_cache_test'},
+    }
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_aggregates_are_cached_and_invalidated_on_change(self):
+        for name, backend in self.backends.items():
+            with self.subTest(backend=name), tempfile.TemporaryDirectory() as directory:
+                if name == 'file':
+                    backend = dict(backend, LOCATION=directory)
+                with override_settings(CACHES={'default': settings.CACHES['default'], 'aggregates': backend},
+                                       EXPENSES_CACHE_ALIAS='aggregates'):
+                    if name == 'db':
+                        call_command('createcachetable', database='default')
+                    self.check_backend()
+                    caches['aggregates'].clear()
+
+    def check_backend(self):
+        aggregates_cache.reset_stats()
+        self.client.post(reverse('add_expense'), {
+            'date': '2024-05-01', 'category': 'Food', 'title': 'Lunch', 'currency': 'PLN', 'amount': '20.00'
+        })
+        self.client.get(reverse('expense_list'), {'year': 2024})
+        misses = aggregates_cache.stats()['misses']
+        self.assertEqual(aggregates_cache.stats(), {'hits': 0, 'misses': misses})
+        response = self.client.get(reverse('expense_list'), {'year': 2024})
+        self.assertEqual(aggregates_cache.stats(), {'hits': misses, 'misses': misses})
+        self.assertEqual(dict((month.month, total) for month, total in response.context['monthly_totals'])[5], Decimal('20.00'))
+
+        expense = Expense.objects.get(user=self.user, title='Lunch')
+        self.client.post(reverse('delete_expense', args=[expense.id]))
+        response = self.client.get(reverse('expense_list'), {'year': 2024})
+        self.assertEqual(aggregates_cache.stats(), {'hits': misses, 'misses': 2 * misses})
+        self.assertEqual(dict((month.month, total) for month, total in response.context['monthly_totals'])[5], Decimal('0'))
+
+
+class CurrencyConversionTest(TestCase):
+    def setUp(self):
+        clear_rate_cache()
+        self.addCleanup(clear_rate_cache)
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        Expense.objects.create(
+            user=self.user, date=datetime(2024, 1, 10), category='Food', title='Groceries', currency='PLN', amount=Decimal('100.00')
+        )
+        Expense.objects.create(
+            user=self.user, date=datetime(2024, 1, 20), category='Travel', title='Hotel', currency='EUR', amount=Decimal('50.00')
+        )
+        Expense.objects.create(
+            user=self.user, date=datetime(2024, 2, 5), category='Travel', title='Taxi', currency='USD', amount=Decimal('10.00')
+        )
+
+    def load_rates(self, content):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as source:
+            source.write(content)
+        self.addCleanup(os.remove, source.name)
+        call_command('load_exchange_rates', source.name, stdout=StringIO(), stderr=StringIO())
+
+    def totals(self, currency):
+        response = self.client.get(reverse('expense_list'), {'year': 2024, 'currency': currency})
+        return {month.month: total for month, total in response.context['monthly_totals'] if total}, response.context['missing_rates']
+
+    def test_totals_are_converted_with_month_end_rates(self):
+        self.load_rates('date,base,quote,rate\n2024-01-02,EUR,PLN,4.30\n2024-01-31,EUR,PLN,4.40\n2024-02-01,EUR,PLN,9.99\n')
+        self.assertEqual(self.totals('PLN'), ({1: Decimal('320.00')}, ['USD']))
+        # PLN -> EUR goes through the inverse of the EUR/PLN rate
+        self.assertEqual(self.totals('eur'), ({1: Decimal('72.73')}, ['USD']))
+
+    def test_loading_rates_invalidates_cached_totals(self):
+        self.assertEqual(self.totals('PLN'), ({1: Decimal('100.00')}, ['EUR', 'USD']))
+        self.load_rates(
+            'date,base,quote,rate\n2024-01-01,EUR,PLN,4\n2024-01-01,USD,PLN,4\nbad,USD,PLN,x\n'
+            '2024-01-01,GBP,PLN\n2024-01-01,CHF,PLN,Infinity\n2024-01-01,NOK,PLN,NaN\n'
+        )
+        self.assertEqual(self.totals('PLN'), ({1: Decimal('300.00'), 2: Decimal('40.00')}, []))
+        self.assertEqual(ExchangeRate.objects.count(), 2)
+
+    def test_rate_lookups_are_served_from_lru_cache(self):
+        ExchangeRate.objects.create(date=datetime(2024, 1, 1), base='EUR', quote='PLN', rate=Decimal('4'))
+        self.assertEqual(get_rate('EUR', 'PLN', datetime(2024, 3, 1).date()), Decimal('4'))
+        with self.assertNumQueries(1):  # only the shared rates version
+            self.assertEqual(get_rate('EUR', 'PLN', datetime(2024, 3, 1).date()), Decimal('4'))
+
+    def test_rates_loaded_by_another_process_are_seen(self):
+        day = datetime(2024, 3, 31).date()
+        self.assertIsNone(get_rate('USD', 'PLN', day))
+        # What load_exchange_rates does elsewhere: no signals, no clear_rate_cache() in this process
+        ExchangeRate.objects.bulk_create([ExchangeRate(date=datetime(2024, 3, 1), base='USD', quote='PLN', rate=Decimal('4'))])
+        ExchangeRateVersion.objects.create(pk=1, version=1)
+        self.assertEqual(get_rate('USD', 'PLN', day), Decimal('4'))
+
+    def test_converted_totals_keep_the_target_currency_exponent(self):
+        self.load_rates('date,base,quote,rate\n2024-01-01,PLN,JPY,37.123\n2024-01-01,PLN,KWD,0.07654\n')
+        self.assertEqual(convert_monthly(date(2024, 1, 1), Decimal('100.00'), 'PLN', 'JPY'), Decimal('3712'))
+        self.assertEqual(convert_monthly(date(2024, 1, 1), Decimal('100.00'), 'PLN', 'KWD'), Decimal('7.654'))
+        self.assertEqual(convert_monthly(date(2024, 1, 1), Decimal('1000'), 'JPY', 'PLN'), Decimal('26.94'))
+
+
+class CategoryTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_spellings_resolve_to_one_category(self):
+        for category, amount in (('Food', '10.00'), (' food ', '5.00'), ('FOOD', '1.00'), ('Bills', '100.00')):
+            self.client.post(reverse('add_expense'), {
+                'date': '2024-01-15', 'category': category, 'title': 'Item', 'currency': 'PLN', 'amount': amount
+            })
+        self.assertEqual(Category.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(set(Expense.objects.values_list('category', flat=True)), {'Food', 'Bills'})
+        self.assertEqual(MonthlyTotal.objects.get(user=self.user, category='Food').total, Decimal('16.00'))
+
+        other = User.objects.create_user(username='other', password='testpassword')
+        Expense.objects.create(user=other, date=datetime(2024, 1, 1), category='food', title='Item', amount=Decimal('1.00'))
+        self.assertEqual(Category.objects.get(user=other).name, 'food')
+
+    def test_invalid_submission_creates_no_category(self):
+        Category.objects.create(user=self.user, name='Food', key='food')
+        response = self.client.post(reverse('add_expense'), {
+            'date': '2024-01-15', 'category': 'Snacks', 'title': 'Item', 'currency': 'PLN', 'amount': '-1',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Category.objects.values_list('name', flat=True)), ['Food'])
+        form = ExpenseForm(data={'date': '2024-01-15', 'category': ' fOOD ', 'title': 'Item', 'currency': 'PLN', 'amount': '1'},
+                           user=self.user)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['category'], 'Food')
+
+    def test_category_breakdown_is_one_grouped_query(self):
+        food = Expense.objects.create(user=self.user, date=datetime(2024, 1, 1), category='Food', title='A', amount=Decimal('10.00'))
+        Expense.objects.create(user=self.user, date=datetime(2024, 2, 1), category='food', title='B', amount=Decimal('5.00'))
+        Expense.objects.create(user=self.user, date=datetime(2024, 2, 1), category='Bills', title='C', amount=Decimal('50.00'))
+        Expense.objects.create(user=self.user, date=datetime(2023, 2, 1), category='Bills', title='D', amount=Decimal('99.00'))
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = category_rows(self.user, *year_range(2024))
+        self.assertIn('GROUP BY "expenses_expense"."category_ref_id"', queries.captured_queries[0]['sql'])
+        self.assertEqual(category_totals(rows, 'PLN'), ([('Bills', Decimal('50.00')), ('Food', Decimal('15.00'))], []))
+
+        response = self.client.get(reverse('expense_list'), {'year': 2024})
+        self.assertEqual(response.context['category_totals'], [('Bills', Decimal('50.00')), ('Food', Decimal('15.00'))])
+        self.assertEqual(food.category_ref.key, 'food')
+
+    def test_deleting_a_category_or_a_user_with_expenses(self):
+        for day, category in [(datetime(2024, 1, 1), 'Food'), (datetime(2024, 2, 1), 'Bills')]:
+            Expense.objects.create(user=self.user, date=day, category=category, title='Item', amount=Decimal('10.00'))
+        bills = Category.objects.get(user=self.user, key='bills')
+        Budget.objects.create(user=self.user, category=Category.objects.get(user=self.user, key='food'), limit_minor=5000)
+        bills.delete()
+        self.assertIsNone(Expense.objects.get(category='Bills').category_ref_id)
+
+        self.user.delete()
+        for model in (Expense, Category, Budget, MonthlyTotal, ExpenseChange):
+            self.assertFalse(model.objects.exists(), model.__name__)
+
+
+class AsyncExpenseViewsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        self.async_client.cookies = self.client.cookies
+        Expense.objects.create(
+            user=self.user, date=datetime(2024, 1, 10), category='Food', title='Groceries', currency='PLN', amount=Decimal('100.00')
+        )
+
+    async def test_async_list_matches_sync_list(self):
+        sync_response = await sync_to_async(self.client.get)(reverse('expense_list'), {'year': 2024})
+        response = await self.async_client.get(reverse('expense_list_async'), {'year': 2024})
+        self.assertEqual(response.status_code, 200)
+        for key in ('monthly_totals', 'category_totals', 'expenses', 'missing_rates'):
+            self.assertEqual(response.context[key], sync_response.context[key])
+        self.assertEqual([year.year for year in response.context['years']], [2024])
+
+    async def test_async_add_and_delete(self):
+        response = await self.async_client.post(reverse('add_expense_async'), {
+            'date': '2024-02-01', 'category': 'food', 'title': 'Lunch', 'currency': 'PLN', 'amount': '20.00'
+        })
+        self.assertRedirects(response, reverse('expense_list_async'), fetch_redirect_response=False)
+        expense = await Expense.objects.aget(title='Lunch')
+        self.assertEqual(expense.category, 'Food')
+        self.assertEqual((await MonthlyTotal.objects.aget(user=self.user, month=datetime(2024, 2, 1))).total, Decimal('20.00'))
+
+        response = await self.async_client.post(reverse('delete_expense_async', args=[expense.id]))
+        self.assertRedirects(response, reverse('expense_list_async'), fetch_redirect_response=False)
+        self.assertFalse(await Expense.objects.filter(id=expense.id).aexists())
+
+    async def test_async_views_require_login(self):
+        self.async_client.cookies.clear()
+        response = await self.async_client.get(reverse('expense_list_async'))
+        self.assertRedirects(response, '/accounts/login/?next=/expenses/async/', fetch_redirect_response=False)
+
+    def test_benchmark_session_uses_the_configured_engine(self):
+        from .management.commands.benchmark_async import Command
+        for engine in ('db', 'cached_db', 'signed_cookies'):
+            with self.subTest(engine), self.settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{engine}'):
+                client = Client()
+                client.cookies[settings.SESSION_COOKIE_NAME] = Command().create_session(self.user)
+                self.assertEqual(client.get(reverse('expense_list')).status_code, 200)
+
+
+WRITER_SCRIPT = """
+from django.contrib.auth.models import User
+from expenses.models import Expense
+user = User.objects.get(username='writer')
+for i in range({writes}):
+    Expense.objects.create(user=user, title='w{worker}-' + str(i), amount='1.00', category='Load', date='2024-01-01')
+    list(Expense.objects.filter(user=user).order_by('-id')[:5])
+"""
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite specific')
+class SQLiteProductionProfileTest(SimpleTestCase):
+    workers = 4
+    writes = 40
+
+    def manage(self, env, *args):
+        return subprocess.run(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), *args],
+            env=env, capture_output=True, text=True, timeout=300,
+        )
+
+    def test_concurrent_writers_do_not_hit_lock_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, DATABASE_PROFILE='production', SQLITE_PATH=os.path.join(directory, 'load.sqlite3'))
+            self.assertEqual(self.manage(env, 'migrate', '-v0').returncode, 0)
+            created = self.manage(env, 'shell', '-c', "from django.contrib.auth.models import User; User.objects.create_user('writer')")
+            self.assertEqual(created.returncode, 0, created.stderr)
+
+            processes = [
+                subprocess.Popen(
+                    [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'shell', '-c',
+                     WRITER_SCRIPT.format(worker=worker, writes=self.writes)],
+                    env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                )
+                for worker in range(self.workers)
+            ]
+            for process in processes:
+                _, stderr = process.communicate(timeout=300)
+                self.assertEqual(process.returncode, 0, stderr)
+                self.assertNotIn('database is locked', stderr)
+
+            check = self.manage(env, 'shell', '-c', (
+                "from django.db import connection; from expenses.models import Expense, MonthlyTotal;"
+                "print(connection.cursor().execute('PRAGMA journal_mode').fetchone()[0],"
+                " Expense.objects.count(), MonthlyTotal.objects.get().count)"
+            ))
+            total = str(self.workers * self.writes)
+            self.assertEqual(check.stdout.split(), ['wal', total, total])
+
+
+class SeedAndBenchmarkCommandTest(TestCase):
+    def seed(self, *extra):
+        call_command('seed_expenses', '--users', '2', '--expenses', '150', '--seed', '7', '--end', '2024-06-30',
+                     '--batch-size', '64', *extra, stdout=StringIO())
+        return list(Expense.objects.order_by('user__username', 'date', 'title', 'amount_minor')
+                    .values_list('user__username', 'date', 'title', 'category', 'currency', 'amount_minor'))
+
+    def test_seed_is_deterministic_and_keeps_rollups_consistent(self):
+        first = self.seed()
+        self.assertEqual(len(first), 300)
+        self.assertEqual({row[0] for row in first}, {'seed0', 'seed1'})
+        self.assertTrue(all(datetime(2022, 1, 1).date() <= row[1] <= datetime(2024, 6, 30).date() for row in first))
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+        with self.assertRaises(CommandError):
+            self.seed()
+        self.assertEqual(self.seed('--clear'), first)
+
+    def test_benchmark_reports_latency_queries_and_memory(self):
+        self.seed()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.json')
+            call_command('benchmark', '--user', 'seed0', '--iterations', '3', '--warmup', '1', '--year', '2024',
+                         '--output', path, stdout=StringIO())
+            with open(path) as results:
+                report = json.load(results)
+        self.assertEqual(report['meta']['expenses'], 150)
+        self.assertEqual(set(report['views']), {'expense_list', 'expense_list_async', 'chart_data', 'add_expense', 'export_expenses'})
+        for metrics in report['views'].values():
+            self.assertLessEqual(metrics['p50_ms'], metrics['p99_ms'])
+            self.assertGreater(metrics['queries'], 0)
+            self.assertGreater(metrics['peak_memory_kb'], 0)
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        from budget_manager import metrics
+        self.metrics = metrics
+        metrics.reset()
+        self.user = User.objects.create_user(username='testuser', password='12345', is_staff=True)
+        self.client.login(username='testuser', password='12345')
+        Expense.objects.create(user=self.user, title='Lunch', amount=Decimal('20.00'), category='Food',
+                               date=datetime(2024, 3, 1).date())
+
+    def test_histograms_are_recorded_per_url_name(self):
+        self.client.get(reverse('expense_list'), {'year': 2024})
+        self.client.get(reverse('expense_list'), {'year': 2024})
+        self.client.get('/no-such-page/')
+        duration, count, _ = self.metrics.REQUEST_DURATION.labels('expense_list').snapshot()
+        self.assertEqual(count, 2)
+        self.assertEqual(duration[-1], 2)
+        _, query_count, queries = self.metrics.REQUEST_QUERIES.labels('expense_list').snapshot()
+        self.assertEqual(query_count, 2)
+        self.assertGreater(queries, 0)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE django_request_duration_seconds histogram', body)
+        self.assertIn('django_request_duration_seconds_count{view="expense_list"} 2', body)
+        self.assertIn('django_request_db_queries_bucket{view="expense_list",le="+Inf"} 2', body)
+        self.assertIn('django_request_db_duration_seconds_sum{view="expense_list"}', body)
+        self.assertIn('view="<unresolved>"', body)
+
+    def test_aggregate_cache_hits_and_misses_are_served(self):
+        aggregates_cache.aggregates_cache().clear()
+        self.client.get(reverse('expense_list'), {'year': 2024})
+        self.client.get(reverse('expense_list'), {'year': 2024})
+        stats = aggregates_cache.stats()
+        self.assertGreater(stats['hits'], 0)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('# TYPE expenses_aggregate_cache_lookups_total counter', body)
+        self.assertIn(f'expenses_aggregate_cache_lookups_total{{result="hit"}} {stats["hits"]}', body)
+        self.assertIn(f'expenses_aggregate_cache_lookups_total{{result="miss"}} {stats["misses"]}', body)
+
+    def test_metrics_endpoint_is_limited_to_staff(self):
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with self.settings(METRICS_ALLOW_INTERNAL_IPS=True):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.1.2.3').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.1.2.3').status_code, 200)
+
+    def test_histogram_merges_thread_shards(self):
+        import threading
+        histogram = self.metrics.Histogram((1, 10))
+        threads = [threading.Thread(target=lambda: [histogram.observe(value) for value in (0.5, 5, 50)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(histogram.snapshot(), ([4, 8, 12], 12, 4 * 55.5))
+
+    def test_shards_of_finished_threads_are_folded_together(self):
+        import threading
+        histogram = self.metrics.Histogram((1, 10))
+        for _ in range(5):
+            thread = threading.Thread(target=histogram.observe, args=(5,))
+            thread.start()
+            thread.join()
+        self.assertEqual(histogram.snapshot(), ([0, 5, 5], 5, 25))
+        self.assertEqual(histogram._shards, [])
+
+    def test_middleware_runs_in_the_async_chain(self):
+        from asgiref.sync import iscoroutinefunction
+        from budget_manager.middleware import RequestMetricsMiddleware
+
+        async def get_response(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(RequestMetricsMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(RequestMetricsMiddleware(lambda request: None)))
+
+    async def test_async_views_are_recorded(self):
+        await sync_to_async(self.client.login)(username='testuser', password='12345')
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get(reverse('expense_list_async'), {'year': 2024})
+        self.assertEqual(response.status_code, 200)
+        _, count, queries = self.metrics.REQUEST_QUERIES.labels('expense_list_async').snapshot()
+        self.assertEqual(count, 1)
+        self.assertGreater(queries, 0)
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs('budget_manager.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('expense_list'), {'year': 2024})
+        self.assertIn('(expense_list)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_slow_request_log_is_off_by_default(self):
+        self.assertIsNone(settings.METRICS_SLOW_REQUEST_MS)
+        with self.assertNoLogs('budget_manager.slow_requests'):
+            self.client.get(reverse('expense_list'), {'year': 2024})
+
+
+class MinorUnitsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+
+    def test_amount_is_stored_in_minor_units_of_its_currency(self):
+        pln = Expense.objects.create(user=self.user, title='Lunch', amount=Decimal('12.34'), category='Food',
+                                     date=datetime(2024, 1, 1).date())
+        jpy = Expense.objects.create(user=self.user, title='Ramen', amount='1500', category='Food',
+                                     date=datetime(2024, 1, 2).date(), currency='JPY')
+        self.assertEqual((pln.amount_minor, jpy.amount_minor), (1234, 1500))
+        pln.refresh_from_db()
+        self.assertEqual(pln.amount, Decimal('12.34'))
+        self.assertEqual(str(pln.amount), '12.34')
+
+    def test_form_checks_precision_against_currency(self):
+        data = {'title': 'Ramen', 'amount': '12.50', 'category': 'Food', 'date': '2024-01-01', 'currency': 'JPY'}
+        form = ExpenseForm(data=data, user=self.user)
+        self.assertFalse(form.is_valid())
+        self.assertIn('no more than 0 decimal places for JPY', form.errors['amount'][0])
+
+        form = ExpenseForm(data={**data, 'amount': '12.50', 'currency': 'EUR'}, user=self.user)
+        self.assertTrue(form.is_valid())
+        expense = form.save(commit=False)
+        expense.user = self.user
+        expense.save()
+        self.assertEqual(Expense.objects.get().amount_minor, 1250)
+
+    def test_aggregates_sum_integers(self):
+        for amount in ('0.10', '0.20', '0.30'):
+            Expense.objects.create(user=self.user, title='Gum', amount=amount, category='Food',
+                                   date=datetime(2024, 1, 5).date())
+        self.assertEqual(MonthlyTotal.objects.get().total_minor, 60)
+        self.assertEqual(category_rows(self.user, datetime(2024, 1, 1).date(), datetime(2025, 1, 1).date())[0]['sum_minor'], 60)
+        response = self.client.get(reverse('chart_data'), {'year': 2024})
+        self.assertEqual(response.json()['series'][0]['data'][0], 0.6)
+
+
+class ExpenseSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.other = User.objects.create_user(username='other', password='12345')
+        self.client.login(username='testuser', password='12345')
+        self.groceries = Expense.objects.create(user=self.user, title='Żabka groceries', amount='12.00', category='Food',
+                                                date=datetime(2021, 3, 1).date())
+        self.fuel = Expense.objects.create(user=self.user, title='Fuel', amount='200.00', category='Transport',
+                                           date=datetime(2024, 3, 1).date())
+        Expense.objects.create(user=self.other, title='Groceries', amount='5.00', category='Food',
+                               date=datetime(2024, 3, 1).date())
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('search_expenses'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_search_matches_prefixes_and_ignores_accents_and_other_users(self):
+        response = self.search('zabka groc')
+        self.assertTrue(response.context['ranked'])
+        self.assertEqual([expense.pk for expense in response.context['expenses']], [self.groceries.pk])
+        self.assertEqual([expense.pk for expense in self.search('transport').context['expenses']], [self.fuel.pk])
+        self.assertEqual(list(self.search('(food" *').context['expenses']), [self.groceries])
+        self.assertEqual(list(self.search('').context['expenses']), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.fuel.title = 'Diesel'
+        self.fuel.save()
+        self.assertEqual(list(self.search('fuel').context['expenses']), [])
+        self.assertEqual(list(self.search('diesel').context['expenses']), [self.fuel])
+        self.fuel.delete()
+        self.assertEqual(list(self.search('diesel').context['expenses']), [])
+
+    @override_settings(EXPENSES_PAGE_SIZE=2)
+    def test_results_are_ranked_and_keyset_paginated(self):
+        for index in range(3):
+            Expense.objects.create(user=self.user, title=f'Coffee {index}', amount='1.00', category='Food',
+                                   date=datetime(2024, 1, 1 + index).date())
+        Expense.objects.create(user=self.user, title='Food market', amount='1.00', category='Food',
+                               date=datetime(2024, 1, 9).date())
+        first = self.search('food')
+        # A title hit outranks category-only hits
+        self.assertEqual(first.context['expenses'][0].title, 'Food market')
+        seen = [expense.pk for expense in first.context['expenses']]
+        after = first.context['next_cursor']
+        while after:
+            page = self.search('food', after=after)
+            seen += [expense.pk for expense in page.context['expenses']]
+            after = page.context['next_cursor']
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+    @override_settings(EXPENSES_PAGE_SIZE=1)
+    def test_cursors_of_the_other_endpoint_are_ignored(self):
+        from .pagination import encode_cursor
+        Expense.objects.create(user=self.user, title='Tea', amount='1.00', category='Food', date=datetime(2024, 1, 1).date())
+        search_cursor = self.search('food').context['next_cursor']
+        list_cursor = self.client.get(reverse('expense_list'), {'year': 2024}).context['next_cursor']
+        self.assertIsNotNone(search_cursor)
+        self.assertIsNotNone(list_cursor)
+        self.assertEqual(list(self.search('food', after=list_cursor).context['expenses']), list(self.search('food').context['expenses']))
+        for after in (search_cursor, encode_cursor('not a date'), encode_cursor('2024-01-01', 1, 2)):
+            response = self.client.get(reverse('expense_list'), {'year': 2024, 'after': after})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['expenses']), 1)
+
+    def test_fallback_without_fts5(self):
+        from unittest import mock
+        with mock.patch('expenses.search.search_available', return_value=False):
+            response = self.search('GROC')
+        self.assertFalse(response.context['ranked'])
+        self.assertEqual(list(response.context['expenses']), [self.groceries])
+
+    def test_post_migrate_restores_dropped_triggers(self):
+        from .search import FTS_TABLE, TRIGGERS, repair_search_triggers
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER expenses_expense_fts_insert')
+        Expense.objects.create(user=self.user, title='Bakery', amount='3.00', category='Food',
+                               date=datetime(2024, 2, 1).date())
+        repair_search_triggers(using='default')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'expenses_expense'")
+            self.assertEqual(cursor.fetchone()[0], len(TRIGGERS))
+            cursor.execute(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH 'bakery'")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class MultiYearSummaryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        for day, amount, category in (
+            ('2022-01-10', '100.00', 'Food'), ('2022-03-05', '50.00', 'Bills'),
+            ('2023-01-20', '150.00', 'Food'), ('2023-02-01', '10.00', 'Food'),
+            ('2024-03-01', '40.00', 'Bills'),
+        ):
+            Expense.objects.create(user=self.user, title='Item', amount=amount, category=category,
+                                   date=datetime.fromisoformat(day).date())
+
+    def test_year_matrix_with_running_totals_and_yoy_deltas(self):
+        response = self.client.get(reverse('summary_data'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['years'], [2022, 2023, 2024])
+        self.assertEqual(len(data['labels']), 12)
+        y2022, y2023, y2024 = data['totals']
+        self.assertEqual(y2022['months'][:3], [100.0, 0.0, 50.0])
+        self.assertEqual(y2022['running'][:3], [100.0, 100.0, 150.0])
+        self.assertEqual(y2022['total'], 150.0)
+        self.assertIsNone(y2022['yoy_total'])
+        self.assertEqual(y2023['yoy_months'][:3], [50.0, 10.0, -50.0])
+        self.assertEqual((y2023['yoy_total'], y2023['yoy_percent']), (10.0, 6.7))
+        self.assertEqual((y2024['total'], y2024['yoy_percent']), (40.0, -75.0))
+        self.assertEqual(data['categories'], {})
+
+    def test_category_split_and_explicit_range(self):
+        data = self.client.get(reverse('summary_data'), {'start_year': 2021, 'end_year': 2023, 'split': 'category'}).json()
+        self.assertEqual(data['years'], [2021, 2022, 2023])
+        self.assertEqual(set(data['categories']), {'Bills', 'Food'})
+        self.assertEqual([row['total'] for row in data['categories']['Food']], [0.0, 100.0, 160.0])
+        self.assertEqual([row['total'] for row in data['totals']], [0.0, 150.0, 160.0])
+        self.assertIsNone(data['totals'][1]['yoy_percent'])
+
+    def test_whole_range_is_one_aggregate_query(self):
+        self.client.get(reverse('summary_data'))
+        aggregates_cache.aggregates_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('summary_data'), {'start_year': 2015, 'end_year': 2024})
+        rollup_queries = [query for query in queries if 'expenses_monthlytotal' in query['sql']]
+        self.assertEqual(len(rollup_queries), 2)  # years present + the grouped year x month rows
+        self.assertIn('GROUP BY', rollup_queries[-1]['sql'])
+
+    def test_invalid_range_and_html_page(self):
+        self.assertEqual(self.client.get(reverse('summary_data'), {'start_year': 2024, 'end_year': 2020}).status_code, 400)
+        response = self.client.get(reverse('summary'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['year'] for row in response.context['totals']], [2022, 2023, 2024])
+        self.assertContains(response, '10.00 (6.7%)')
+
+
+class AnalyticsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        # 100 PLN every month of 2023 except 300 in December, then 200 a month in 2024
+        for month in range(1, 13):
+            Expense.objects.create(user=self.user, title='Rent', amount='300.00' if month == 12 else '100.00',
+                                   category='Bills', date=datetime(2023, month, 10).date())
+        for month in range(1, 7):
+            Expense.objects.create(user=self.user, title='Rent', amount='200.00', category='Bills',
+                                   date=datetime(2024, month, 10).date())
+        Expense.objects.create(user=self.user, title='Lunch', amount='50.00', category='Food',
+                               date=datetime(2024, 5, 3).date())
+        Expense.objects.create(user=self.user, title='Lunch', amount='25.00', category='Food',
+                               date=datetime(2024, 6, 3).date())
+        Expense.objects.create(user=self.user, title='Bakery', amount='10.00', category='Food',
+                               date=datetime(2024, 7, 1).date())
+        Expense.objects.create(user=self.user, title='Hotel', amount='99.00', category='Travel',
+                               date=datetime(2024, 6, 1).date(), currency='USD')
+
+    def insights(self):
+        from .analytics import compute_insights
+        clear_rate_cache()
+        with self.assertNumQueries(5):  # the expense columns, the archived totals, the rates version, then the USD rate for June and its inverse
+            return compute_insights(self.user, 'PLN', today=datetime(2024, 7, 15).date())
+
+    def test_rolling_averages_and_growth(self):
+        data = self.insights()
+        self.assertEqual(data['months'][0], '2023-07')
+        self.assertEqual(data['months'][-1], '2024-06')
+        self.assertEqual(data['totals'][-2:], [250.0, 225.0])
+        self.assertEqual(data['rolling_3'][-1], round((200 + 250 + 225) / 3, 2))
+        self.assertEqual(data['rolling_12'][-1], round((5 * 100 + 300 + 4 * 200 + 250 + 225) / 12, 2))
+        categories = {category['name']: category for category in data['categories']}
+        self.assertEqual(categories['Food']['last_growth'], -50.0)
+        self.assertEqual(categories['Bills']['last_growth'], 0.0)
+        self.assertEqual(categories['Bills']['percentiles']['p50'], 100.0)
+        self.assertEqual(data['missing_rates'], ['USD'])
+        self.assertEqual(categories['Travel']['percentiles']['p90'], 0.0)
+
+    def test_seasonal_forecast_for_rest_of_year(self):
+        data = self.insights()
+        self.assertEqual([month['month'] for month in data['forecast']], ['2024-07', '2024-08', '2024-09', '2024-10', '2024-11', '2024-12'])
+        forecast = {month['month']: month['amount'] for month in data['forecast']}
+        # December was three times a normal month, so it is forecast higher than the rest
+        self.assertGreater(forecast['2024-12'], 2 * forecast['2024-08'])
+        self.assertEqual(data['year_to_date'], 6 * 200 + 75 + 10)
+        self.assertAlmostEqual(data['projected_year_total'], 6 * 200 + 75 + sum(forecast.values()), places=1)
+
+    def test_json_endpoint_is_cached_per_data_version(self):
+        aggregates_cache.reset_stats()
+        first = self.client.get(reverse('insights_data'))
+        self.assertEqual(first.status_code, 200)
+        self.client.get(reverse('insights_data'))
+        self.assertEqual(aggregates_cache.stats()['hits'], 1)
+        Expense.objects.create(user=self.user, title='Taxi', amount='10.00', category='Transport',
+                               date=datetime(2024, 6, 20).date())
+        self.assertIn('Transport', [category['name'] for category in self.client.get(reverse('insights_data')).json()['categories']])
+        self.assertContains(self.client.get(reverse('insights')), 'Projected for the whole year')
+
+    def test_json_endpoint_etag_changes_with_the_month(self):
+        etag = self.client.get(reverse('insights_data'))['ETag']
+        self.assertIn(f'{date.today():%Y-%m}', etag)
+        self.assertEqual(self.client.get(reverse('insights_data'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        last_month = etag.replace(f'{date.today():%Y-%m}', '2000-01')
+        self.assertEqual(self.client.get(reverse('insights_data'), HTTP_IF_NONE_MATCH=last_month).status_code, 200)
+
+    def test_no_expenses(self):
+        Expense.objects.all().delete()
+        response = self.client.get(reverse('insights'))
+        self.assertContains(response, 'Insights appear once')
+
+
+class BudgetTest(TestCase):
+    def setUp(self):
+        from .budgets import current_month
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        self.month = current_month()
+        self.client.post(reverse('budgets'), {'category': 'Food', 'limit': '100.00', 'currency': 'PLN', 'alert_percent': 80})
+        self.budget = Budget.objects.get(user=self.user)
+
+    def add(self, amount, category='food'):
+        return self.client.post(reverse('add_expense'), {
+            'title': 'Groceries', 'amount': amount, 'category': category, 'date': self.month.isoformat(), 'currency': 'PLN',
+        }, follow=True)
+
+    def alerts(self):
+        return sorted(BudgetAlert.objects.filter(budget=self.budget, month=self.month).values_list('percent', flat=True))
+
+    def test_thresholds_are_flagged_as_they_are_crossed(self):
+        self.add('50.00')
+        self.assertEqual(self.alerts(), [])
+        response = self.add('35.00')
+        self.assertEqual(self.alerts(), [80])
+        self.assertContains(response, 'You have spent 80% of your Food budget')
+        response = self.add('20.00')
+        self.assertEqual(self.alerts(), [80, 100])
+        self.assertNotContains(response, 'spent 80%')
+        self.assertContains(response, 'class="over-budget"')
+
+        self.client.post(reverse('delete_expense', args=[Expense.objects.get(amount_minor=3500).pk]))
+        self.assertEqual(self.alerts(), [])
+
+    def test_usage_is_read_from_counters(self):
+        self.add('40.00')
+        self.add('5.00', category='Bills')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('expense_list'))
+        self.assertEqual(response.context['budgets'][0][1:], (Decimal('40.00'), 40))
+        self.assertFalse([query for query in queries if 'FROM "expenses_expense"' in query['sql'] and 'SUM' in query['sql']])
+        self.assertContains(response, '<progress max="100" value="40">')
+
+    def test_changing_the_limit_reevaluates_alerts(self):
+        self.add('60.00')
+        self.assertEqual(self.alerts(), [])
+        self.client.post(reverse('budgets'), {'category': 'FOOD', 'limit': '50.00', 'currency': 'PLN', 'alert_percent': 80})
+        self.assertEqual(Budget.objects.count(), 1)
+        self.assertEqual(self.alerts(), [80, 100])
+        self.client.post(reverse('delete_budget', args=[self.budget.pk]))
+        self.assertFalse(Budget.objects.exists())
+
+    def test_reconcile_budgets_reports_and_fixes_drift(self):
+        self.add('90.00')
+        call_command('reconcile_budgets', stdout=StringIO())
+        MonthlyTotal.objects.filter(user=self.user).update(total_minor=100)
+        BudgetAlert.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('reconcile_budgets', '--batch-size', '1', stdout=StringIO())
+        call_command('reconcile_budgets', '--fix', '--month', f'{self.month:%Y-%m}', stdout=StringIO())
+        call_command('reconcile_budgets', stdout=StringIO())
+        self.assertEqual(MonthlyTotal.objects.get(user=self.user).total_minor, 9000)
+        self.assertEqual(self.alerts(), [80])
+
+
+class RecurringExpenseTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+
+    def rule(self, **fields):
+        values = {'user': self.user, 'title': 'Rent', 'amount_minor': 150000, 'category': 'housing',
+                  'frequency': RecurringExpense.MONTHLY, 'start_date': datetime(2024, 1, 31).date()}
+        values.update(fields)
+        return RecurringExpense.objects.create(**values)
+
+    def test_occurrences_keep_the_start_day(self):
+        from .recurring import occurrence
+        start = datetime(2024, 1, 31).date()
+        self.assertEqual(
+            [occurrence(start, RecurringExpense.MONTHLY, index).isoformat() for index in range(4)],
+            ['2024-01-31', '2024-02-29', '2024-03-31', '2024-04-30'],
+        )
+        self.assertEqual(occurrence(datetime(2024, 2, 29).date(), RecurringExpense.YEARLY, 1).isoformat(), '2025-02-28')
+        self.assertEqual(occurrence(start, RecurringExpense.WEEKLY, 2).isoformat(), '2024-02-14')
+
+    def test_materialize_catches_up_once(self):
+        from .recurring import materialize
+        rule = self.rule()
+        self.rule(title='Gym', category='Sport', frequency=RecurringExpense.WEEKLY, start_date=datetime(2024, 3, 1).date(),
+                  end_date=datetime(2024, 3, 20).date())
+        until = datetime(2024, 4, 15).date()
+        self.assertEqual(materialize(until), (2, 6))
+        self.assertEqual(materialize(until), (0, 0))
+        self.assertEqual(
+            list(Expense.objects.filter(recurring=rule).order_by('date').values_list('date', flat=True)),
+            [datetime(2024, month, day).date() for month, day in ((1, 31), (2, 29), (3, 31))],
+        )
+        rule.refresh_from_db()
+        self.assertEqual(rule.next_date, datetime(2024, 4, 30).date())
+        self.assertIsNone(RecurringExpense.objects.get(title='Gym').next_date)
+        self.assertEqual(Expense.objects.get(date='2024-02-29').category_ref.name, 'housing')
+        self.assertEqual(MonthlyTotal.objects.get(user=self.user, month='2024-03-01', category='housing').total_minor, 150000)
+
+        # A run that failed after inserting, or a rewound rule, never duplicates occurrences
+        RecurringExpense.objects.filter(pk=rule.pk).update(next_date=rule.start_date)
+        self.assertEqual(materialize(until), (1, 0))
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+    def test_bulk_rollup_path_matches_the_expense_table(self):
+        from .recurring import materialize
+        from .search import search_page
+        users = [User.objects.create_user(username=f'user{index}') for index in range(60)]
+        RecurringExpense.objects.bulk_create([
+            RecurringExpense(user=user, title=f'Subscription {index}', amount_minor=999, category='Streaming',
+                             frequency=RecurringExpense.MONTHLY, start_date=datetime(2024, 1, 5).date(),
+                             next_date=datetime(2024, 1, 5).date())
+            for index, user in enumerate(users)
+        ])
+        Expense.objects.create(user=users[0], title='Old', amount_minor=1, category='Streaming', date='2024-02-01')
+        call_command('materialize_recurring', '--until', '2024-06-30', '--batch-size', '25', stdout=StringIO())
+        self.assertEqual(Expense.objects.filter(recurring__isnull=False).count(), 60 * 6)
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+        self.assertEqual(MonthlyTotal.objects.get(user=users[0], month='2024-02-01').total_minor, 1000)
+        self.assertEqual(len(search_page(users[7], 'subscription', None, 10)[0]), 6)
+
+    def test_saving_a_rule_adds_past_occurrences(self):
+        response = self.client.post(reverse('recurring_expenses'), {
+            'title': 'Netflix', 'amount': '43.00', 'category': 'Fun', 'currency': 'pln',
+            'frequency': 'yearly', 'start_date': '2023-05-01', 'end_date': '',
+        }, follow=True)
+        rule = RecurringExpense.objects.get(user=self.user)
+        self.assertEqual(rule.currency, 'PLN')
+        self.assertGreaterEqual(Expense.objects.filter(recurring=rule).count(), 3)
+        self.assertContains(response, 'Netflix')
+        self.client.post(reverse('delete_recurring_expense', args=[rule.pk]))
+        self.assertFalse(RecurringExpense.objects.exists())
+        self.assertTrue(Expense.objects.filter(title='Netflix', recurring__isnull=True).exists())
+
+
+class ExpenseAdminTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='12345')
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='admin', password='12345')
+        for month in (1, 2, 3):
+            for title in ('Bread', 'Milk'):
+                Expense.objects.create(user=self.user, title=title, amount_minor=1000, category='Food', date=f'2024-{month:02d}-10')
+        Expense.objects.create(user=self.admin, title='Bread', amount_minor=500, category='Food', date='2024-01-10')
+        self.url = reverse('admin:expenses_expense_changelist')
+
+    def test_changelist_avoids_distinct_and_full_counts(self):
+        from unittest import mock
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        with mock.patch('expenses.admin.ESTIMATE_MIN_ROWS', 1), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'user__id__exact': self.user.pk, 'date__year': 2024})
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        expense_queries = [query['sql'] for query in queries if 'FROM "expenses_expense"' in query['sql']]
+        self.assertFalse([sql for sql in expense_queries if 'DISTINCT "expenses_expense"."currency"' in sql or 'DISTINCT "expenses_expense"."category"' in sql])
+        self.assertFalse([sql for sql in expense_queries if sql.startswith('SELECT COUNT(*)') and 'WHERE' not in sql])
+        self.assertEqual(response.context['cl'].result_count, 7)
+        self.assertNotIn('delete_selected', response.context['cl'].model_admin.get_actions(response.wsgi_request))
+
+    def test_bulk_actions_keep_rollups_in_step(self):
+        selected = Expense.objects.filter(user=self.user, title='Milk').values_list('pk', flat=True)
+        data = {'action': 'move_to_category', 'index': 0, '_selected_action': list(selected)}
+        response = self.client.post(self.url, data)
+        self.assertContains(response, 'This will change 3 expenses')
+        response = self.client.post(self.url, {**data, 'apply': 'yes', 'category': 'dairy'}, follow=True)
+        self.assertContains(response, 'Moved 3 expenses to dairy.')
+        self.assertEqual(set(Expense.objects.filter(title='Milk').values_list('category', flat=True)), {'dairy'})
+        self.assertEqual(MonthlyTotal.objects.get(user=self.user, month='2024-02-01', category='dairy').total_minor, 1000)
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+        # "Select all" over a filtered list deletes the whole range at once
+        response = self.client.post(f'{self.url}?date__year=2024&date__month=1', {
+            'action': 'delete_in_bulk', 'index': 0, 'select_across': 1, '_selected_action': [selected[0]], 'apply': 'yes',
+        }, follow=True)
+        self.assertContains(response, 'Deleted 3 expenses.')
+        self.assertFalse(Expense.objects.filter(date__month=1).exists())
+        self.assertEqual(Expense.objects.count(), 4)
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+
+class SyncApiTest(TestCase):
+    RENT = '6f1c2a1e-0000-4000-8000-000000000001'
+    COFFEE = '6f1c2a1e-0000-4000-8000-000000000002'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+
+    def sync(self, upserts=(), deletes=()):
+        return self.client.post(
+            reverse('sync_expenses'), json.dumps({'upserts': list(upserts), 'deletes': list(deletes)}),
+            content_type='application/json',
+        )
+
+    def changes(self, since=0):
+        return self.client.get(reverse('expense_changes'), {'since': since}).json()
+
+    def upsert(self, client_id, title, amount):
+        return {'client_id': client_id, 'title': title, 'amount': amount, 'category': 'Bills', 'date': '2024-05-01', 'currency': 'PLN'}
+
+    def test_batches_are_idempotent(self):
+        batch = [self.upsert(self.RENT, 'Rent', '1500.00'), self.upsert(self.COFFEE, 'Coffee', '12.50')]
+        first = self.sync(batch).json()
+        self.assertEqual((first['created'], first['updated']), (2, 0))
+        replay = self.sync(batch).json()
+        self.assertEqual((replay['created'], replay['unchanged'], replay['cursor']), (0, 2, first['cursor']))
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(MonthlyTotal.objects.get(user=self.user).total_minor, 151250)
+        feed = self.changes()
+        self.assertEqual([change['title'] for change in feed['changes']], ['Rent', 'Coffee'])
+        self.assertEqual((feed['cursor'], feed['more']), (first['cursor'], False))
+
+    def test_feed_returns_latest_state_and_tombstones(self):
+        cursor = self.sync([self.upsert(self.RENT, 'Rent', '1500.00'), self.upsert(self.COFFEE, 'Coffee', '12.50')]).json()['cursor']
+        self.client.post(reverse('add_expense'), {'title': 'Lunch', 'amount': '30.00', 'category': 'Food', 'date': '2024-05-02', 'currency': 'PLN'})
+        result = self.sync([self.upsert(self.RENT, 'Rent', '1600.00'), self.upsert(self.RENT, 'Rent', '1550.00')], [self.COFFEE]).json()
+        self.assertEqual((result['updated'], result['deleted']), (1, 1))
+        lunch = Expense.objects.get(title='Lunch')
+        self.client.post(reverse('delete_expense', args=[lunch.pk]))
+
+        feed = self.changes(cursor)
+        self.assertEqual(
+            [(change['client_id'], change['deleted'], change.get('amount')) for change in feed['changes']],
+            [(self.RENT, False, '1550.00'), (self.COFFEE, True, None), (None, True, None)],
+        )
+        self.assertEqual(feed['changes'][2]['id'], lunch.pk)
+        # One log row per expense however often it changed
+        self.assertEqual(ExpenseChange.objects.filter(user=self.user).count(), 3)
+        # A late replay of the deleted expense's upsert does not bring it back
+        self.assertEqual(self.sync([self.upsert(self.COFFEE, 'Coffee', '12.50')]).json()['skipped'], 1)
+        self.assertEqual(self.changes(feed['cursor'])['changes'], [])
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+    def test_archived_expenses_cannot_be_synced(self):
+        self.sync([{**self.upsert(self.RENT, 'Rent', '1500.00'), 'date': '2022-05-01'}, self.upsert(self.COFFEE, 'Coffee', '12.50')])
+        call_command('archive_years', before=2023, stdout=StringIO())
+        rollup = list(MonthlyTotal.objects.values_list('month', 'total_minor', 'count'))
+        for response in (self.sync([{**self.upsert(self.RENT, 'Rent', '1600.00'), 'date': '2022-05-01'}]),
+                         self.sync([self.upsert(self.COFFEE, 'Coffee', '13.00')], [self.RENT])):
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['errors'], {self.RENT: {'client_id': [{
+                'message': 'This expense is archived; its year must be unarchived to change it.', 'code': 'archived',
+            }]}})
+        self.assertEqual(list(Expense.objects.values_list('title', 'amount_minor')), [('Coffee', 1250)])
+        self.assertEqual(list(MonthlyTotal.objects.values_list('month', 'total_minor', 'count')), rollup)
+
+        call_command('unarchive_years', user=self.user.pk, stdout=StringIO())
+        self.assertFalse(ArchivedClientId.objects.exists())
+        self.assertEqual(self.sync([], [self.RENT]).json()['deleted'], 1)
+
+    def test_invalid_batch_changes_nothing(self):
+        response = self.sync([self.upsert(self.RENT, 'Rent', '1500.00'), {**self.upsert(self.COFFEE, 'Coffee', '-1'), 'category': 'Drinks'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(self.COFFEE, response.json()['errors'])
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(Category.objects.filter(name='Drinks').exists())
+        self.assertEqual(self.sync([{'client_id': 'nope'}]).status_code, 400)
+        self.assertEqual(self.client.get(reverse('expense_changes'), {'since': -1}).status_code, 400)
+
+
+@override_settings(AUTH_USER_CACHE_TIMEOUT=30)
+class CachedUserTest(TestCase):
+    def setUp(self):
+        caches[settings.AUTH_USER_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(reverse('expense_list')).status_code, 200)
+        return len(captured)
+
+    def test_cached_user_saves_the_user_query(self):
+        with override_settings(AUTH_USER_CACHE_TIMEOUT=0):
+            self.count_queries()
+            uncached = self.count_queries()
+        self.count_queries()
+        self.assertEqual(self.count_queries(), uncached - 1)
+
+    def test_cached_db_sessions_skip_the_database(self):
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db'):
+            client = Client()
+            client.login(username='testuser', password='12345')
+            self.client = client
+            self.count_queries()
+            cached = self.count_queries()
+        with override_settings(AUTH_USER_CACHE_TIMEOUT=0):
+            self.client = Client()
+            self.client.login(username='testuser', password='12345')
+            self.assertEqual(self.count_queries(), cached + 2)
+
+    def test_password_change_ends_other_sessions(self):
+        self.count_queries()
+        other = Client()
+        other.login(username='testuser', password='12345')
+        self.user.set_password('new password')
+        self.user.save()
+        response = self.client.get(reverse('expense_list'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(settings.LOGIN_URL))
+
+    def test_logout_drops_the_cached_user(self):
+        self.count_queries()
+        self.assertIsNotNone(caches[settings.AUTH_USER_CACHE_ALIAS].get(f'auth:user:{self.user.pk}'))
+        self.client.post(reverse('account_logout'))
+        self.assertIsNone(caches[settings.AUTH_USER_CACHE_ALIAS].get(f'auth:user:{self.user.pk}'))
+        self.assertEqual(self.client.get(reverse('expense_list')).status_code, 302)
+
+    def test_cached_user_requires_a_shared_cache(self):
+        from budget_manager.auth import check_shared_cache
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['budget_manager.E001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+        with override_settings(AUTH_USER_CACHE_TIMEOUT=0):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+def exit_worker(job_id):
+    """report_worker.run() stand-in killing its pool process; module level so spawned workers can load it."""
+    os._exit(1)
+
+
+class ReportJobTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        for day, amount, currency in [(datetime(2023, 3, 1), '10.00', 'PLN'), (datetime(2024, 1, 5), '2.50', 'EUR'),
+                                      (datetime(2024, 2, 5), '4.00', 'PLN')]:
+            Expense.objects.create(user=self.user, title='Lunch', amount=Decimal(amount), category='Food', date=day, currency=currency)
+
+    def request(self, report='annual_summary'):
+        return self.client.post(reverse('request_report_job'), {'report': report})
+
+    def run_jobs(self):
+        call_command('run_report_jobs', workers=0, once=True, stdout=StringIO())
+
+    def test_requests_for_the_same_data_share_one_job(self):
+        first = self.request()
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(self.request().json()['id'], first.json()['id'])
+        Expense.objects.create(user=self.user, title='Tea', amount=Decimal('1.00'), category='Food', date=datetime(2024, 3, 1))
+        self.assertNotEqual(self.request().json()['id'], first.json()['id'])
+        self.assertEqual(ReportJob.objects.filter(user=self.user).count(), 2)
+
+    def test_worker_builds_the_report_for_download(self):
+        job = self.request().json()
+        self.assertEqual((job['status'], job['download_url']), ('queued', None))
+        self.assertEqual(self.client.get(reverse('download_report', args=[job['id']])).status_code, 404)
+        self.run_jobs()
+        status = self.client.get(job['status_url']).json()
+        self.assertEqual((status['status'], status['progress']), ('done', 100))
+        self.assertEqual(self.request().status_code, 200)
+        response = self.client.get(status['download_url'])
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[0].split(',')[:4], ['year', 'category', 'currency', '01'])
+        self.assertEqual(rows[1:], [
+            '2023,Food,PLN,0.00,0.00,10.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,10.00,1',
+            '2024,Food,EUR,2.50,0.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,2.50,1',
+            '2024,Food,PLN,0.00,4.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,0.00,4.00,1',
+        ])
+        other = User.objects.create_user(username='other', password='12345')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(status['download_url']).status_code, 404)
+
+    def test_full_export_and_replacing_outdated_results(self):
+        old = ReportJob.objects.get(pk=self.request('full_export').json()['id'])
+        self.run_jobs()
+        old.refresh_from_db()
+        with old.result.open('rb') as result:
+            self.assertEqual(gzip.decompress(result.read()).decode().splitlines()[1], 'Lunch,10.00,Food,2023-03-01,PLN')
+        Expense.objects.create(user=self.user, title='Tea', amount=Decimal('1.00'), category='Food', date=datetime(2024, 3, 1))
+        self.request('full_export')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.run_jobs()
+        self.assertFalse(ReportJob.objects.filter(pk=old.pk).exists())
+        self.assertFalse(old.result.storage.exists(old.result.name))
+
+    def test_failed_job_is_queued_again(self):
+        job = ReportJob.objects.get(pk=self.request().json()['id'])
+        ReportJob.objects.filter(pk=job.pk).update(status=ReportJob.FAILED, error='OperationalError: disk full')
+        self.assertEqual(self.request().json()['status'], 'queued')
+        self.assertEqual(self.client.get(reverse('reports')).context['pending'], True)
+
+    def test_dead_worker_fails_its_jobs_and_the_pool_is_replaced(self):
+        from unittest import mock
+        from expenses.management.commands.run_report_jobs import Command
+        first = self.request().json()['id']
+        second = self.request('full_export').json()['id']
+        stderr = StringIO()
+        with mock.patch('expenses.report_worker.run', exit_worker):
+            Command(stdout=StringIO(), stderr=stderr).run_pool(2, 0.1, once=True)
+        self.assertEqual(
+            set(ReportJob.objects.values_list('pk', 'status', 'error')),
+            {(job_id, ReportJob.FAILED, 'The worker process running the job died.') for job_id in (first, second)},
+        )
+        # run_pool() only returned once a new pool found the queue empty
+        self.assertIn('starting a new pool', stderr.getvalue())
+
+
+class SvgChartTest(TestCase):
+    def setUp(self):
+        aggregates_cache.aggregates_cache().clear()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        for day, amount, category in [(datetime(2024, 1, 10), '100.00', 'Food'), (datetime(2024, 3, 10), '40.00', 'Bills & <Fees>'),
+                                      (datetime(2024, 3, 12), '20.00', 'Food')]:
+            Expense.objects.create(user=self.user, date=day, category=category, title='Item', currency='PLN', amount=Decimal(amount))
+
+    def svg(self, response):
+        html = response.content.decode()
+        self.assertNotIn('cdn.jsdelivr.net', html)
+        svg = html[html.index('<svg'):html.index('</svg>') + len('</svg>')]
+        return ElementTree.fromstring(svg)
+
+    def test_expense_list_renders_the_monthly_line_chart(self):
+        chart = self.svg(self.client.get(reverse('expense_list'), {'year': 2024}))
+        namespace = '{http://www.w3.org/2000/svg}'
+        points = chart.find(f'{namespace}polyline').get('points').split()
+        self.assertEqual(len(points), 12)
+        # March (60) sits lower on the page than January (100), February is on the axis
+        self.assertLess(float(points[0].split(',')[1]), float(points[2].split(',')[1]))
+        self.assertEqual(points[1].split(',')[1], chart.find(f'{namespace}polygon').get('points').split()[0].split(',')[1])
+
+    def test_category_chart_stacks_bars_and_escapes_names(self):
+        response = self.client.get(reverse('expense_list'), {'year': 2024, 'chart': 'category'})
+        self.assertIn('Bills &amp; &lt;Fees&gt;', response.content.decode())
+        chart = self.svg(response)
+        titles = [rect.find('{http://www.w3.org/2000/svg}title').text for rect in chart.iter('{http://www.w3.org/2000/svg}rect')
+                  if rect.find('{http://www.w3.org/2000/svg}title') is not None]
+        self.assertEqual(titles, ['Food Jan: 100.00 PLN', 'Bills & <Fees> Mar: 40.00 PLN', 'Food Mar: 20.00 PLN'])
+        self.svg(self.client.get(reverse('expense_list_async'), {'year': 2024, 'chart': 'category'}))
+
+    def test_chart_is_cached_per_data_version(self):
+        self.client.get(reverse('expense_list'), {'year': 2024})
+        aggregates_cache.reset_stats()
+        first = self.client.get(reverse('expense_list'), {'year': 2024}).content
+        self.assertEqual(aggregates_cache.stats()['misses'], 0)
+        Expense.objects.create(user=self.user, date=datetime(2024, 2, 1), category='Food', title='Item', currency='PLN', amount=Decimal('5.00'))
+        self.assertNotEqual(self.client.get(reverse('expense_list'), {'year': 2024}).content, first)
+
+    def test_summary_draws_one_line_per_year(self):
+        Expense.objects.create(user=self.user, date=datetime(2023, 6, 1), category='Food', title='Item', currency='PLN', amount=Decimal('5.00'))
+        chart = self.svg(self.client.get(reverse('summary')))
+        self.assertEqual(len(chart.findall('{http://www.w3.org/2000/svg}polyline')), 2)
+
+
+class ExpenseArchiveTest(TestCase):
+    def setUp(self):
+        aggregates_cache.aggregates_cache().clear()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        for day, amount, category in [(datetime(2022, 1, 5), '10.00', 'Food'), (datetime(2022, 1, 20), '5.50', 'Bills'),
+                                      (datetime(2022, 7, 1), '3.00', 'Food'), (datetime(2024, 2, 1), '7.00', 'Food')]:
+            Expense.objects.create(user=self.user, title=f'Item {day:%m-%d}', amount=Decimal(amount), category=category, date=day, currency='PLN')
+        self.rollup = sorted(MonthlyTotal.objects.values_list('month', 'category', 'currency', 'total_minor', 'count'))
+        call_command('archive_years', before=2023, stdout=StringIO())
+
+    def listed(self, name='expense_list', **params):
+        response = self.client.get(reverse(name), {'year': 2022, **params})
+        return [(str(expense.date), str(expense.amount)) for expense in response.context['expenses']], response
+
+    def test_archived_year_leaves_the_expense_table_but_keeps_its_totals(self):
+        self.assertEqual(list(Expense.objects.values_list('date', flat=True)), [date(2024, 2, 1)])
+        archive = ExpenseArchive.objects.get(user=self.user, year=2022)
+        self.assertEqual(archive.row_count, 3)
+        self.assertEqual(sorted(MonthlyTotal.objects.values_list('month', 'category', 'currency', 'total_minor', 'count')), self.rollup)
+        self.assertFalse(ExpenseChange.objects.filter(deleted=True).exists())
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+    def test_archive_size_covers_only_this_runs_archives(self):
+        other = User.objects.create_user(username='other', password='12345')
+        Expense.objects.create(user=other, title='Old', amount=Decimal('1.00'), category='Food', date=datetime(2021, 3, 1))
+        stdout = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('archive_years', before=2023, stdout=stdout)
+        size = len(ExpenseArchive.objects.get(user=other).data)
+        self.assertIn(f'these archives hold {size / 1024:.0f} KiB', stdout.getvalue())
+        # The blobs are sized in SQL, not loaded
+        self.assertIn('SUM(LENGTH("expenses_expensearchive"."data"))', queries.captured_queries[-1]['sql'])
+        self.assertIn('"archived_at" >=', queries.captured_queries[-1]['sql'])
+
+    def test_expense_list_pages_through_the_archive(self):
+        with self.settings(EXPENSES_PAGE_SIZE=2):
+            expenses, response = self.listed()
+            self.assertEqual(expenses, [('2022-07-01', '3.00'), ('2022-01-20', '5.50')])
+            self.assertContains(response, '<em>archived</em>')
+            self.assertEqual(response.context['category_totals'], [('Food', Decimal('13.00')), ('Bills', Decimal('5.50'))])
+            Expense.objects.create(user=self.user, title='Late', amount=Decimal('1.00'), category='Food', date=datetime(2022, 1, 10))
+            expenses, _ = self.listed(after=response.context['next_cursor'])
+            self.assertEqual(expenses, [('2022-01-10', '1.00'), ('2022-01-05', '10.00')])
+            expenses, _ = self.listed('expense_list_async')
+            self.assertEqual(expenses, [('2022-07-01', '3.00'), ('2022-01-20', '5.50')])
+
+    def test_exports_include_archived_expenses_in_date_order(self):
+        response = self.client.get(reverse('export_expenses'), {'category': 'Food'})
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[1:], [
+            'Item 01-05,10.00,Food,2022-01-05,PLN', 'Item 07-01,3.00,Food,2022-07-01,PLN', 'Item 02-01,7.00,Food,2024-02-01,PLN',
+        ])
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dump.csv')
+            call_command('export_expenses', output=path, end=date(2022, 1, 20), stdout=out)
+            with open(path) as dump:
+                self.assertEqual(len(dump.read().splitlines()), 3)
+
+    def test_unarchive_restores_the_rows_under_their_ids(self):
+        ids = sorted(expense.id for expense in decode_archive(ExpenseArchive.objects.get(year=2022)))
+        Category.objects.filter(user=self.user, name='Bills').delete()
+        call_command('unarchive_years', user=self.user.pk, stdout=StringIO())
+        self.assertFalse(ExpenseArchive.objects.exists())
+        self.assertEqual(sorted(Expense.objects.filter(date__year=2022).values_list('id', flat=True)), ids)
+        self.assertTrue(Expense.objects.get(category='Bills').category_ref_id)
+        self.assertEqual(ExpenseChange.objects.filter(expense_id__in=ids).count(), 3)
+        self.assertEqual(sorted(MonthlyTotal.objects.values_list('month', 'category', 'currency', 'total_minor', 'count')), self.rollup)
+        self.assertEqual(len(self.client.get(reverse('search_expenses'), {'q': 'Item'}).context['expenses']), 4)
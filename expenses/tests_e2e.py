@@ -92,7 +92,7 @@ class ExpenseE2ETest(StaticLiveServerTestCase):
         except TimeoutException:
             raise TimeoutException(f"Text '{expense_category_text}' or '{expense_amount_text}' not found in the body after 10 seconds.")
         
-        self.assertTrue(Expense.objects.filter(title='E2E Test Expense Title', amount=Decimal('123.45')).exists())
+        self.assertTrue(Expense.objects.filter(title='E2E Test Expense Title', amount_minor=12345).exists())
 
 
 
@@ -1,8 +1,29 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('', views.expense_list, name="expense_list"),
     path('add/', views.add_expense, name="add_expense"),
+    path('import/', views.import_expenses, name="import_expenses"),
+    path('export/', views.export_expenses, name="export_expenses"),
+    path('budgets/', views.budgets, name="budgets"),
+    path('budgets/delete/<int:budget_id>/', views.delete_budget, name="delete_budget"),
+    path('recurring/', views.recurring_expenses, name="recurring_expenses"),
+    path('recurring/delete/<int:rule_id>/', views.delete_recurring_expense, name="delete_recurring_expense"),
+    path('summary/', views.summary, name="summary"),
+    path('api/summary/', views.summary_data, name="summary_data"),
+    path('insights/', views.insights, name="insights"),
+    path('api/insights/', views.insights_data, name="insights_data"),
+    path('reports/', views.reports, name="reports"),
+    path('reports/<int:job_id>/download/', views.download_report, name="download_report"),
+    path('api/reports/', views.request_report_job, name="request_report_job"),
+    path('api/reports/<int:job_id>/', views.report_job_status, name="report_job_status"),
+    path('search/', views.search_expenses, name="search_expenses"),
+    path('api/sync/', views.sync_expenses, name="sync_expenses"),
+    path('api/changes/', views.expense_changes, name="expense_changes"),
+    path('api/chart/', views.chart_data, name="chart_data"),
     path('delete/<int:expense_id>/', views.delete_expense, name="delete_expense"),
+    path('async/', async_views.expense_list, name="expense_list_async"),
+    path('async/add/', async_views.add_expense, name="add_expense_async"),
+    path('async/delete/<int:expense_id>/', async_views.delete_expense, name="delete_expense_async"),
 ]
@@ -1,59 +1,461 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Expense
-from .forms import ExpenseForm
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET, require_POST
+from .models import Budget, Expense, MonthlyTotal, RecurringExpense, ReportJob
+from .forms import BudgetForm, ChangesForm, ChartForm, ExpenseForm, ExportForm, ImportForm, RecurringExpenseForm, ReportForm, SearchForm, SummaryForm
+from .rollups import currencies_queryset, data_version, month_start, monthly_rows, monthly_series, years_queryset
+from .cache import cached
+from .archives import archived_category_rows, archived_expenses, archived_page, archived_years
+from .categories import category_rows, category_totals
+from .exporters import CONTENT_TYPES, accepts_gzip, export_stream, user_export_queryset
+from .importers import detect_format, import_expenses as run_import
+from .pagination import keyset_page
+from .search import search_page
+from .summary import multi_year_summary, year_rows_json
+from .analytics import compute_insights
+from .charts import line_chart, stacked_bar_chart
+from .budgets import budget_usage, current_month, pop_new_alerts
+from .recurring import materialize
+from .changes import changes_page
+from .reports import BUILDERS, job_json, request_report
+from .sync import SyncError, apply_batch, parse_batch
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth import logout
-from django.db.models import Sum
-from django.db.models.functions import TruncMonth
-from datetime import datetime
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from datetime import date, datetime, time
+import calendar
+import csv
 import json
-from decimal import Decimal
+
+def year_range(year):
+    # Half-open [Jan 1, next Jan 1) bounds so the (user, date) index can be used
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+def selected_currency(value):
+    # Base currency for totals; anything that is not an ISO-like code falls back to the default
+    value = (value or '').upper()
+    return value if len(value) == 3 and value.isalpha() else settings.EXPENSES_BASE_CURRENCY
+
+def _data_version(request):
+    # Memoized per request: cache keys, ETag and Last-Modified all use it
+    if not hasattr(request, '_data_version'):
+        request._data_version = data_version(request.user.pk)
+    return request._data_version
+
+def budget_alert_messages(request, alerts):
+    for alert in alerts:
+        messages.warning(
+            request,
+            f"You have spent {alert.percent}% of your {alert.budget.category.name} budget for {alert.month:%B %Y}.",
+        )
 
 @login_required
 def add_expense(request):
     if request.method == 'POST':
-        form = ExpenseForm(request.POST)
+        form = ExpenseForm(request.POST, user=request.user)
         if form.is_valid():
             expense = form.save(commit=False)
             expense.user = request.user
             expense.save()
+            budget_alert_messages(request, pop_new_alerts(request.user, month_start(expense.date)))
             return redirect('expense_list')
     else:
         form = ExpenseForm()
     return render(request, 'add.html', {'form': form})
 
-@login_required
-def expense_list(request):
-    selected_year = int(request.GET.get('year', datetime.now().year))
-    expenses = Expense.objects.filter(user=request.user, date__year=selected_year)
-    monthly_totals = expenses.annotate(month=TruncMonth('date')).values('month').annotate(total=Sum('amount')).order_by('month')
-    
-    # Create a list of tuples with all months of the selected year
-    all_months = [(datetime(selected_year, month, 1), 0) for month in range(1, 13)]
-    for total in monthly_totals:
-        for i, (month, _) in enumerate(all_months):
-            if month.month == total['month'].month:
-                all_months[i] = (month, total['total'])
-    
-    years = Expense.objects.filter(user=request.user).dates('date', 'year')
-    
-    # Data for the chart
-    chart_data = {month.strftime('%Y-%m'): 0 for month, _ in all_months}
-    for total in monthly_totals:
-        month_str = total['month'].strftime('%Y-%m')
-        if month_str in chart_data:
-            chart_data[month_str] = float(total['total'])  # Convert Decimal to float
-    
-    return render(request, 'list.html', {
+def list_params(request):
+    """(year, base currency) of an expense list request, or None when year is not a number in 1-9998."""
+    try:
+        selected_year = int(request.GET.get('year', datetime.now().year))
+    except ValueError:
+        return None
+    # year_range() needs the following Jan 1 to be a valid date too
+    if not 1 <= selected_year < 9999:
+        return None
+    return selected_year, selected_currency(request.GET.get('currency'))
+
+def year_chart(user, year, base_currency, by_category, version, rows):
+    """
+    Inline SVG of a year's monthly totals, stacked by category with
+    by_category, cached per data version like the totals it is drawn from.
+    rows are the year's monthly_rows(), only read for the total chart.
+    """
+    start, end = year_range(year)
+    split = 'category' if by_category else 'total'
+
+    def render_chart():
+        if not by_category:
+            _, series, _ = monthly_series(rows, start, end, base_currency)
+            return line_chart(calendar.month_abbr[1:], {'Expenses': series['Total']}, f'Expenses in {year}', base_currency, fill=True)
+        category_rows = cached(
+            user.pk, f'monthly:{start}:{end}:category', lambda: monthly_rows(user, start, end, by_category=True), version,
+        )
+        _, series, _ = monthly_series(category_rows, start, end, base_currency, by_category=True)
+        return stacked_bar_chart(calendar.month_abbr[1:], series, f'Expenses by category in {year}', base_currency)
+
+    return mark_safe(cached(user.pk, f'chart:{year}:{base_currency}:{split}', render_chart, version))
+
+def list_context(selected_year, base_currency, rows, years, category_rows, currencies, page):
+    """Template context of list.html, shared by the sync and async expense list views."""
+    start, end = year_range(selected_year)
+    months, series, missing_rates = monthly_series(rows, start, end, base_currency)
+    monthly_totals = [
+        (datetime(month.year, month.month, 1), total) for month, total in zip(months, series['Total'])
+    ]
+    categories, missing_category_rates = category_totals(category_rows, base_currency)
+    expenses, next_cursor = page
+    return {
         'expenses': expenses,
-        'monthly_totals': all_months,
+        'next_cursor': next_cursor,
+        'monthly_totals': monthly_totals,
         'years': years,
         'selected_year': selected_year,
-        'chart_labels': json.dumps(list(chart_data.keys())),
-        'chart_data': json.dumps(list(chart_data.values()))
+        'base_currency': base_currency,
+        'currencies': sorted(set(currencies) | {base_currency}),
+        'missing_rates': sorted(set(missing_rates) | set(missing_category_rates)),
+        'category_totals': categories,
+    }
+
+@login_required
+def expense_list(request):
+    params = list_params(request)
+    if params is None:
+        return HttpResponseBadRequest('Invalid year.')
+    selected_year, base_currency = params
+    start, end = year_range(selected_year)
+    user = request.user
+    expenses = Expense.objects.filter(user=user, date__gte=start, date__lt=end)
+    # Totals come from the incrementally maintained rollup, cached per data version
+    version = _data_version(request)
+    rows = cached(user.pk, f'monthly:{start}:{end}:total', lambda: monthly_rows(user, start, end), version)
+    years = cached(user.pk, 'years', lambda: list(years_queryset(user)), version)
+    categories = cached(
+        user.pk, f'categories:{start}:{end}',
+        lambda: category_rows(user, start, end) + archived_category_rows(user, start, end), version,
+    )
+    currencies = cached(user.pk, 'currencies', lambda: list(currencies_queryset(user)), version)
+    month = current_month()
+    budgets = cached(user.pk, f'budgets:{month}', lambda: budget_usage(user, month), version)
+    # An archived year is listed from its archive plus anything added to it since
+    archived = cached(user.pk, 'archived_years', lambda: archived_years(user.pk), version)
+    after = request.GET.get('after')
+    extra = archived_page(user.pk, selected_year, after, settings.EXPENSES_PAGE_SIZE) if selected_year in archived else None
+    page = keyset_page(expenses, after, settings.EXPENSES_PAGE_SIZE, extra)
+
+    context = list_context(selected_year, base_currency, rows, years, categories, currencies, page)
+    context['is_first_page'] = not request.GET.get('after')
+    context['budgets'] = budgets
+    context['budget_month'] = month
+    context['by_category'] = request.GET.get('chart') == 'category'
+    context['chart'] = year_chart(user, selected_year, base_currency, context['by_category'], version, rows)
+    return render(request, 'list.html', context)
+
+def chart_data_etag(request):
+    return f'{request.user.pk}-{_data_version(request)[0]}'
+
+def chart_data_last_modified(request):
+    return _data_version(request)[1]
+
+def insights_etag(request):
+    # The forecast and rolling windows move on with the month, not only with the data
+    return f'{chart_data_etag(request)}-{date.today():%Y-%m}'
+
+def insights_last_modified(request):
+    updated_at = _data_version(request)[1]
+    month = timezone.make_aware(datetime.combine(date.today().replace(day=1), time.min))
+    return max(updated_at, month) if updated_at else month
+
+@login_required
+@cache_control(private=True, max_age=0)
+@condition(etag_func=chart_data_etag, last_modified_func=chart_data_last_modified)
+def chart_data(request):
+    form = ChartForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    start, end = form.date_range()
+    split = form.cleaned_data['split'] or 'total'
+    base_currency = selected_currency(form.cleaned_data['currency'])
+    rows = cached(
+        request.user.pk, f'monthly:{start}:{end}:{split}',
+        lambda: monthly_rows(request.user, start, end, by_category=split == 'category'),
+        _data_version(request),
+    )
+    months, series, missing_rates = monthly_series(rows, start, end, base_currency, by_category=split == 'category')
+    return JsonResponse({
+        'labels': [month.strftime('%Y-%m') for month in months],
+        'currency': base_currency,
+        'series': [{'label': label, 'data': [float(total) for total in totals]} for label, totals in series.items()],
+        'missing_rates': missing_rates,
     })
 
+def summary_params(request, form):
+    """(currency, years, totals, categories, missing) of the multi-year summary for a valid SummaryForm."""
+    user = request.user
+    version = _data_version(request)
+    data_years = cached(user.pk, 'years', lambda: list(years_queryset(user)), version)
+    first_year, last_year = form.year_range([day.year for day in data_years])
+    start, end = date(first_year, 1, 1), date(last_year + 1, 1, 1)
+    split = form.cleaned_data['split'] or 'total'
+    # The whole range comes from a single grouped query over the monthly rollup
+    rows = cached(
+        user.pk, f'monthly:{start}:{end}:{split}',
+        lambda: monthly_rows(user, start, end, by_category=split == 'category'),
+        version,
+    )
+    base_currency = selected_currency(form.cleaned_data['currency'])
+    return (base_currency, *multi_year_summary(rows, first_year, last_year, base_currency, by_category=split == 'category'))
+
+@login_required
+def summary(request):
+    form = SummaryForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+    base_currency, years, totals, categories, missing_rates = summary_params(request, form)
+    chart = cached(
+        request.user.pk, f'chart:summary:{years[0]}:{years[-1]}:{base_currency}',
+        lambda: line_chart(
+            calendar.month_abbr[1:], {str(row['year']): row['running'] for row in totals},
+            'Spending so far in each year', base_currency,
+        ),
+        _data_version(request),
+    )
+    return render(request, 'summary.html', {
+        'form': form,
+        'chart': mark_safe(chart),
+        'base_currency': base_currency,
+        'years': years,
+        'month_names': calendar.month_abbr[1:],
+        'totals': totals,
+        'categories': categories,
+        'missing_rates': missing_rates,
+    })
+
+@login_required
+@cache_control(private=True, max_age=0)
+@condition(etag_func=chart_data_etag, last_modified_func=chart_data_last_modified)
+def summary_data(request):
+    form = SummaryForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    base_currency, years, totals, categories, missing_rates = summary_params(request, form)
+    return JsonResponse({
+        'currency': base_currency,
+        'years': years,
+        'labels': calendar.month_abbr[1:],
+        'totals': year_rows_json(totals),
+        'categories': {name: year_rows_json(rows) for name, rows in categories.items()},
+        'missing_rates': missing_rates,
+    })
+
+def insights_for(request):
+    base_currency = selected_currency(request.GET.get('currency'))
+    today = date.today()
+    # The forecast depends on the current month, so it is part of the key
+    return cached(
+        request.user.pk, f'insights:{base_currency}:{today:%Y-%m}',
+        lambda: compute_insights(request.user, base_currency, today),
+        _data_version(request),
+    )
+
+@login_required
+def insights(request):
+    data = insights_for(request)
+    return render(request, 'insights.html', {
+        'insights': data,
+        'recent_months': list(zip(data['months'], data['totals'], data['rolling_3'], data['rolling_12'])),
+    })
+
+@login_required
+@cache_control(private=True, max_age=0)
+@condition(etag_func=insights_etag, last_modified_func=insights_last_modified)
+def insights_data(request):
+    return JsonResponse(insights_for(request))
+
+@login_required
+@require_POST
+def sync_expenses(request):
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'errors': {'batch': ['Invalid JSON.']}}, status=400)
+    try:
+        upserts, deletes = parse_batch(payload)
+        result = apply_batch(request.user, upserts, deletes)
+    except SyncError as exc:
+        return JsonResponse({'errors': exc.errors}, status=400)
+    return JsonResponse(result)
+
+@login_required
+@require_GET
+def expense_changes(request):
+    form = ChangesForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    changes, cursor, more = changes_page(request.user, form.cleaned_data['since'], form.cleaned_data['limit'])
+    return JsonResponse({'changes': changes, 'cursor': cursor, 'more': more})
+
+@login_required
+def reports(request):
+    if request.method == 'POST':
+        form = ReportForm(request.POST)
+        if form.is_valid():
+            job = request_report(request.user, form.cleaned_data['report'])
+            if job.status == ReportJob.DONE:
+                messages.info(request, f'{job.get_report_display()} is up to date with your expenses.')
+            else:
+                messages.success(request, f'{job.get_report_display()} is being prepared.')
+            return redirect('reports')
+    else:
+        form = ReportForm()
+    jobs = list(ReportJob.objects.filter(user=request.user).order_by('-id')[:20])
+    return render(request, 'reports.html', {
+        'form': form,
+        'jobs': jobs,
+        # The page reloads itself until every job has finished
+        'pending': any(not job.finished for job in jobs),
+    })
+
+@login_required
+@require_POST
+def request_report_job(request):
+    form = ReportForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    job = request_report(request.user, form.cleaned_data['report'])
+    data = job_json(job)
+    response = JsonResponse(data, status=200 if job.finished else 202)
+    response['Location'] = data['status_url']
+    return response
+
+@login_required
+@require_GET
+def report_job_status(request, job_id):
+    return JsonResponse(job_json(get_object_or_404(ReportJob, id=job_id, user=request.user)))
+
+@login_required
+@require_GET
+def download_report(request, job_id):
+    job = get_object_or_404(ReportJob, id=job_id, user=request.user)
+    if job.status != ReportJob.DONE:
+        raise Http404('The report is not ready.')
+    return FileResponse(job.result.open('rb'), as_attachment=True, filename=f'{job.report}.{BUILDERS[job.report][1]}')
+
+@login_required
+def import_expenses(request):
+    result = None
+    if request.method == 'POST':
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            uploaded = form.cleaned_data['file']
+            file_format = form.cleaned_data['format'] or detect_format(uploaded.name)
+            try:
+                result = run_import(request.user, uploaded.file, file_format, settings.EXPENSES_IMPORT_BATCH_SIZE)
+            except (UnicodeDecodeError, csv.Error) as exc:
+                form.add_error('file', f"Could not read file: {exc}")
+            else:
+                messages.success(
+                    request,
+                    f"Imported {result.created} expenses in {result.elapsed:.2f}s "
+                    f"({result.rows_per_second:.0f} rows/s), {len(result.errors)} rows rejected.",
+                )
+    else:
+        form = ImportForm()
+    return render(request, 'import.html', {
+        'form': form,
+        'result': result,
+        'errors': result.errors[:100] if result else [],
+    })
+
+@login_required
+def export_expenses(request):
+    form = ExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+    file_format = form.cleaned_data.pop('format')
+    queryset = user_export_queryset(request.user, **form.cleaned_data)
+    archived = archived_expenses([request.user.pk], **form.cleaned_data)
+    compress = accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    response = StreamingHttpResponse(
+        export_stream(queryset, file_format, settings.EXPENSES_EXPORT_CHUNK_SIZE, compress=compress, archived=archived),
+        content_type=CONTENT_TYPES[file_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="expenses.{file_format}"'
+    response['Vary'] = 'Accept-Encoding'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+@login_required
+def search_expenses(request):
+    form = SearchForm(request.GET)
+    query = form.cleaned_data['q'] if form.is_valid() else ''
+    expenses, next_cursor, ranked = search_page(request.user, query, request.GET.get('after'), settings.EXPENSES_PAGE_SIZE)
+    return render(request, 'search.html', {
+        'form': form,
+        'query': query,
+        'expenses': expenses,
+        'next_cursor': next_cursor,
+        'ranked': ranked,
+        'is_first_page': not request.GET.get('after'),
+    })
+
+@login_required
+def budgets(request):
+    if request.method == 'POST':
+        form = BudgetForm(request.POST, user=request.user)
+        if form.is_valid():
+            budget = form.save()
+            messages.success(request, f'Budget for {budget.category.name} saved.')
+            budget_alert_messages(request, pop_new_alerts(request.user, current_month()))
+            return redirect('budgets')
+    else:
+        form = BudgetForm()
+    month = current_month()
+    return render(request, 'budgets.html', {
+        'form': form,
+        'budgets': budget_usage(request.user, month),
+        'budget_month': month,
+    })
+
+@login_required
+def delete_budget(request, budget_id):
+    budget = get_object_or_404(Budget, id=budget_id, user=request.user)
+    if request.method == 'POST':
+        budget.delete()
+        messages.success(request, 'Budget deleted successfully.')
+    return redirect('budgets')
+
+@login_required
+def recurring_expenses(request):
+    if request.method == 'POST':
+        form = RecurringExpenseForm(request.POST, user=request.user)
+        if form.is_valid():
+            rule = form.save()
+            # Catch up occurrences up to today right away; later ones come from materialize_recurring
+            _, created = materialize(date.today(), rules=RecurringExpense.objects.filter(pk=rule.pk))
+            messages.success(request, f'Recurring expense saved, {created} expense(s) added.')
+            budget_alert_messages(request, pop_new_alerts(request.user, current_month()))
+            return redirect('recurring_expenses')
+    else:
+        form = RecurringExpenseForm()
+    return render(request, 'recurring.html', {
+        'form': form,
+        'rules': RecurringExpense.objects.filter(user=request.user).order_by('title', 'pk'),
+    })
+
+@login_required
+def delete_recurring_expense(request, rule_id):
+    rule = get_object_or_404(RecurringExpense, id=rule_id, user=request.user)
+    if request.method == 'POST':
+        # Expenses already generated stay; they only lose the link to the rule
+        rule.delete()
+        messages.success(request, 'Recurring expense deleted successfully.')
+    return redirect('recurring_expenses')
+
 @login_required
 def delete_expense(request, expense_id):
     expense = get_object_or_404(Expense, id=expense_id, user=request.user)